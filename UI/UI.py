@@ -1,12 +1,33 @@
+import functools
+import os
 import sys
+import time
+from startup import ModelLoader, StartupReport
+
+# Started before the other imports, so that the report includes them
+STARTUP = StartupReport()
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
 from PyQt5.QtMultimediaWidgets import QVideoWidget
-from PyQt5.QtCore import Qt, QUrl, QTimer, QSize
+from PyQt5.QtCore import Qt, QUrl, QSize, QObject, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QTextEdit, \
     QFileDialog, QLabel, QStackedWidget, QGroupBox
 from PyQt5.QtGui import QPixmap, QImage, QFont
-from ultralytics import YOLO
-from Detection import detect_video, detect_image
+
+# The detection stack (OpenCV, NumPy, the modes and pipelines) is imported by the model loader thread, after the
+# window shows up
+STARTUP.add('imports', STARTUP.elapsed())
+MODEL_PATH = 'runs/detect/yolov8m.pt_train_120_epochs/weights/best.pt'
+DETECTION_MODULES = ('cv2', 'numpy', 'Detection', 'detection_cache', 'backends')
+
+
+class LoaderSignals(QObject):
+    """Qt signal relaying the state of a startup.ModelLoader from its thread to the GUI thread."""
+    state_changed = pyqtSignal(str)
+
+
+def load_model(backend, int8):
+    from backends import load_detector
+    return load_detector(MODEL_PATH, backend, int8)
 
 
 class FinalTermProjectApp(QMainWindow):
@@ -18,20 +39,59 @@ class FinalTermProjectApp(QMainWindow):
         self.top = 10
         self.width = 1920
         self.height = 1080
-        self.initUI()
+
+        # Inference backend: 'torch', or 'onnx' / 'openvino' (optionally INT8) on CPU-only machines
+        self.backend = 'torch'
+        self.int8 = False
+        # The model is loaded and warmed up in the background while the window is built
+        self.model = None
+        self.loader_signals = LoaderSignals()
+        self.loader_signals.state_changed.connect(self.model_state_changed)
+        self.model_loader = ModelLoader(functools.partial(load_model, self.backend, self.int8),
+                                        imports=DETECTION_MODULES + ('ultralytics',), report=STARTUP,
+                                        on_state=self.loader_signals.state_changed.emit).start()
+        self.detect_started = None
+
+        with STARTUP.phase('window'):
+            self.initUI()
 
         font = QFont('San Francisco', 12)
         self.setFont(font)
 
-        #
-        self.model = YOLO('runs/detect/yolov8m.pt_train_120_epochs/weights/best.pt')
         self.image_path = None
         self.video_path = None
+        self.video_paths = []  # Several videos are monitored together in a grid
         self.mode = 'Normal'
 
-        # Timer for video processing
-        self.timer = QTimer(self)
-        self.cap = None
+        # Background pipeline for video processing
+        self.pipeline = None
+        self.inference_stride = 1  # Run the detector every N frames, boxes are carried forward in between
+        self.tiling = False  # Look for small PPE (gloves, glasses, dust masks) in high-resolution person crops
+        self.motion_gate = False  # Skip the detector while the scene of a fixed camera does not change
+        self.decoder = 'opencv'  # Video decoder, 'pyav' decodes on several threads (pip install av)
+        self.decode_size = None  # Longest side of the decoded frames, e.g. 1280 to scale 4K videos at decode time
+        # Sends the persons without helmet nor vest out of the application, e.g.
+        # AlertDispatcher([WebhookSink('http://alerts.local/ppe'), SpoolSink('alerts')]), see alerts.py
+        self.alerts = None
+        # Regions of interest of the camera, see zones.example.yaml, read on the first detection
+        self.zones_path = 'zones.yaml'
+        self.zones = None
+        # Per-stage timings of the video runs: written on the frames with profile_overlay, and served on
+        # http://127.0.0.1:<metrics_port>/metrics (Prometheus) and /stats (JSON) when metrics_port is set
+        self.profiler = None
+        self.profile_overlay = False
+        self.metrics_port = None
+        self.metrics_server = None
+        # Annotated frames of the running video(s) streamed to browsers on http://127.0.0.1:<live_port>/ when set
+        self.live_port = None
+        self.live_server = None
+        # Detections of the images and videos already seen by the model, replayed when the mode changes: stored in
+        # detection_cache_dir when set (e.g. '.detection_cache'), at most detection_cache_size MB
+        self.detection_cache_dir = None
+        self.detection_cache_size = 512
+        self.detection_cache = None
+        self.model_key = None
+        self.services_started = False
 
     def initUI(self):
         self.setWindowTitle(self.title)
@@ -230,8 +290,18 @@ class FinalTermProjectApp(QMainWindow):
         self.control_panel.addWidget(result_group)
 
     def browse_files(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select File", "",
-                                                   "Image Files (*.png *.jpg *.jpeg *.bmp);;Video Files (*.mp4 *.avi *.mov);;All Files (*)")
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select File", "",
+                                                     "Image Files (*.png *.jpg *.jpeg *.bmp);;Video Files (*.mp4 *.avi *.mov);;All Files (*)")
+        video_paths = [path for path in file_paths if path.lower().endswith(('.mp4', '.avi', '.mov'))]
+        if len(video_paths) > 1:  # Several videos, monitored together
+            self.result_text.clear()
+            self.result_text.append(f'Complete import {len(video_paths)} videos')
+            self.video_paths = video_paths
+            self.video_path = None
+            self.image_path = None
+            return
+        self.video_paths = []
+        file_path = file_paths[0] if file_paths else None
 
         if file_path:  # Check if a file was selected
             if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):  # If the file is an image
@@ -263,6 +333,7 @@ class FinalTermProjectApp(QMainWindow):
             self.result_text.append("No file selected.")
 
     def refresh_ui(self):
+        self.stop_pipeline()  # stop the running detection, its result files are flushed
         self.result_text.clear()  # clear result text
         self.image_area.clear()  # clear image 
         self.video_output_label.clear()  # clear video
@@ -279,21 +350,103 @@ class FinalTermProjectApp(QMainWindow):
     def start_detect(self):
         self.result_text.append("Starting detect...")
         #self.select_mode(self.normal_button, "Normal")  # Activate Normal mode by default
+        if self.model is None:
+            self.result_text.append(f"The model is {self.model_loader.state}, please start again when it is ready.")
+            return
+        self.detect_started = time.perf_counter()
+        self.start_services()
+        from Detection import detect_video, detect_image, detect_multi
+        from detection_cache import CachedDetector, source_key
         if self.image_path is not None:
-            detect_image(self.model, self.image_path, self.image_area, self.result_text)
+            detect_image(CachedDetector(self.model, self.detection_cache, self.model_key), self.image_path,
+                         self.image_area, self.result_text)
+            self.first_frame_shown()
+        elif self.video_paths:
+            self.stop_pipeline()
+            self.pipeline = detect_multi(self.model, self.video_paths, self.mode, self.result_text,
+                                         self.video_output_label, self.stacked_widget, on_stats=self.show_stats,
+                                         on_first_frame=self.first_frame_shown, live=self.live_server)
         elif self.video_path is not None:
-            detect_video(self.model,self.video_path, self.mode, self.timer, self.result_text, self.video_output_label, self.stacked_widget)
+            self.stop_pipeline()
+            self.pipeline = detect_video(self.model, self.video_path, self.mode, self.result_text,
+                                         self.video_output_label, self.stacked_widget,
+                                         inference_stride=self.inference_stride, zones=self.zones,
+                                         tiling=self.tiling, motion_gate=self.motion_gate, profiler=self.profiler,
+                                         overlay=self.profile_overlay, on_stats=self.show_stats,
+                                         on_first_frame=self.first_frame_shown, cache=self.detection_cache,
+                                         source_key=source_key(self.model_key, self.video_path, self.decode_size),
+                                         decoder=self.decoder, decode_size=self.decode_size, alerts=self.alerts,
+                                         live=self.live_server)
+
+    def start_services(self):
+        # Zones, profiler, cache and servers of the detections, once the detection stack is imported
+        if self.services_started:
+            return
+        from profiling import FrameProfiler, MetricsServer
+        from zones import load_zones
+        self.zones = load_zones(self.zones_path) if os.path.exists(self.zones_path) else None
+        self.profiler = FrameProfiler()
+        if self.metrics_port:
+            self.metrics_server = MetricsServer(self.profiler, port=self.metrics_port).start()
+        if self.live_port:
+            from streaming import MJPEGServer
+            self.live_server = MJPEGServer(port=self.live_port).start()
+        if self.detection_cache_dir:
+            from detection_cache import DetectionCache
+            self.detection_cache = DetectionCache(self.detection_cache_dir, self.detection_cache_size << 20)
+        self.services_started = True
+
+    def model_state_changed(self, state):
+        # Progress of the background model loading
+        if state == 'ready':
+            from detection_cache import model_key
+            self.model = self.model_loader.model
+            self.model_key = model_key(MODEL_PATH, self.backend, self.int8)
+            STARTUP.add('model_ready', STARTUP.elapsed())
+            self.statusBar().showMessage(f'Model ready ({self.backend}). Startup: {STARTUP}')
+        elif state == 'failed':
+            self.statusBar().showMessage('Model loading failed')
+            self.result_text.append(f'The model could not be loaded: {self.model_loader.error}')
+        else:
+            self.statusBar().showMessage(f'Model {state}...')
+
+    def first_frame_shown(self):
+        # Startup report, once the first detection of the session is displayed
+        if 'first_frame' not in STARTUP.phases:
+            STARTUP.add('first_frame', time.perf_counter() - self.detect_started)
+            self.statusBar().showMessage(f'Startup: {STARTUP}')
 
     def stop_detect(self):
         self.result_text.append("Stopping detect...")
-        # Dừng timer hoặc thread đang chạy phát hiện
-        if self.timer.isActive():
-            self.timer.stop()  # Giả sử đang dùng QTimer để handle loop
-        elif hasattr(self, 'detection_thread') and self.detection_thread.is_alive():
-            self.detection_thread.stop()  # Giả sử có thread chạy phát hiện
+        # Dừng pipeline đang chạy phát hiện
+        self.stop_pipeline()
 
         self.result_text.append("Detection has been paused.")
 
+    def stop_pipeline(self):
+        # Joins the pipeline threads, the mode closes its result file, alerts and cache entry
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+    def closeEvent(self, event):
+        # The pipeline threads are daemons, stop them before the application exits so that their results are kept
+        self.stop_pipeline()
+        if self.alerts is not None:
+            self.alerts.close()
+        for server in (self.metrics_server, self.live_server):
+            if server is not None:
+                server.stop()
+        super().closeEvent(event)
+
+    def show_stats(self, stats):
+        # Per-stage FPS, queue depth and dropped or skipped frames of the video pipeline
+        self.statusBar().showMessage('    '.join(
+            f"{stage}: {values['fps']:.1f} FPS, {values['busy_ms']:.1f} ms" +
+            ''.join(f", {key} {values[key]}" for key in ('queue', 'dropped', 'skipped', 'gated', 'replayed')
+                    if key in values)
+            for stage, values in stats.items()))
+
 
     def select_mode(self, button, mode):
         for btn in [self.normal_button, self.inspection_button, self.tracking_button, self.detect_button]:
@@ -304,10 +457,8 @@ class FinalTermProjectApp(QMainWindow):
         self.result_text.append(f"Mode {mode} is turned on.")
         self.mode = mode
 
-        # Disconnect and reconnect the timer
-        self.timer.stop()
-        self.timer.timeout.disconnect()
-        print('Mode: ', self.mode)
+        # Stop the pipeline of the previous mode
+        self.stop_pipeline()
 
     def play_video(self):
         self.result_text.append("Playing video...")
@@ -338,4 +489,6 @@ if __name__ == '__main__':
     app = QApplication(sys.argv)
     ex = FinalTermProjectApp()
     ex.show()
+    # Reported once the event loop runs, the window is then on screen
+    QTimer.singleShot(0, lambda: STARTUP.add('window_shown', STARTUP.elapsed()))
     sys.exit(app.exec_())
@@ -0,0 +1,362 @@
+"""
+Alerts on the persons without safety vest nor helmet (the "ALERT !!!" of Show_Status_and_Alert), sent out of the
+process by an asyncio event loop running in a background thread:
+
+- the inference thread only checks the cooldowns and copies the snapshot crop (AlertDispatcher.check)
+- the loop batches the alerts, rate-limits the notifications, encodes the JPEG snapshots in a worker thread and
+  delivers every batch to the sinks (WebhookSink, MQTTSink, SpoolSink) concurrently, retrying the failed deliveries
+
+Alerts that do not fit in the queue are dropped and counted, the inference loop never waits for the network.
+"""
+import asyncio
+import base64
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+import cv2 as cv
+import numpy as np
+
+REASON = 'no helmet nor safety vest'
+
+logger = logging.getLogger(__name__)
+
+
+def alert_json(alert):
+    """JSON text of an alert, the JPEG snapshot in base64."""
+    snapshot = alert.get('snapshot')
+    return json.dumps({**{key: value for key, value in alert.items() if key != 'snapshot'},
+                       'snapshot_jpeg': base64.b64encode(snapshot).decode() if snapshot else None})
+
+
+class WebhookSink:
+    """
+    POST every batch to `url` as JSON {"alerts": [...]}, the snapshots in base64 (snapshot_jpeg).
+    Parameters:
+        - url (str): webhook endpoint
+        - headers (dict): extra HTTP headers (authorization)
+        - timeout (float): seconds before a request fails
+    """
+
+    def __init__(self, url, headers=None, timeout=5.0):
+        self.url = url
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+        self.timeout = timeout
+
+    def _post(self, body):
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    async def send(self, alerts):
+        body = ('{"alerts": [' + ', '.join(alert_json(alert) for alert in alerts) + ']}').encode()
+        await asyncio.get_running_loop().run_in_executor(None, self._post, body)
+
+    def close(self):
+        pass
+
+
+class MQTTSink:
+    """
+    Publish every alert as JSON on '<topic>/<camera>' with paho-mqtt. The connection is opened on the first batch
+    and kept, paho reconnects it when the broker goes away.
+    Parameters:
+        - host (str), port (int): MQTT broker
+        - topic (str): topic prefix
+        - qos (int): MQTT quality of service
+        - username (str), password (str): broker credentials
+    """
+
+    def __init__(self, host, port=1883, topic='ppe/alerts', qos=1, username=None, password=None, timeout=5.0):
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError as error:
+            raise ImportError('The MQTT alert sink requires paho-mqtt: pip install paho-mqtt') from error
+        # paho-mqtt 2 asks for the version of the callbacks
+        version = getattr(mqtt, 'CallbackAPIVersion', None)
+        self.client = mqtt.Client(version.VERSION2) if version is not None else mqtt.Client()
+        if username:
+            self.client.username_pw_set(username, password)
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.qos = qos
+        self.timeout = timeout
+        self.connected = False
+
+    def _publish(self, alerts):
+        if not self.connected:
+            self.client.connect(self.host, self.port)
+            self.client.loop_start()
+            self.connected = True
+        messages = [self.client.publish(f"{self.topic}/{alert['camera']}", alert_json(alert), qos=self.qos)
+                    for alert in alerts]
+        for message in messages:
+            message.wait_for_publish(self.timeout)
+            if not message.is_published():
+                raise IOError(f'MQTT publish to {self.host}:{self.port} failed')
+
+    async def send(self, alerts):
+        await asyncio.get_running_loop().run_in_executor(None, self._publish, alerts)
+
+    def close(self):
+        if self.connected:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.connected = False
+
+
+class SpoolSink:
+    """
+    Local file spool: every alert is written to `directory` as '<camera>_<time in microseconds>_<n>.json' with its
+    snapshot next to it ('.jpg'), for another process to pick up. The JSON file is renamed into place last, so a
+    reader never sees a partial alert.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, alerts):
+        for alert in alerts:
+            self.count += 1
+            moment = datetime.datetime.fromtimestamp(alert['timestamp']).strftime('%Y%m%d-%H%M%S-%f')
+            stem = os.path.join(self.directory, f"{alert['camera']}_{moment}_{self.count}")
+            snapshot = alert.get('snapshot')
+            record = {key: value for key, value in alert.items() if key != 'snapshot'}
+            if snapshot:
+                with open(f'{stem}.jpg', 'wb') as file:
+                    file.write(snapshot)
+                record['snapshot'] = os.path.basename(f'{stem}.jpg')
+            with open(f'{stem}.json.tmp', 'w') as file:
+                json.dump(record, file)
+            os.replace(f'{stem}.json.tmp', f'{stem}.json')
+
+    async def send(self, alerts):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, alerts)
+
+    def close(self):
+        pass
+
+
+class AlertDispatcher:
+    """
+    Deduplicated, rate-limited and batched delivery of the alerts to `sinks`, on an asyncio event loop in a
+    background thread.
+    A person alerts once per `cooldown` seconds: a tracked person is identified by its track and zone, the untracked
+    persons (Detect mode) by their zone only. Batches hold up to `batch_size` alerts gathered for at most
+    `batch_interval` seconds, and at most `rate` batches are sent per minute (token bucket): the alerts arriving
+    meanwhile wait in the queue and go in the next batch.
+    Parameters:
+        - sinks (list): objects with `async send(alerts)` and `close()` (WebhookSink, MQTTSink, SpoolSink)
+        - zones (list): Zone objects of the camera, a person belongs to the zones containing the bottom centre of its
+    box, the persons outside every zone do not alert. Without zones every person is in the zone 'all'
+        - camera (str): camera name of the alerts
+        - cooldown (float): seconds before the same person (or zone) alerts again
+        - rate (float): maximum batches per minute, 0 for no limit
+        - batch_size (int), batch_interval (float): see above
+        - queue_size (int): alerts waiting for delivery, the next ones are dropped
+        - snapshot_size (int): longest side of the JPEG snapshots, 0 for no snapshot
+        - jpeg_quality (int): JPEG quality of the snapshots
+        - margin (float): margin around the person box in the snapshot, relative to the box size
+        - retries (int): new attempts of a failed delivery, one second apart then doubling
+        - clock (callable): time of the current frame in seconds
+    """
+
+    def __init__(self, sinks, zones=None, camera='default', cooldown=60.0, rate=6, batch_size=20,
+                 batch_interval=2.0, queue_size=256, snapshot_size=320, jpeg_quality=80, margin=0.2, retries=2,
+                 clock=time.time):
+        self.sinks = list(sinks)
+        self.zones = zones or []
+        self.zone_names = [zone.name for zone in self.zones] or ['all']
+        self.camera = camera
+        self.cooldown = cooldown
+        self.rate = rate
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue_size = queue_size
+        self.snapshot_size = snapshot_size
+        self.jpeg_quality = jpeg_quality
+        self.margin = margin
+        self.retries = retries
+        self.clock = clock
+        # {(zone, track id or None): time of the last alert}, only used by the calling thread
+        self.last_alert = {}
+        self.counters = dict.fromkeys(['alerts', 'suppressed', 'dropped', 'batches', 'sent', 'failed', 'errors'], 0)
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.queue = None
+        self.task = None
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def check(self, frame, association, timestamp=None):
+        """
+        Alert on the persons of `association` (PPEAssociation, tracked or not) wearing neither safety vest nor
+        helmet. Call it before the annotations are drawn on `frame`, the snapshots are cropped from it.
+        Returns:
+            - int: number of alerts queued
+        """
+        normal = ~(association.column('Safety Vest') | association.column('Helmet'))
+        if not normal.any():
+            return 0
+        timestamp = self.clock() if timestamp is None else timestamp
+        boxes = np.asarray(association.person_boxes, dtype=np.float64).reshape(-1, 4)
+        track_ids = getattr(association, 'track_ids', None)
+        if self.zones:
+            feet = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1)
+            masks = [zone.contains(feet, (frame.shape[1], frame.shape[0])) for zone in self.zones]
+        else:
+            masks = [np.ones(len(boxes), dtype=bool)]
+        queued = 0
+        for zone, mask in zip(self.zone_names, masks):
+            for index in np.flatnonzero(normal & mask):
+                track_id = None if track_ids is None else int(track_ids[index])
+                key = (zone, track_id)
+                if timestamp - self.last_alert.get(key, -np.inf) < self.cooldown:
+                    self.counters['suppressed'] += 1
+                    continue
+                self.last_alert[key] = timestamp
+                queued += self._submit(self._alert(frame, boxes[index], zone, track_id, timestamp))
+        if len(self.last_alert) > 4096:
+            # Forget the persons whose cooldown is over
+            self.last_alert = {key: last for key, last in self.last_alert.items()
+                               if timestamp - last < self.cooldown}
+        return queued
+
+    def _alert(self, frame, box, zone, track_id, timestamp):
+        x1, y1, x2, y2 = box
+        dx, dy = (x2 - x1) * self.margin, (y2 - y1) * self.margin
+        height, width = frame.shape[:2]
+        x1, y1 = int(max(x1 - dx, 0)), int(max(y1 - dy, 0))
+        x2, y2 = int(min(x2 + dx, width)), int(min(y2 + dy, height))
+        # The frame is annotated and reused once the mode returns, the crop is copied
+        crop = frame[y1:y2, x1:x2].copy() if self.snapshot_size and x2 > x1 and y2 > y1 else None
+        return {'time': datetime.datetime.fromtimestamp(timestamp).isoformat(timespec='seconds'),
+                'timestamp': timestamp, 'camera': self.camera, 'zone': zone, 'track_id': track_id,
+                'box': [int(value) for value in box], 'reason': REASON, 'snapshot': crop}
+
+    def _submit(self, alert):
+        with self.lock:
+            if self.pending >= self.queue_size:
+                self.counters['dropped'] += 1
+                return 0
+            self.pending += 1
+            self.counters['alerts'] += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, alert)
+        return 1
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.closing = asyncio.Event()
+        self.task = self.loop.create_task(self._dispatch())
+        self.started.set()
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # The sink calls still running in the executor end before the thread, and so before the sinks close
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+            self.loop.close()
+
+    async def _dispatch(self):
+        tokens, refilled = max(self.rate, 1), self.loop.time()
+        closing = False
+        while not closing:
+            alert = await self.queue.get()
+            if alert is None:
+                break
+            if self.rate:
+                tokens = min(self.rate, tokens + (self.loop.time() - refilled) * self.rate / 60)
+                refilled = self.loop.time()
+                if tokens < 1:
+                    # Wait for the next token, the queued alerts are flushed right away on close()
+                    try:
+                        await asyncio.wait_for(self.closing.wait(), (1 - tokens) * 60 / self.rate)
+                    except asyncio.TimeoutError:
+                        pass
+                    tokens, refilled = 1, self.loop.time()
+                tokens -= 1
+            batch = [alert]
+            deadline = self.loop.time() + self.batch_interval
+            while len(batch) < self.batch_size:
+                try:
+                    alert = self.queue.get_nowait() if not self.queue.empty() else \
+                        await asyncio.wait_for(self.queue.get(), max(deadline - self.loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if alert is None:
+                    closing = True
+                    break
+                batch.append(alert)
+            with self.lock:
+                self.pending -= len(batch)
+            await self._deliver(batch)
+
+    def _encode(self, batch):
+        alerts = []
+        for alert in batch:
+            crop = alert['snapshot']
+            if crop is not None:
+                scale = self.snapshot_size / max(crop.shape[:2])
+                if scale < 1:
+                    crop = cv.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                                     interpolation=cv.INTER_AREA)
+                crop = cv.imencode('.jpg', crop, [cv.IMWRITE_JPEG_QUALITY, self.jpeg_quality])[1].tobytes()
+            alerts.append({**alert, 'snapshot': crop})
+        return alerts
+
+    async def _deliver(self, batch):
+        alerts = await self.loop.run_in_executor(None, self._encode, batch)
+        self.counters['batches'] += 1
+        await asyncio.gather(*(self._send(sink, alerts) for sink in self.sinks))
+
+    async def _send(self, sink, alerts):
+        for attempt in range(self.retries + 1):
+            try:
+                await sink.send(alerts)
+                self.counters['sent'] += len(alerts)
+                return
+            except Exception as error:
+                self.counters['errors'] += 1
+                if attempt == self.retries:
+                    logger.warning('Alert delivery to %s failed: %s', type(sink).__name__, error)
+                    self.counters['failed'] += len(alerts)
+                    return
+                await asyncio.sleep(2 ** attempt)
+
+    def stats(self):
+        """
+        Alerts queued, suppressed by the cooldown, dropped (queue full), batches, alerts sent and failed, and failed
+        delivery attempts ('errors', retries included).
+        """
+        return dict(self.counters)
+
+    def close(self, timeout=10.0):
+        """
+        Deliver the queued alerts (for at most `timeout` seconds), then stop the loop and close the sinks. A delivery
+        still running after `timeout` is cancelled, the sinks are only closed once the loop thread has exited.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.closing.set)
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.loop.call_soon_threadsafe(self.task.cancel)
+                self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning('Alert delivery still running after %.0f s, the alert sinks are left open', 2 * timeout)
+                return
+        self.thread = None
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,174 @@
+import numpy as np
+
+CLASSES_NAMES = ['boots', 'dust mask', 'glass', 'gloves', 'helmet', 'person', 'safety vest']
+PERSON_CLASS = 5
+PPE_CLASSES = [1, 2, 3, 4, 6]  # Classes reported in the PPE status of a person
+
+# Vertical band of the person box, as (top, bottom) fractions of its height, in which the centre of a PPE box must
+# lie to be counted for that person. Classes without a rule only need to overlap the person box.
+BODY_REGION_RULES = {
+    0: (0.8, 1.0),  # boots: bottom fifth
+    1: (0.0, 1 / 3),  # dust mask: top third
+    2: (0.0, 1 / 3),  # glass: top third
+    4: (0.0, 1 / 3),  # helmet: top third
+}
+
+
+class PPEAssociation:
+    """
+    Array-backed result of associating PPE detections to persons.
+    Attributes:
+        - person_boxes (np.array): (N, 4) xyxy boxes of the persons
+        - person_scores (np.array): (N,) confidence of the persons
+        - ppe_classes (np.array): (C,) class ids of the PPE columns
+        - matched (np.array): (N, C) bool, True when person n wears PPE class ppe_classes[c]
+        - labels (list): (C,) titled class names used as keys of the status dictionaries
+        - track_ids (np.array): (N,) identities of the persons when they come from the tracker, else None
+    """
+    __slots__ = ('person_boxes', 'person_scores', 'ppe_classes', 'matched', 'labels', 'track_ids')
+
+    def __init__(self, person_boxes, person_scores, ppe_classes, matched, track_ids=None):
+        self.person_boxes = person_boxes
+        self.person_scores = person_scores
+        self.ppe_classes = ppe_classes
+        self.matched = matched
+        self.track_ids = track_ids
+        self.labels = [CLASSES_NAMES[cls].title() for cls in ppe_classes]
+
+    def __len__(self):
+        return len(self.person_boxes)
+
+    def column(self, label):
+        """Return the (N,) bool array telling which persons wear the PPE `label` (e.g. 'Helmet')."""
+        return self.matched[:, self.labels.index(label)]
+
+    def status(self, idx):
+        """Return the PPE status of person `idx` as {label: bool}."""
+        return {label: bool(value) for label, value in zip(self.labels, self.matched[idx])}
+
+    def items(self):
+        """Yield (person box tuple, status dict) pairs, like the dictionary returned by the old ppe_inspection."""
+        for idx, box in enumerate(self.person_boxes):
+            yield tuple(box), self.status(idx)
+
+
+def overlap_matrix(boxes_a, boxes_b):
+    """
+    Vectorized version of check_overlap for every pair of boxes.
+    Parameters:
+        - boxes_a (np.array): (N, 4) xyxy boxes
+        - boxes_b (np.array): (M, 4) xyxy boxes
+    Returns:
+        - np.array: (N, M) bool, True when the boxes overlap or touch
+    """
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    return (a[..., 2] >= b[..., 0]) & (a[..., 0] <= b[..., 2]) & (a[..., 3] >= b[..., 1]) & (a[..., 1] <= b[..., 3])
+
+
+def _intersection(boxes_a, boxes_b):
+    """Return the (N, M) intersection areas and the broadcast (N, 1, 4) and (1, M, 4) float boxes."""
+    a = boxes_a[:, None, :].astype(np.float32)
+    b = boxes_b[None, :, :].astype(np.float32)
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    return inter_w * inter_h, a, b
+
+
+def ioa_matrix(boxes_a, boxes_b):
+    """
+    Intersection over the area of the boxes in `boxes_b`, i.e. how much of each box b is contained in each box a.
+    Parameters:
+        - boxes_a (np.array): (N, 4) xyxy boxes
+        - boxes_b (np.array): (M, 4) xyxy boxes
+    Returns:
+        - np.array: (N, M) float in [0, 1]
+    """
+    inter, _, b = _intersection(boxes_a, boxes_b)
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_b, 1e-6)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Intersection over union of every pair of boxes.
+    Parameters:
+        - boxes_a (np.array): (N, 4) xyxy boxes
+        - boxes_b (np.array): (M, 4) xyxy boxes
+    Returns:
+        - np.array: (N, M) float in [0, 1]
+    """
+    inter, a, b = _intersection(boxes_a, boxes_b)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def region_matrix(person_boxes, ppe_boxes, ppe_cls, region_rules):
+    """
+    Check the body-region rules for every person / PPE pair.
+    Returns:
+        - np.array: (N, M) bool, True when the centre of the PPE box lies in the band of the person box required by
+    its class, or when its class has no rule
+    """
+    top = np.zeros(len(ppe_cls), dtype=np.float32)
+    bottom = np.ones(len(ppe_cls), dtype=np.float32)
+    has_rule = np.zeros(len(ppe_cls), dtype=bool)
+    for cls, (rule_top, rule_bottom) in region_rules.items():
+        selected = ppe_cls == cls
+        top[selected] = rule_top
+        bottom[selected] = rule_bottom
+        has_rule |= selected
+
+    y1 = person_boxes[:, 1:2].astype(np.float32)
+    height = person_boxes[:, 3:4] - y1
+    center_y = (ppe_boxes[:, 1] + ppe_boxes[:, 3]) / 2
+    in_band = (center_y[None] >= y1 + top[None] * height) & (center_y[None] <= y1 + bottom[None] * height)
+    return in_band | ~has_rule[None]
+
+
+def associate_ppe(positions, classes, scores, conf_threshold=0.5, scoring='overlap', min_ioa=0.5,
+                  region_rules=None, ppe_classes=PPE_CLASSES):
+    """
+    Associate every PPE detection to every person of a frame in one pass.
+    Parameters:
+        - positions (np.array): (M, 4) xyxy boxes of all detections
+        - classes (np.array): (M,) class ids
+        - scores (np.array): (M,) confidences
+        - conf_threshold (float): detections with a lower confidence are ignored
+        - scoring (str): 'overlap' counts any intersection (like check_overlap), 'ioa' requires at least `min_ioa` of
+    the PPE box to be inside the person box
+        - min_ioa (float): containment threshold of the 'ioa' scoring
+        - region_rules (dict): {class id: (top, bottom)} body-region rules, e.g. BODY_REGION_RULES
+        - ppe_classes (list): class ids reported in the result
+    Returns:
+        - PPEAssociation: the PPE status of each person
+    """
+    positions = np.asarray(positions)
+    classes = np.asarray(classes).astype(int)
+    scores = np.asarray(scores)
+
+    # Filter detections based on the confidence threshold
+    valid = scores > conf_threshold
+    positions, classes, scores = positions[valid], classes[valid], scores[valid]
+
+    is_person = classes == PERSON_CLASS
+    person_boxes, person_scores = positions[is_person], scores[is_person]
+    ppe_boxes, ppe_cls = positions[~is_person], classes[~is_person]
+    ppe_classes = np.asarray(ppe_classes, dtype=int)
+
+    # Person x PPE association matrix
+    if scoring == 'overlap':
+        associated = overlap_matrix(person_boxes, ppe_boxes)
+    elif scoring == 'ioa':
+        associated = ioa_matrix(person_boxes, ppe_boxes) >= min_ioa
+    else:
+        raise ValueError(f"Unknown scoring '{scoring}', expected 'overlap' or 'ioa'")
+    if region_rules:
+        associated &= region_matrix(person_boxes, ppe_boxes, ppe_cls, region_rules)
+
+    # Reduce detections to classes: (N, M) @ (M, C) counts the associated detections of each class
+    one_hot = ppe_cls[:, None] == ppe_classes[None]
+    matched = (associated.astype(np.int32) @ one_hot.astype(np.int32)) > 0
+
+    return PPEAssociation(person_boxes, person_scores, ppe_classes, matched)
@@ -0,0 +1,221 @@
+"""
+Dataset augmentation of the raw images (grayscale, binarization, salt-and-pepper noise, right-angle rotation), the
+transforms of the notebook in one pass: every image is read once, goes through the transforms drawn for it and is
+written once, on a process pool. The transforms of an image only depend on the seed and the image file name, so a
+run gives the same dataset whatever the number of workers. YOLO label files next to the images are rotated with
+them.
+
+    python augment.py ../RawData --seed 42
+    python augment.py ../dataset/train/images --output ../augmented/train/images --workers 8
+"""
+import argparse
+import os
+import shutil
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from backends import IMAGE_EXTENSIONS
+
+NOISE_PROBABILITIES = (0.01, 0.02, 0.03, 0.04, 0.05)
+ANGLES = (0, 90, 180, 270)
+# cv.rotate codes of the counterclockwise angles, as cv.getRotationMatrix2D turns
+ROTATIONS = {90: cv.ROTATE_90_COUNTERCLOCKWISE, 180: cv.ROTATE_180, 270: cv.ROTATE_90_CLOCKWISE}
+
+
+def grayscale(image, rng):
+    return cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def binarize(image, rng, threshold=120):
+    _, binary = cv.threshold(grayscale(image, rng), threshold, 255, cv.THRESH_BINARY)
+    return binary
+
+
+def add_salt_and_pepper_noise(image, rng, salt_prob=None, pepper_prob=None):
+    """
+    Set int(prob * image.size) random pixels (drawn with replacement) to white for salt and black for pepper, as the
+    per-pixel loop of the notebook did, in two array assignments. The probabilities are drawn from
+    NOISE_PROBABILITIES when not given.
+    """
+    salt_prob = rng.choice(NOISE_PROBABILITIES) if salt_prob is None else salt_prob
+    pepper_prob = rng.choice(NOISE_PROBABILITIES) if pepper_prob is None else pepper_prob
+    noisy_image = image.copy()
+    pixels = noisy_image.reshape(image.shape[0] * image.shape[1], -1)
+    pixels[rng.integers(0, len(pixels), int(salt_prob * image.size))] = 255
+    pixels[rng.integers(0, len(pixels), int(pepper_prob * image.size))] = 0
+    return noisy_image
+
+
+def rotate_labels(lines, angle):
+    """
+    Rotate YOLO label lines ('class xc yc w h' boxes or 'class x1 y1 x2 y2 ...' polygons, normalized) with an image
+    turned counterclockwise by `angle` (90, 180 or 270).
+    """
+    rotated = []
+    for line in lines:
+        values = line.split()
+        if not values:
+            continue
+        points = np.array(values[1:], dtype=np.float64)
+        is_box = len(points) == 4
+        xy = points[:2] if is_box else points
+        x, y = xy[0::2].copy(), xy[1::2].copy()
+        if angle == 90:
+            xy[0::2], xy[1::2] = y, 1 - x
+        elif angle == 180:
+            xy[0::2], xy[1::2] = 1 - x, 1 - y
+        elif angle == 270:
+            xy[0::2], xy[1::2] = 1 - y, x
+        if is_box and angle in (90, 270):
+            points[2:] = points[[3, 2]]
+        rotated.append(' '.join([values[0]] + [f'{value:.6f}' for value in points]))
+    return rotated
+
+
+def rotate(image, rng, angle=None, labels=None):
+    """
+    Turn the image by a right angle drawn from ANGLES. cv.rotate keeps every pixel (the width and height are swapped
+    at 90 and 270), so the label boxes stay exact. Returns the image and the rotated `labels` lines.
+    """
+    angle = int(rng.choice(ANGLES)) if angle is None else angle
+    if angle == 0:
+        return image, labels
+    return cv.rotate(image, ROTATIONS[angle]), (rotate_labels(labels, angle) if labels is not None else None)
+
+
+TRANSFORMS = {'grayscale': grayscale, 'binarize': binarize, 'noise': add_salt_and_pepper_noise, 'rotate': rotate}
+
+
+def image_rng(seed, name):
+    """Random generator of an image, seeded by the run seed and the file name (not by the processing order)."""
+    return np.random.default_rng([seed, zlib.crc32(name.encode())])
+
+
+def draw_transforms(rng, probabilities):
+    """Names of the transforms applied to an image, in the order of `probabilities`."""
+    return [name for name, probability in probabilities.items() if rng.random() < probability]
+
+
+def augment_image(image_path, output_path, labels_path, output_labels_path, probabilities, seed):
+    """
+    Read an image once, apply the transforms drawn for it and write it (and its rotated labels) once. Unchanged
+    images are copied when the output is another folder.
+    Returns:
+        - list: names of the applied transforms, None when the image could not be read
+    """
+    rng = image_rng(seed, os.path.basename(image_path))
+    applied = draw_transforms(rng, probabilities)
+    in_place = os.path.abspath(output_path) == os.path.abspath(image_path)
+    has_labels = labels_path is not None and os.path.exists(labels_path)
+    if not applied:
+        if not in_place:
+            shutil.copyfile(image_path, output_path)
+            if has_labels:
+                shutil.copyfile(labels_path, output_labels_path)
+        return applied
+
+    image = cv.imread(image_path, cv.IMREAD_COLOR)
+    if image is None:
+        return None
+    labels = None
+    if has_labels:
+        with open(labels_path) as file:
+            labels = file.read().splitlines()
+    for name in applied:
+        if name == 'rotate':
+            image, labels = rotate(image, rng, labels=labels)
+        else:
+            image = TRANSFORMS[name](image, rng)
+
+    cv.imwrite(output_path, image)
+    if has_labels and ('rotate' in applied or not in_place):
+        with open(output_labels_path, 'w') as file:
+            file.write(''.join(line + '\n' for line in labels))
+    return applied
+
+
+def _augment_task(task):
+    return task[0], augment_image(*task)
+
+
+def augment_dataset(images_dir, output_dir=None, labels_dir=None, probabilities=None, seed=0, workers=None,
+                    chunksize=16):
+    """
+    Augment every image of a folder, on a process pool.
+    Parameters:
+        - images_dir (str): folder of the images
+        - output_dir (str): folder of the augmented dataset, None to replace the images in place like the notebook
+        - labels_dir (str): folder of the YOLO label files (same name, .txt), defaults to the 'labels' folder next to
+    an 'images' folder. The labels go to the 'labels' folder next to `output_dir`
+        - probabilities (dict): {transform name: probability for an image to get it}, see TRANSFORMS
+        - seed (int): seed of the run, the transforms of an image only depend on it and on the image name
+        - workers (int): worker processes, 0 runs in this process, None uses every CPU
+        - chunksize (int): images sent to a worker at once
+    Returns:
+        - dict: {transform name: number of images}, with 'images' and 'unreadable' counts
+    """
+    probabilities = probabilities or {'grayscale': 0.1, 'binarize': 0.1, 'noise': 0.1, 'rotate': 0.1}
+    unknown = set(probabilities) - set(TRANSFORMS)
+    if unknown:
+        raise ValueError(f'Unknown transforms {sorted(unknown)}, expected some of {list(TRANSFORMS)}')
+    output_dir = output_dir or images_dir
+    if labels_dir is None and os.path.basename(os.path.normpath(images_dir)) == 'images':
+        labels_dir = os.path.join(os.path.dirname(os.path.normpath(images_dir)), 'labels')
+    output_labels_dir = labels_dir
+    if output_dir != images_dir and labels_dir is not None:
+        output_labels_dir = os.path.join(os.path.dirname(os.path.normpath(output_dir)), 'labels')
+    os.makedirs(output_dir, exist_ok=True)
+    if output_labels_dir is not None and os.path.isdir(labels_dir):
+        os.makedirs(output_labels_dir, exist_ok=True)
+
+    tasks = []
+    for name in sorted(os.listdir(images_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            label_name = os.path.splitext(name)[0] + '.txt'
+            tasks.append((os.path.join(images_dir, name), os.path.join(output_dir, name),
+                          os.path.join(labels_dir, label_name) if labels_dir else None,
+                          os.path.join(output_labels_dir, label_name) if output_labels_dir else None,
+                          probabilities, seed))
+
+    counts = {'images': len(tasks), 'unreadable': 0, **dict.fromkeys(probabilities, 0)}
+    if workers == 0:
+        results = map(_augment_task, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(workers)
+        results = executor.map(_augment_task, tasks, chunksize=chunksize)
+    try:
+        for image_path, applied in results:
+            if applied is None:
+                print(f'Could not read image at path {image_path}')
+                counts['unreadable'] += 1
+                continue
+            for name in applied:
+                counts[name] += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images_dir')
+    parser.add_argument('--output', help='output images folder, the images are replaced in place by default')
+    parser.add_argument('--labels', help="YOLO labels folder, defaults to the 'labels' folder next to 'images'")
+    for name in TRANSFORMS:
+        parser.add_argument(f'--{name}', type=float, default=0.1, help=f'probability of {name} for an image')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help='worker processes, 0 runs in this process (default: every CPU)')
+    args = parser.parse_args(argv)
+
+    probabilities = {name: getattr(args, name) for name in TRANSFORMS if getattr(args, name) > 0}
+    counts = augment_dataset(args.images_dir, args.output, args.labels, probabilities, args.seed, args.workers)
+    print(', '.join(f'{name}: {count}' for name, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import glob
+import os
+import re
+import shutil
+
+import cv2 as cv
+import numpy as np
+
+# Backends a detector can run on: PyTorch (ultralytics), ONNX Runtime and OpenVINO (CPU)
+BACKENDS = ('torch', 'onnx', 'openvino')
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data.yaml')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def dataset_split_dir(data_path=DATA_PATH, split='val'):
+    """
+    Directory of a split of a YOLO dataset configuration (data.yaml), relative to the configuration file (or to its
+    'path' entry).
+    """
+    import yaml
+
+    with open(data_path) as file:
+        data = yaml.safe_load(file)
+    root = os.path.join(os.path.dirname(os.path.abspath(data_path)), data.get('path', ''))
+    return os.path.join(root, data[split])
+
+
+def dataset_images(data_path=DATA_PATH, split='val', limit=None):
+    """
+    Image files of a split of a YOLO dataset configuration (data.yaml), read from the 'images' folder of the split
+    directory when there is one.
+    """
+    split_dir = dataset_split_dir(data_path, split)
+    if os.path.isdir(os.path.join(split_dir, 'images')):
+        split_dir = os.path.join(split_dir, 'images')
+    files = sorted(path for path in glob.glob(os.path.join(split_dir, '*')) if path.lower().endswith(IMAGE_EXTENSIONS))
+    if not files:
+        raise FileNotFoundError(f"No images in the '{split}' split of {data_path} ({split_dir})")
+    return files[:limit]
+
+
+def letterbox(image, size=640, color=114):
+    """Resize keeping the aspect ratio and pad to size x size, as the YOLO preprocessing does."""
+    scale = min(size / image.shape[0], size / image.shape[1])
+    width, height = round(image.shape[1] * scale), round(image.shape[0] * scale)
+    canvas = np.full((size, size, 3), color, dtype=np.uint8)
+    top, left = (size - height) // 2, (size - width) // 2
+    canvas[top:top + height, left:left + width] = cv.resize(image, (width, height), interpolation=cv.INTER_LINEAR)
+    return canvas
+
+
+class CalibrationReader:
+    """
+    ONNX Runtime calibration data reader over dataset images, preprocessed like the YOLO input
+    (letterbox, RGB, CHW, float32 in [0, 1], batch of 1).
+    """
+
+    def __init__(self, input_name, image_paths, imgsz=640):
+        self.input_name = input_name
+        self.image_paths = iter(image_paths)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.image_paths:
+            image = cv.imread(path, cv.IMREAD_COLOR)
+            if image is not None:
+                tensor = letterbox(image, self.imgsz)[:, :, ::-1].transpose(2, 0, 1)
+                return {self.input_name: np.ascontiguousarray(tensor, dtype=np.float32)[None] / 255}
+        return None
+
+
+def quantize_onnx(fp32_path, int8_path, data_path=DATA_PATH, imgsz=640, calibration_images=300):
+    """
+    Static INT8 post-training quantization of an ONNX detector, calibrated on the validation split of `data_path`.
+    The box decoding head (the last module of the network) stays in float: quantizing it costs most of the mAP for
+    little speed. The ultralytics metadata (class names, stride, image size) is kept so YOLO() can load the result.
+    """
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    model = onnx.load(fp32_path)
+    matches = [re.match(r'/model\.(\d+)/', node.name) for node in model.graph.node]
+    modules = [int(match.group(1)) for match in matches if match]
+    head = f'/model.{max(modules)}/' if modules else None
+    nodes_to_exclude = [node.name for node in model.graph.node if head and node.name.startswith(head)]
+
+    reader = CalibrationReader(model.graph.input[0].name, dataset_images(data_path, 'val', calibration_images), imgsz)
+    quantize_static(fp32_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, nodes_to_exclude=nodes_to_exclude)
+
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+
+def exported_path(weights, backend, int8=False):
+    """Path of the export of `weights` for a backend: best.onnx, best_int8.onnx, best_openvino_model/, ..."""
+    stem = os.path.splitext(weights)[0] + ('_int8' if int8 else '')
+    return f'{stem}.onnx' if backend == 'onnx' else f'{stem}_openvino_model'
+
+
+def is_fresh(path, weights):
+    """True when the export `path` exists and is newer than the weights it was made from."""
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(weights)
+
+
+def export_model(weights, backend, int8=False, data_path=DATA_PATH, imgsz=640, calibration_images=300):
+    """
+    Export PyTorch YOLO weights for a backend, with dynamic batch and image size so that batched callers
+    (offline analysis, multi-camera) work unchanged.
+    Parameters:
+        - weights (str): .pt weights
+        - backend (str): 'onnx' or 'openvino'
+        - int8 (bool): INT8 post-training quantization calibrated on the validation split of `data_path`
+        - imgsz (int): input size
+        - calibration_images (int): number of validation images used to calibrate the ONNX quantization (the
+    OpenVINO quantization of ultralytics uses the whole split)
+    Returns:
+        - str: path of the exported model, see exported_path
+    """
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f"Unknown export backend '{backend}', expected 'onnx' or 'openvino'")
+    target = exported_path(weights, backend, int8)
+    if backend == 'onnx':
+        fp32_path = exported_path(weights, 'onnx')
+        if not is_fresh(fp32_path, weights):
+            path = YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+            if os.path.abspath(path) != os.path.abspath(fp32_path):
+                os.replace(path, fp32_path)
+        if int8:
+            quantize_onnx(fp32_path, target, data_path, imgsz, calibration_images)
+    else:
+        path = YOLO(weights).export(format='openvino', imgsz=imgsz, dynamic=True, int8=int8, data=data_path)
+        if os.path.abspath(path) != os.path.abspath(target):
+            # Replace a stale export
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(path, target)
+    return target
+
+
+def load_detector(weights, backend='torch', int8=False, data_path=DATA_PATH, imgsz=640):
+    """
+    Load the detector on a backend. PyTorch weights are exported for ONNX Runtime or OpenVINO the first time, the
+    export is reused as long as it is newer than the weights. Every backend is loaded through ultralytics YOLO, so
+    the model is called the same way and returns the same Results whatever the backend.
+    Parameters:
+        - weights (str): .pt weights, or an already exported model (.onnx file, OpenVINO model folder)
+        - backend (str): one of BACKENDS
+        - int8 (bool): use the INT8 quantized export (onnx and openvino backends)
+        - data_path (str): dataset configuration used to calibrate the INT8 quantization
+        - imgsz (int): input size of the export
+    Returns:
+        - YOLO object: the detection model
+    """
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    if not weights.endswith('.pt'):
+        return YOLO(weights, task='detect')
+    if backend == 'torch':
+        if int8:
+            raise ValueError("INT8 quantization needs the 'onnx' or 'openvino' backend")
+        return YOLO(weights)
+
+    path = exported_path(weights, backend, int8)
+    if not is_fresh(path, weights):
+        path = export_model(weights, backend, int8, data_path, imgsz)
+    return YOLO(path, task='detect')
@@ -1,7 +1,7 @@
 import tkinter as tk
 from PIL import Image, ImageTk
 import subprocess
-import UI
+import sys
 
 
 class WarningSystemUI(tk.Tk):
@@ -116,7 +116,8 @@ class WarningSystemUI(tk.Tk):
 
     def start_button_clicked(self):
         self.destroy()  # Đóng cửa sổ hiện tại
-        subprocess.run(["python3", "UI.py"])
+        # UI.py is only imported by the new process, the splash screen starts without PyQt5 and the model
+        subprocess.run([sys.executable, "UI.py"])
 
 
 if __name__ == "__main__":
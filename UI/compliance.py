@@ -0,0 +1,185 @@
+import datetime
+import time
+
+import numpy as np
+
+# Trailing windows of the compliance statistics, in seconds
+WINDOWS = {'1min': 60, '15min': 15 * 60, 'shift': 8 * 3600}
+# A person counts as a worker when wearing any of these (the rule of Show_Status_and_Alert)
+WORKER_PPE = ('Helmet', 'Safety Vest')
+# Compliance rules: {rule name: PPE labels a person must all wear}
+DEFAULT_RULES = {'Helmet': ('Helmet',), 'Safety Vest': ('Safety Vest',), 'Helmet and vest': ('Helmet', 'Safety Vest')}
+HEADCOUNT_STATES = ('Normal', 'Missing', 'Redundant')
+
+
+def headcount_state(number_worker, required):
+    """'Normal' when the zone has the required number of workers, else 'Missing' or 'Redundant'."""
+    if number_worker == required:
+        return 'Normal'
+    return 'Missing' if number_worker < required else 'Redundant'
+
+
+class SlidingWindow:
+    """
+    Sums of a counter vector over the last `length` seconds, kept in a ring of `buckets` time buckets: an update adds
+    to the current bucket and to the totals, and subtracts the buckets leaving the window, so it costs O(1) whatever
+    the number of updates in the window. The window moves one bucket (length / buckets seconds) at a time.
+    Parameters:
+        - length (float): window length in seconds
+        - size (int): length of the counter vectors
+        - buckets (int): time resolution of the window
+    """
+
+    def __init__(self, length, size, buckets=60):
+        self.length = length
+        self.bucket_seconds = length / buckets
+        self.ring = np.zeros((buckets, size), dtype=np.int64)
+        self.totals = np.zeros(size, dtype=np.int64)
+        self.current = None
+
+    def advance(self, timestamp):
+        """Move the window so that it ends at `timestamp`, dropping the buckets that left it."""
+        bucket = int(timestamp // self.bucket_seconds)
+        if self.current is None:
+            self.current = bucket
+        # Clocks going backwards (NTP) keep the current bucket
+        for expired in range(self.current + 1, min(bucket, self.current + len(self.ring)) + 1):
+            slot = expired % len(self.ring)
+            self.totals -= self.ring[slot]
+            self.ring[slot] = 0
+        self.current = max(self.current, bucket)
+
+    def add(self, timestamp, values):
+        self.advance(timestamp)
+        self.ring[self.current % len(self.ring)] += values
+        self.totals += values
+
+
+class ComplianceAggregator:
+    """
+    Streaming PPE compliance of the persons of a camera, per zone and over sliding time windows. Every update costs
+    O(1) per window, and the summaries are read from running totals without going over the history.
+    Counted per zone: frames, the frames in each headcount state (see headcount_state), the person observations, the
+    observations wearing each PPE class and the observations following each rule.
+    Parameters:
+        - ppe_labels (list): titled PPE classes of the statuses (PPEAssociation.labels)
+        - zones (list): Zone objects, a person belongs to the zones containing the bottom centre of its box. Without
+    zones every person is in the zone 'all'
+        - required_workers (int or dict): required number of workers of every zone, or {zone name: number}. A zone's
+    `required_workers` (zones.yaml) takes precedence
+        - rules (dict): {rule name: PPE labels a person must all wear}, DEFAULT_RULES by default
+        - windows (dict): {window name: seconds}, WINDOWS by default
+        - report_window (str): window of the rule shares of the result rows, one of `windows`
+    """
+
+    def __init__(self, ppe_labels, zones=None, required_workers=5, rules=None, windows=None, report_window='1min'):
+        self.ppe_labels = list(ppe_labels)
+        self.zones = zones or []
+        self.zone_names = [zone.name for zone in self.zones] or ['all']
+        self.required = {}
+        for name, zone in zip(self.zone_names, self.zones or [None]):
+            default = required_workers.get(name, 0) if isinstance(required_workers, dict) else required_workers
+            zone_required = getattr(zone, 'required_workers', None)
+            self.required[name] = zone_required if zone_required is not None else default
+        self.rules = dict(rules or DEFAULT_RULES)
+        unknown = {label for labels in self.rules.values() for label in labels} - set(self.ppe_labels)
+        if unknown:
+            raise ValueError(f'Unknown PPE {sorted(unknown)} in the compliance rules, expected some of '
+                             f'{self.ppe_labels}')
+        # Columns of PPEAssociation.matched checked by each rule
+        self.rule_columns = [[self.ppe_labels.index(label) for label in labels] for labels in self.rules.values()]
+        self.worker_columns = [self.ppe_labels.index(label) for label in WORKER_PPE if label in self.ppe_labels]
+        # Counter layout: frames, headcount states, persons, PPE worn per class, rule followed per rule
+        self.size = 2 + len(HEADCOUNT_STATES) + len(self.ppe_labels) + len(self.rules)
+        self.windows = {name: {zone: SlidingWindow(length, self.size) for zone in self.zone_names}
+                        for name, length in (windows or WINDOWS).items()}
+        if report_window not in self.windows:
+            raise ValueError(f"Unknown report window '{report_window}', expected one of {list(self.windows)}")
+        self.report_window = report_window
+        self.last_workers = dict.fromkeys(self.zone_names, 0)
+        self.updates = 0
+
+    def zone_masks(self, boxes, frame_size):
+        """(Z, N) bool, True when person n is in zone z."""
+        if not self.zones:
+            return np.ones((1, len(boxes)), dtype=bool)
+        feet = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1)
+        return np.array([zone.contains(feet, frame_size) for zone in self.zones]).reshape(len(self.zones), -1)
+
+    def update(self, association, frame_size=None, timestamp=None):
+        """
+        Count the persons of a frame.
+        Parameters:
+            - association (PPEAssociation): PPE status of the persons (tracked or not)
+            - frame_size (tuple): (width, height) of the frame, needed with zones
+            - timestamp (float): time of the frame in seconds, time.time() by default
+        Returns:
+            - dict: {zone name: number of workers in the zone}
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        matched = np.asarray(association.matched, dtype=bool).reshape(len(association), len(self.ppe_labels))
+        workers = matched[:, self.worker_columns].any(axis=1)
+        rules = np.stack([matched[:, columns].all(axis=1) for columns in self.rule_columns], axis=1)
+        per_person = np.concatenate([np.ones((len(matched), 1), dtype=np.int64), matched, rules], axis=1)
+
+        masks = self.zone_masks(np.asarray(association.person_boxes, dtype=np.float64).reshape(-1, 4), frame_size)
+        for name, mask in zip(self.zone_names, masks):
+            number_worker = int(np.count_nonzero(workers & mask))
+            values = np.zeros(self.size, dtype=np.int64)
+            values[0] = 1
+            values[1 + HEADCOUNT_STATES.index(headcount_state(number_worker, self.required[name]))] = 1
+            values[1 + len(HEADCOUNT_STATES):] = per_person[mask].sum(axis=0)
+            for zone_windows in self.windows.values():
+                zone_windows[name].add(timestamp, values)
+            self.last_workers[name] = number_worker
+        self.updates += 1
+        return dict(self.last_workers)
+
+    def summary(self, timestamp=None):
+        """
+        Statistics of every zone and window:
+        {zone: {window: {'frames', 'persons', 'states': {state: share of the frames}, 'ppe': {label: share of the
+        persons wearing it}, 'rules': {rule: share of the persons following it}}}}
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        summary = {}
+        for window_name, zone_windows in self.windows.items():
+            for zone, window in zone_windows.items():
+                window.advance(timestamp)
+                totals = window.totals
+                frames, states = int(totals[0]), totals[1:1 + len(HEADCOUNT_STATES)]
+                persons = int(totals[1 + len(HEADCOUNT_STATES)])
+                worn = totals[2 + len(HEADCOUNT_STATES):2 + len(HEADCOUNT_STATES) + len(self.ppe_labels)]
+                followed = totals[2 + len(HEADCOUNT_STATES) + len(self.ppe_labels):]
+                summary.setdefault(zone, {})[window_name] = {
+                    'frames': frames, 'persons': persons,
+                    'states': {state: round(int(count) / max(frames, 1), 4)
+                               for state, count in zip(HEADCOUNT_STATES, states)},
+                    'ppe': {label: round(int(count) / max(persons, 1), 4)
+                            for label, count in zip(self.ppe_labels, worn)},
+                    'rules': {rule: round(int(count) / max(persons, 1), 4)
+                              for rule, count in zip(self.rules, followed)}}
+        return summary
+
+    def columns(self, window=None):
+        """Keys of the rows(), in order."""
+        window = window or self.report_window
+        return ['Date time', 'Zone', 'Number of workers', 'Required', 'State'] + [f'{rule} {window}'
+                                                                                    for rule in self.rules]
+
+    def rows(self, timestamp=None, window=None):
+        """
+        Result rows (one per zone) of the last update: the date, zone, workers, required workers and headcount state,
+        with the share of the persons following each rule over `window` (the report window by default).
+        """
+        window = window or self.report_window
+        if window not in self.windows:
+            raise ValueError(f"Unknown window '{window}', expected one of {list(self.windows)}")
+        timestamp = time.time() if timestamp is None else timestamp
+        date_time = datetime.datetime.fromtimestamp(timestamp).strftime("%B %d, %Y %H:%M:%S")
+        summary = self.summary(timestamp)
+        return [{'Date time': date_time, 'Zone': zone, 'Number of workers': self.last_workers[zone],
+                 'Required': self.required[zone],
+                 'State': headcount_state(self.last_workers[zone], self.required[zone]),
+                 **{f'{rule} {window}': share for rule, share in summary[zone][window]['rules'].items()}}
+                for zone in self.zone_names]
@@ -0,0 +1,233 @@
+"""
+Index of the YOLO label files of a dataset: every label file is parsed once (in parallel for large splits) into
+columnar arrays cached next to the labels folder, keyed by the modification time and size of each file. The next runs
+only parse the files that changed. Class counts, box sizes, objects per image and imbalance reports come from the
+arrays.
+
+    python dataset_index.py --data ../data.yaml
+    python dataset_index.py --labels ../Annotate_PPE-4/train/labels --json train_stats.json
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from association import CLASSES_NAMES
+from backends import DATA_PATH, dataset_split_dir
+
+CACHE_NAME = 'labels.index.npz'
+CACHE_VERSION = 1
+# Below this number of files to parse, starting worker processes costs more than it saves
+PARALLEL_MIN_FILES = 2000
+
+
+def parse_labels(text):
+    """
+    Parse the content of a YOLO label file into a (N, 5) float32 array [class, xc, yc, w, h]. Segmentation lines
+    ('class x1 y1 x2 y2 ...') are converted to their bounding box.
+    """
+    values = text.split()
+    lines = text.splitlines()
+    if len(values) == 5 * len(lines):
+        return np.array(values, dtype=np.float32).reshape(-1, 5)
+    rows = []
+    for line in lines:
+        values = line.split()
+        if len(values) == 5:
+            rows.append(values)
+        elif len(values) > 5:
+            points = np.array(values[1:], dtype=np.float32).reshape(-1, 2)
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            rows.append([values[0], (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def _parse_files(paths):
+    labels = []
+    for path in paths:
+        with open(path) as file:
+            labels.append(parse_labels(file.read()))
+    return labels
+
+
+class LabelIndex:
+    """
+    Labels of a split as columns: `labels` (M, 5) [class, xc, yc, w, h] of every box, grouped by file in the order
+    of `files`, with `counts` boxes per file.
+    """
+
+    def __init__(self, files, counts, labels):
+        self.files = files
+        self.counts = counts
+        self.labels = labels
+        self.classes = labels[:, 0].astype(int)
+        self.image_ids = np.repeat(np.arange(len(files)), counts)
+        self.parsed = 0
+        self.reused = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def class_ids(self, num_classes):
+        """
+        Class of every box and number of class entries: the classes above `num_classes` (labelling mistakes) get their
+        own entries after it, the negative ones share a last entry.
+        """
+        classes = self.classes
+        num_classes = max(num_classes, int(classes.max()) + 1 if len(classes) else 0)
+        negative = classes < 0
+        if negative.any():
+            classes = np.where(negative, num_classes, classes)
+            num_classes += 1
+        return classes, num_classes
+
+    def class_counts(self, num_classes=len(CLASSES_NAMES), per_image=False):
+        """
+        Boxes of every class, or the number of images containing the class when `per_image` is True. Classes out of
+        range get their own entries at the end, see class_ids().
+        """
+        classes, num_classes = self.class_ids(num_classes)
+        if per_image:
+            pairs = np.unique(self.image_ids * num_classes + classes)
+            return np.bincount(pairs % num_classes, minlength=num_classes)
+        return np.bincount(classes, minlength=num_classes)
+
+    def objects_per_image(self):
+        return self.counts
+
+    def box_size_histogram(self, bins=10, num_classes=len(CLASSES_NAMES)):
+        """
+        Histogram of the box sizes (square root of the normalized area) of every class over `bins` bins in [0, 1].
+        Classes out of range get their own rows at the end, see class_ids().
+        Returns:
+            - np.array: (num_classes, bins) counts
+            - np.array: (bins + 1,) bin edges
+        """
+        sizes = np.sqrt(self.labels[:, 3] * self.labels[:, 4])
+        edges = np.linspace(0, 1, bins + 1)
+        bin_ids = np.clip(np.digitize(sizes, edges) - 1, 0, bins - 1)
+        classes, num_classes = self.class_ids(num_classes)
+        histogram = np.bincount(classes * bins + bin_ids, minlength=num_classes * bins)
+        return histogram.reshape(num_classes, bins), edges
+
+    def imbalance_report(self, names=CLASSES_NAMES):
+        """Per-class boxes, images and share of the boxes, with the ratio of the most to the least frequent class."""
+        boxes = self.class_counts(len(names))
+        images = self.class_counts(len(names), per_image=True)
+        total = max(int(boxes.sum()), 1)
+        present = boxes[boxes > 0]
+        return {'images': len(self), 'empty_images': int((self.counts == 0).sum()), 'boxes': int(boxes.sum()),
+                'objects_per_image': {'mean': round(float(self.counts.mean()), 2) if len(self) else 0.0,
+                                      'max': int(self.counts.max()) if len(self) else 0},
+                'classes': {name: {'boxes': int(boxes[i]), 'images': int(images[i]),
+                                   'share': round(int(boxes[i]) / total, 4)} for i, name in enumerate(names)},
+                'imbalance_ratio': round(float(present.max() / present.min()), 2) if len(present) else None,
+                'missing_classes': [name for i, name in enumerate(names) if boxes[i] == 0]}
+
+
+def load_index(labels_dir, cache_path=None, workers=None):
+    """
+    Index the label files of a folder, parsing only the files added or modified since the cached index.
+    Parameters:
+        - labels_dir (str): folder of the .txt label files
+        - cache_path (str): cache file (.npz, added when missing), CACHE_NAME next to the labels folder by default.
+    The cache is rewritten when a file was added, modified or removed, and rebuilt when it is unreadable or from
+    another CACHE_VERSION
+        - workers (int): parsing processes, 0 parses in this process, None uses every CPU above PARALLEL_MIN_FILES
+    files to parse
+    Returns:
+        - LabelIndex: the index, with the `parsed` and `reused` file counts of the run
+    """
+    cache_path = cache_path or os.path.join(os.path.dirname(os.path.normpath(labels_dir)), CACHE_NAME)
+    # np.savez appends the suffix to the other paths
+    if not cache_path.endswith('.npz'):
+        cache_path += '.npz'
+    entries = sorted((entry.name, entry.stat()) for entry in os.scandir(labels_dir)
+                     if entry.name.endswith('.txt') and entry.is_file())
+    files = [name for name, _ in entries]
+    mtimes = np.array([stat.st_mtime_ns for _, stat in entries], dtype=np.int64)
+    sizes = np.array([stat.st_size for _, stat in entries], dtype=np.int64)
+
+    per_file = [None] * len(files)
+    cached_files = 0
+    reusable = np.zeros(len(files), dtype=bool)
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as npz:
+                cache = {key: npz[key] for key in npz.files}
+        except (OSError, ValueError):
+            pass
+        if cache.get('version') == CACHE_VERSION:
+            cached_files = len(cache['files'])
+            position = {name: i for i, name in enumerate(cache['files'].tolist())}
+            rows = np.array([position.get(name, -1) for name in files], dtype=np.int64)
+            known = rows >= 0
+            reusable[known] = ((cache['mtimes'][rows[known]] == mtimes[known]) &
+                               (cache['sizes'][rows[known]] == sizes[known]))
+            offsets = np.concatenate([[0], np.cumsum(cache['counts'])])
+            for i in np.flatnonzero(reusable):
+                per_file[i] = cache['labels'][offsets[rows[i]]:offsets[rows[i] + 1]]
+    to_parse = np.flatnonzero(~reusable).tolist()
+
+    paths = [os.path.join(labels_dir, files[i]) for i in to_parse]
+    if workers is None:
+        workers = os.cpu_count() if len(paths) >= PARALLEL_MIN_FILES else 0
+    if workers and paths:
+        chunks = [paths[start:start + 256] for start in range(0, len(paths), 256)]
+        with ProcessPoolExecutor(workers) as executor:
+            parsed = [labels for chunk in executor.map(_parse_files, chunks) for labels in chunk]
+    else:
+        parsed = _parse_files(paths)
+    for i, labels in zip(to_parse, parsed):
+        per_file[i] = labels
+
+    counts = np.array([len(labels) for labels in per_file], dtype=np.int64)
+    labels = np.concatenate(per_file) if per_file else np.empty((0, 5), dtype=np.float32)
+    if to_parse or cached_files != len(files):
+        np.savez(cache_path, version=CACHE_VERSION, files=np.array(files, dtype=str), mtimes=mtimes, sizes=sizes,
+                 counts=counts, labels=labels)
+
+    index = LabelIndex(files, counts, labels)
+    index.parsed = len(to_parse)
+    index.reused = len(files) - len(to_parse)
+    return index
+
+
+def index_dataset(data_path=DATA_PATH, splits=('train', 'val', 'test'), workers=None):
+    """Return {split: LabelIndex} of the 'labels' folders of the splits of a dataset configuration (data.yaml)."""
+    return {split: load_index(os.path.join(dataset_split_dir(data_path, split), 'labels'), workers=workers)
+            for split in splits}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH, help='dataset configuration, its splits are indexed')
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--labels', help='index this labels folder instead of the dataset splits')
+    parser.add_argument('--workers', type=int, help='parsing processes, 0 parses in this process')
+    parser.add_argument('--json', help='also write the reports to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.labels:
+        indexes = {args.labels: load_index(args.labels, workers=args.workers)}
+    else:
+        indexes = index_dataset(args.data, args.splits, args.workers)
+
+    reports = {}
+    for split, index in indexes.items():
+        report = reports[split] = index.imbalance_report()
+        print(f"{split}: {report['images']} images ({index.parsed} parsed, {index.reused} from the cache), "
+              f"{report['boxes']} boxes, {report['objects_per_image']['mean']} per image, "
+              f"imbalance ratio {report['imbalance_ratio']}")
+        for name, values in report['classes'].items():
+            print(f"    {name:<12} {values['boxes']:>7} boxes {values['images']:>7} images {values['share']:>7.1%}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
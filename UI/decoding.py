@@ -0,0 +1,290 @@
+"""
+Video decoders with the interface of cv.VideoCapture (isOpened, read, get, release), so the pipelines take either:
+
+- 'opencv': cv.VideoCapture, optionally with hardware decoding (CAP_PROP_HW_ACCELERATION)
+- 'pyav': FFmpeg through PyAV, with frame-threaded decoding, scaling and BGR conversion in one swscale pass, and
+  keyframe-only decoding for fast scans
+
+Both can scale the frames at decode time (the model resizes them to 640 anyway) and prefetch them in a background
+thread into a ring of preallocated frames.
+"""
+import queue
+import sys
+import threading
+
+import cv2 as cv
+import numpy as np
+
+DECODERS = ('opencv', 'pyav')
+
+
+def decode_size(width, height, max_size):
+    """Frame size with its longest side at most `max_size` (even, for the codecs), the same size without it."""
+    if not max_size or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+
+class FrameRing:
+    """
+    Ring of preallocated frames. A frame is reused once the ring came back to it, unless it is still referenced
+    (queued, being annotated, or a view of it is): a new frame then takes its place, so a frame is never overwritten
+    while in use.
+    """
+
+    def __init__(self, size):
+        self.frames = [None] * size
+        self.index = 0
+        self.allocated = 0
+
+    def next(self, shape):
+        index = self.index
+        self.index = (index + 1) % len(self.frames)
+        # References: the list and the argument of getrefcount
+        if self.frames[index] is None or self.frames[index].shape != shape or sys.getrefcount(self.frames[index]) > 2:
+            self.frames[index] = np.empty(shape, dtype=np.uint8)
+            self.allocated += 1
+        return self.frames[index]
+
+
+class PrefetchCapture:
+    """
+    Base of the decoders: a background thread decodes up to `prefetch` frames ahead into a FrameRing, read() takes
+    them in order. With `prefetch` 0, read() decodes on the calling thread.
+    Subclasses implement _decode(frame_ring) -> frame or None at the end, and _close().
+    """
+
+    def __init__(self, prefetch=4, ring_size=8):
+        self.ring = FrameRing(max(ring_size, prefetch + 2))
+        self.prefetch = prefetch
+        self.frames_read = 0
+        self.opened = False
+        self.queue = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        # Incremented by seeks, frames decoded before a seek are dropped
+        self.generation = 0
+
+    def _start(self):
+        self.opened = True
+        if self.prefetch:
+            self.queue = queue.Queue(maxsize=self.prefetch)
+            self.thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self.thread.start()
+
+    def _prefetch_loop(self):
+        try:
+            while not self.stop_event.is_set():
+                with self.lock:
+                    frame = self._decode(self.ring)
+                    generation = self.generation
+                self._put(frame, generation)
+                if frame is None:
+                    break
+        except Exception:
+            # Wake the reader up with the end of the stream
+            self._put(None)
+            raise
+
+    def _put(self, frame, generation=None):
+        """Queue `frame` for read(), unless the capture is released or, for a frame of `generation`, seeked."""
+        while not self.stop_event.is_set() and (generation is None or generation == self.generation):
+            try:
+                self.queue.put(frame, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        if self.thread is not None:
+            frame = self.queue.get()
+            if frame is None:
+                # Keep answering the end of the stream
+                self.queue.put(None)
+        else:
+            frame = self._decode(self.ring)
+        if frame is None:
+            return False, None
+        self.frames_read += 1
+        return True, frame
+
+    def release(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.opened:
+            self._close()
+            self.opened = False
+
+    def stats(self):
+        """Frames read and frames allocated by the ring (the others reused a preallocated frame)."""
+        return {'frames': self.frames_read, 'allocated': self.ring.allocated}
+
+    def _decode(self, ring):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+
+class OpenCVCapture(PrefetchCapture):
+    """
+    cv.VideoCapture with decode-time scaling into preallocated frames and prefetching.
+    Parameters:
+        - source (str or int): video file, stream URL or camera index
+        - max_size (int): longest side of the frames, None keeps the source size
+        - hw_accel (bool): ask OpenCV (FFmpeg backend) for hardware decoding when the platform has it
+        - prefetch (int), ring_size (int): see PrefetchCapture and FrameRing
+    """
+
+    def __init__(self, source, max_size=None, hw_accel=False, prefetch=4, ring_size=8):
+        super().__init__(prefetch, ring_size)
+        if hw_accel:
+            self.cap = cv.VideoCapture(source, cv.CAP_FFMPEG, [cv.CAP_PROP_HW_ACCELERATION, cv.VIDEO_ACCELERATION_ANY])
+        else:
+            self.cap = cv.VideoCapture(source)
+        # get() answers 0 for the size of a capture that could not be opened, as cv.VideoCapture does
+        self.size = (0, 0)
+        if not self.cap.isOpened():
+            return
+        width, height = int(self.cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+        self.size = decode_size(width, height, max_size)
+        self.scaled = self.size != (width, height)
+        # Decoded frame reused by cap.read() when the frames are scaled after decoding
+        self.decoded = None
+        self._start()
+
+    def _decode(self, ring):
+        if self.scaled:
+            ret, self.decoded = self.cap.read(self.decoded)
+            if not ret:
+                return None
+            frame = ring.next((self.size[1], self.size[0], 3))
+            cv.resize(self.decoded, self.size, dst=frame, interpolation=cv.INTER_LINEAR)
+            return frame
+        frame = ring.next((self.size[1], self.size[0], 3))
+        ret, decoded = self.cap.read(frame)
+        if not ret:
+            return None
+        return decoded
+
+    def get(self, prop):
+        if prop == cv.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0])
+        if prop == cv.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1])
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            return float(self.frames_read)
+        return self.cap.get(prop)
+
+    def _close(self):
+        self.cap.release()
+
+
+class PyAVCapture(PrefetchCapture):
+    """
+    FFmpeg decoding through PyAV: frame-threaded decoding on `threads` threads, scaling and conversion to BGR in one
+    swscale pass, and keyframe-only decoding.
+    Parameters:
+        - source (str): video file or stream URL
+        - max_size (int): longest side of the frames, None keeps the source size
+        - threads (int): decoding threads, 0 lets FFmpeg choose
+        - keyframes_only (bool): decode only the keyframes (e.g. one frame every 1 to 10 s), for fast scans
+        - prefetch (int), ring_size (int): see PrefetchCapture and FrameRing
+    """
+
+    def __init__(self, source, max_size=None, threads=0, keyframes_only=False, prefetch=4, ring_size=8):
+        super().__init__(prefetch, ring_size)
+        try:
+            import av
+        except ImportError as error:
+            raise ImportError('The PyAV decoder requires av: pip install av') from error
+
+        # get() answers 0 on a source that could not be opened, as cv.VideoCapture does
+        self.size = (0, 0)
+        self.fps = 0.0
+        self.stream = None
+        try:
+            self.container = av.open(source)
+        except (av.error.FFmpegError, OSError):
+            return
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.stream.thread_count = threads
+        if keyframes_only:
+            self.stream.codec_context.skip_frame = 'NONKEY'
+        context = self.stream.codec_context
+        self.size = decode_size(context.width, context.height, max_size)
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or 0)
+        self.frames = self.container.decode(self.stream)
+        self._start()
+
+    def _decode(self, ring):
+        for decoded in self.frames:
+            frame = ring.next((self.size[1], self.size[0], 3))
+            converted = decoded.reformat(width=self.size[0], height=self.size[1], format='bgr24',
+                                         interpolation='BILINEAR')
+            np.copyto(frame, converted.to_ndarray())
+            return frame
+        return None
+
+    def get(self, prop):
+        if prop == cv.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0])
+        if prop == cv.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1])
+        if prop == cv.CAP_PROP_FRAME_COUNT:
+            return float(self.stream.frames) if self.stream is not None else 0.0
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            return float(self.frames_read)
+        return 0.0
+
+    def seek(self, seconds):
+        """Continue from the keyframe at or before `seconds` (fast, no decoding of the frames in between)."""
+        with self.lock:
+            self.container.seek(int(seconds / self.stream.time_base), stream=self.stream, backward=True,
+                                any_frame=False)
+            self.frames = self.container.decode(self.stream)
+            self.generation += 1
+            if self.queue is not None:
+                # Drop the frames prefetched before the seek
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+
+    def _close(self):
+        self.container.close()
+
+
+def open_video(source, decoder='opencv', max_size=None, hw_accel=False, prefetch=4, ring_size=8, **options):
+    """
+    Open a video file, stream or camera with one of DECODERS.
+    Parameters:
+        - decoder (str): one of DECODERS. 'opencv' without scaling, hardware decoding nor prefetching returns a plain
+    cv.VideoCapture
+        - max_size (int): longest side of the decoded frames, None keeps the source size
+        - hw_accel (bool): hardware decoding ('opencv')
+        - prefetch (int): frames decoded ahead in a background thread, 0 decodes in read()
+        - ring_size (int): preallocated frames, see FrameRing
+        - options: keyword arguments of the decoder class (threads, keyframes_only for 'pyav')
+    Returns:
+        - the capture, check isOpened()
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder '{decoder}', expected one of {DECODERS}")
+    if decoder == 'pyav':
+        if isinstance(source, int):
+            raise ValueError('The PyAV decoder does not open camera indexes, use the opencv decoder')
+        return PyAVCapture(source, max_size=max_size, prefetch=prefetch, ring_size=ring_size, **options)
+    if not max_size and not hw_accel and not prefetch:
+        return cv.VideoCapture(source)
+    return OpenCVCapture(source, max_size=max_size, hw_accel=hw_accel, prefetch=prefetch, ring_size=ring_size)
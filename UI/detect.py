@@ -0,0 +1,414 @@
+"""
+Headless command line of the detection modes, for machines without a display. It does not import PyQt5, tkinter
+or PIL.
+
+    python detect.py image site.jpg --mode Detect --output site_detect.jpg
+    python detect.py video site.mp4 --mode Tracking --output site_tracking.mp4 --results site_tracking.jsonl
+    python detect.py stream rtsp://192.168.1.10/stream1 --mode Detect --results live.jsonl
+    python detect.py analyze site.mp4 --mode Detect --batch-size 16
+    python detect.py video gate.mp4 --mode Inspection --zones zones.yaml --camera gate
+    python detect.py --backend openvino --int8 video site.mp4 --mode Detect --output site_detect.mp4
+    python detect.py multi rtsp://cam1/stream rtsp://cam2/stream --mode Tracking --results-dir results --workers 2
+    python detect.py video site.mp4 --mode Detect --overlay --metrics-port 9108 --profile site.prof
+    python detect.py --cache-dir .detection_cache analyze site.mp4 --mode Tracking
+    python detect.py video site.mp4 --mode Tracking --required-workers 4 --ppe-rule "Full PPE=Helmet,Safety Vest,Gloves"
+    python detect.py analyze site_4k.mp4 --mode Detect --decoder pyav --decode-size 1280
+    python detect.py stream rtsp://cam/stream --mode Tracking --alert-webhook http://site.local/ppe --alert-spool spool
+    python detect.py stream rtsp://cam/stream --mode Detect --live-port 8081 --live-host 0.0.0.0
+"""
+import argparse
+import datetime
+import functools
+import json
+import sys
+import time
+
+import cv2 as cv
+
+from alerts import AlertDispatcher, MQTTSink, SpoolSink, WebhookSink
+from backends import BACKENDS, load_detector
+from decoding import DECODERS, open_video
+from detection_cache import CachedDetector, DetectionCache, content_key, model_key, source_key
+from engine import MODES, VideoClock, build_mode, is_live_source
+from multicam import MultiCameraMonitor
+from offline import ResultWriter, analyze_video
+from pipeline import DROP_POLICIES, VideoPipeline
+from streaming import MJPEGServer
+from profiling import FrameProfiler, MetricsServer
+from startup import StartupReport, warm_up
+from zones import load_zones
+
+MODEL_PATH = 'runs/detect/yolov8m.pt_train_120_epochs/weights/best.pt'
+
+
+def load_model(model_path, backend='torch', int8=False):
+    return load_detector(model_path, backend, int8)
+
+
+def tracking_options(args):
+    """Keyword arguments of TrackingMode from the command line."""
+    rules = None
+    if args.ppe_rule:
+        rules = {}
+        for rule in args.ppe_rule:
+            name, _, labels = rule.partition('=')
+            rules[name.strip()] = tuple(label.strip() for label in labels.split(','))
+    return {'result_path': args.tracking_file, 'required_workers': args.required_workers, 'ppe_rules': rules,
+            'report_interval': args.report_interval}
+
+
+def detect_image_file(model, image_path, mode, output_path=None, zones=None, tiling=False, cache=None,
+                      model_key=None):
+    """
+    Run a mode on a single image. With a `cache` (DetectionCache), the detections of an image already seen by the
+    model `model_key` (see detection_cache.model_key) are read from it. The Tracking mode writes no result file.
+    Returns:
+        - dict: the record of the mode for the image, with the result text lines under 'text'
+    """
+    image = cv.imread(image_path, cv.IMREAD_COLOR)
+    if image is None:
+        raise IOError(f'Could not read image file {image_path}')
+    # A single image has no tracking history worth a result file
+    options = {'result_path': None} if mode == 'Tracking' else {}
+    frame_mode = build_mode(model, mode, zones=zones, tiling=tiling, **options)
+    if cache is not None:
+        zones_key = [zone.key() for zone in zones or []]
+        frame_mode.model = CachedDetector(frame_mode.model, cache, content_key(model_key, zones_key, tiling))
+    image, text = frame_mode.process(image, frame_mode.infer(image))
+    frame_mode.close()
+    if output_path:
+        cv.imwrite(output_path, image)
+    return {**frame_mode.record, 'text': text}
+
+
+def run_video(model, source, mode, output_path=None, results_path=None, realtime=False, drop_policy='block',
+              queue_size=4, inference_stride=1, zones=None, tiling=False, show_stats=False, mode_options=None,
+              report=None, profiler=None, overlay=False, motion_gate=False, max_reuse=30, cache=None,
+              source_key=None, decoder='opencv', decode_size=None, hw_decode=False, alerts=None, live=None,
+              start_time=None):
+    """
+    Run a mode on a video file or a live stream through the same VideoPipeline as the GUI, without display.
+    Stops at the end of the stream or on Ctrl+C. `mode_options` are given to the mode constructor, `report`
+    (startup.StartupReport) receives the latency of the first frame, `profiler` and `overlay` are given to the
+    pipeline, `motion_gate`, `max_reuse`, `cache` and `source_key` to engine.build_mode (the cache needs every
+    frame: 'block' drop policy, video file). The annotations are only drawn when `output_path` is given. `decoder`,
+    `decode_size` and `hw_decode` are given to decoding.open_video, `alerts` (alerts.AlertDispatcher) to
+    engine.build_mode. The annotated frames are also published to `live` (streaming.MJPEGServer). The Tracking mode
+    of a video file going through every frame ('block' drop policy) follows the time of the video from `start_time`
+    (see engine.VideoClock), a camera or stream the current time.
+    Returns:
+        - dict: the final pipeline stats
+    """
+    # The pipeline already decodes in its own thread
+    cap = open_video(source, decoder, max_size=decode_size, hw_accel=hw_decode, prefetch=0)
+    if not cap.isOpened():
+        raise IOError(f'Error opening video stream or file {source}')
+    fps = cap.get(cv.CAP_PROP_FPS)
+    writer = ResultWriter(output_path, results_path, fps)
+    mode_options = dict(mode_options or {})
+    if mode == 'Tracking' and drop_policy == 'block' and not is_live_source(source):
+        mode_options.setdefault('clock', VideoClock(fps, start_time))
+    frame_mode = build_mode(model, mode, zones=zones, inference_stride=inference_stride, tiling=tiling,
+                            motion_gate=motion_gate, max_reuse=max_reuse, cache=cache, source_key=source_key,
+                            draw=bool(output_path) or live is not None, alerts=alerts, **mode_options)
+
+    def print_stats(stats):
+        print(json.dumps(stats), file=sys.stderr)
+
+    start = time.perf_counter()
+
+    def write_result(frame, text, record):
+        if report is not None and 'first_frame' not in report.phases:
+            report.add('first_frame', time.perf_counter() - start)
+        writer.write(frame, text, record)
+        if live is not None:
+            live.publish(frame)
+
+    pipeline = VideoPipeline(cap, frame_mode, queue_size=queue_size, drop_policy=drop_policy, realtime=realtime,
+                             profiler=profiler, overlay=overlay, on_result=write_result,
+                             on_finished=lambda lines: print('\n'.join(lines)),
+                             on_stats=print_stats if show_stats else None)
+    pipeline.start()
+    try:
+        while not pipeline.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pipeline.stop()
+    finally:
+        writer.close()
+    return pipeline.stats()
+
+
+def run_multi(model, sources, mode, batch_size=8, workers=0, model_factory=None, results_dir=None, realtime=True,
+              drop_policy='drop_oldest', show_stats=False, mode_options=None, live=None, consumers=0):
+    """
+    Monitor several sources with a shared, batched detector (see multicam.MultiCameraMonitor), without display.
+    Stops when all the sources ended or on Ctrl+C. The annotated frames of every camera are also published to `live`
+    (streaming.MJPEGServer), one stream per camera.
+    Returns:
+        - dict: the final stats
+    """
+    def print_stats(stats):
+        print(json.dumps(stats), file=sys.stderr)
+
+    monitor = MultiCameraMonitor(model, sources, mode, batch_size=batch_size, workers=workers, consumers=consumers,
+                                 model_factory=model_factory, drop_policy=drop_policy, realtime=realtime,
+                                 results_dir=results_dir, mode_options=mode_options,
+                                 on_result=live.on_camera_result if live is not None else None,
+                                 on_finished=lambda lines: print('\n'.join(lines)),
+                                 on_stats=print_stats if show_stats else None)
+    monitor.start()
+    try:
+        while not monitor.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        monitor.stop()
+    return monitor.stats()
+
+
+def add_tracking_arguments(parser):
+    parser.add_argument('--required-workers', type=int, default=5,
+                        help="Tracking mode required number of workers of each zone (a zone's required_workers in "
+                             "the zone configuration takes precedence)")
+    parser.add_argument('--ppe-rule', action='append',
+                        help="Tracking mode compliance rule 'NAME=PPE,PPE', e.g. 'Full PPE=Helmet,Safety Vest,Gloves' "
+                             "(repeat for several rules, default: helmet, vest, helmet and vest)")
+    parser.add_argument('--report-interval', type=float, default=1.0,
+                        help='seconds between two rows of the Tracking mode result file')
+
+
+def timestamp_arg(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def add_start_time_argument(parser):
+    parser.add_argument('--start-time', type=timestamp_arg,
+                        help="recording time of the first frame of a video file, e.g. '2024-05-02 07:30:00', for the "
+                             "Tracking mode reports (default: the start of the run)")
+
+
+def add_decoder_arguments(parser):
+    parser.add_argument('--decoder', choices=DECODERS, default='opencv',
+                        help='video decoder, pyav decodes on several threads (pip install av)')
+    parser.add_argument('--decode-size', type=int,
+                        help='scale the frames at decode time to this longest side, e.g. 1280 for 4K sources')
+    parser.add_argument('--hw-decode', action='store_true',
+                        help='hardware decoding when the platform has it (opencv decoder)')
+
+
+def add_alert_arguments(parser):
+    parser.add_argument('--alert-webhook', help='POST the alerts on the persons without helmet nor vest to this URL')
+    parser.add_argument('--alert-mqtt', help='publish the alerts to this MQTT broker, HOST or HOST:PORT (paho-mqtt)')
+    parser.add_argument('--alert-topic', default='ppe/alerts', help='MQTT topic prefix, the camera name is appended')
+    parser.add_argument('--alert-spool', help='write the alerts and their snapshots to this folder')
+    parser.add_argument('--alert-cooldown', type=float, default=60.0,
+                        help='seconds before the same tracked person (or zone in Detect mode) alerts again')
+    parser.add_argument('--alert-rate', type=float, default=6, help='maximum alert notifications per minute')
+
+
+def add_live_arguments(parser):
+    parser.add_argument('--live-port', type=int,
+                        help='watch the annotated frames in a browser on http://HOST:PORT/ (MJPEG)')
+    parser.add_argument('--live-host', default='127.0.0.1',
+                        help='listening address of the live view, 0.0.0.0 for the other machines')
+    parser.add_argument('--live-size', type=int, default=960, help='longest side of the live frames')
+    parser.add_argument('--live-quality', type=int, default=75, help='JPEG quality of the live frames')
+    parser.add_argument('--live-fps', type=float, default=15.0, help='maximum frames per second of the live view')
+
+
+def live_server(args):
+    """Started MJPEGServer of the command line, None without --live-port."""
+    if args.live_port is None:
+        return None
+    server = MJPEGServer(args.live_host, args.live_port, max_size=args.live_size, quality=args.live_quality,
+                         max_fps=args.live_fps).start()
+    print(f'Live view on http://{args.live_host}:{server.port}/', file=sys.stderr)
+    return server
+
+
+def alert_dispatcher(args, zones):
+    """AlertDispatcher of the sinks given on the command line, None without any."""
+    sinks = []
+    if args.alert_webhook:
+        sinks.append(WebhookSink(args.alert_webhook))
+    if args.alert_mqtt:
+        host, _, port = args.alert_mqtt.partition(':')
+        sinks.append(MQTTSink(host, int(port or 1883), topic=args.alert_topic))
+    if args.alert_spool:
+        sinks.append(SpoolSink(args.alert_spool))
+    if not sinks:
+        return None
+    return AlertDispatcher(sinks, zones=zones, camera=args.camera, cooldown=args.alert_cooldown, rate=args.alert_rate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_PATH, help='YOLO weights')
+    parser.add_argument('--backend', choices=BACKENDS, default='torch',
+                        help='inference backend, the weights are exported the first time for onnx and openvino')
+    parser.add_argument('--int8', action='store_true',
+                        help='INT8 quantized model calibrated on the data.yaml validation split (onnx, openvino)')
+    parser.add_argument('--zones', help='zone configuration (.yaml or .json), see zones.example.yaml')
+    parser.add_argument('--camera', default='default', help='camera of the zone configuration')
+    parser.add_argument('--tiling', action='store_true',
+                        help='look for gloves, glasses and dust masks in high-resolution crops of the persons')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='print the durations of the runtime import, model load, warm-up and first frame')
+    parser.add_argument('--cache-dir', help='on-disk detection cache: images and video files already seen by the '
+                                            'model are replayed from it (image, video, analyze)')
+    parser.add_argument('--cache-size', type=int, default=512, help='maximum size of the detection cache in MB')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    image_parser = commands.add_parser('image', help='detect on an image')
+    image_parser.add_argument('path')
+    image_parser.add_argument('--mode', choices=list(MODES), default='Normal')
+    image_parser.add_argument('--output', help='annotated image path')
+
+    for command, help_text, drop_policy in [('video', 'detect on a video file, every frame is processed', 'block'),
+                                            ('stream', 'detect on a camera index or a stream URL', 'drop_oldest')]:
+        video_parser = commands.add_parser(command, help=help_text)
+        video_parser.add_argument('source')
+        video_parser.add_argument('--mode', choices=list(MODES), default='Detect')
+        video_parser.add_argument('--output', help='annotated video path')
+        video_parser.add_argument('--results', help='JSON Lines results path')
+        video_parser.add_argument('--drop-policy', choices=DROP_POLICIES, default=drop_policy)
+        video_parser.add_argument('--queue-size', type=int, default=4)
+        video_parser.add_argument('--stride', type=int, default=1,
+                                  help='run the detector every N frames at most, boxes follow the optical flow in '
+                                       'between')
+        video_parser.add_argument('--motion-gate', action='store_true',
+                                  help='skip the detector while the scene does not change (fixed cameras)')
+        video_parser.add_argument('--max-reuse', type=int, default=30,
+                                  help='maximum frames in a row the motion gate reuses the previous detections')
+        video_parser.add_argument('--stats', action='store_true', help='print the pipeline stats every second')
+        video_parser.add_argument('--tracking-file', default='Tracking_State.csv',
+                                  help='Tracking mode result file (.csv, .jsonl or .parquet)')
+        video_parser.add_argument('--rotation', choices=['hour', 'day'], help='start a new tracking file every period')
+        add_tracking_arguments(video_parser)
+        add_start_time_argument(video_parser)
+        add_decoder_arguments(video_parser)
+        add_alert_arguments(video_parser)
+        add_live_arguments(video_parser)
+        video_parser.add_argument('--overlay', action='store_true',
+                                  help='write the per-stage latency percentiles on the output frames')
+        video_parser.add_argument('--profile-log', help='JSON Lines log of the per-stage latency percentiles')
+        video_parser.add_argument('--metrics-port', type=int,
+                                  help='serve the per-stage latencies on http://127.0.0.1:PORT/metrics (Prometheus)')
+        video_parser.add_argument('--profile', help='cProfile dump of the inference thread (pstats format)')
+        video_parser.add_argument('--profile-frames', type=int, default=300, help='number of frames of --profile')
+
+    multi_parser = commands.add_parser('multi', help='monitor several sources with a shared batched detector')
+    multi_parser.add_argument('sources', nargs='+', help='video files, camera indexes or stream URLs')
+    multi_parser.add_argument('--mode', choices=list(MODES), default='Detect')
+    multi_parser.add_argument('--batch-size', type=int, default=8, help='maximum frames per model call')
+    multi_parser.add_argument('--workers', type=int, default=0,
+                              help='inference processes, each loads its own model (0: run in this process)')
+    multi_parser.add_argument('--consumers', type=int, default=0,
+                              help='processes running the tracking, compliance and drawing of the cameras, with '
+                                   '--workers (0: run them in this process)')
+    multi_parser.add_argument('--results-dir', help='directory of the per-camera JSON Lines results')
+    multi_parser.add_argument('--drop-policy', choices=DROP_POLICIES, default='drop_oldest')
+    multi_parser.add_argument('--no-realtime', action='store_true',
+                              help='decode video files as fast as possible instead of at their FPS')
+    multi_parser.add_argument('--stats', action='store_true', help='print the stats every second')
+    multi_parser.add_argument('--tracking-file', default='Tracking_State.csv',
+                              help='Tracking mode result file, suffixed with the camera name')
+    add_tracking_arguments(multi_parser)
+    add_live_arguments(multi_parser)
+
+    analyze_parser = commands.add_parser('analyze', help='offline analysis of a video file with batched inference')
+    analyze_parser.add_argument('source')
+    analyze_parser.add_argument('--mode', choices=list(MODES), default='Detect')
+    analyze_parser.add_argument('--batch-size', type=int, default=8)
+    analyze_parser.add_argument('--output', help='annotated video path, defaults to <video>_<mode>.mp4')
+    analyze_parser.add_argument('--results', help='JSON Lines results path, defaults to <video>_<mode>.jsonl')
+    analyze_parser.add_argument('--tracking-file',
+                                help='Tracking mode result file (.csv, .jsonl or .parquet), defaults to '
+                                     '<results>_tracking.csv')
+    add_tracking_arguments(analyze_parser)
+    add_start_time_argument(analyze_parser)
+    add_decoder_arguments(analyze_parser)
+
+    args = parser.parse_args(argv)
+    report = StartupReport()
+    model = None
+    # Worker processes load their own model
+    if args.command != 'multi' or args.workers == 0:
+        # ultralytics is imported by load_detector, with the model
+        with report.phase('model_load'):
+            model = load_model(args.model, args.backend, args.int8)
+        if args.command in ('video', 'stream'):
+            # The first frames of a stream are not delayed (or dropped) by the lazy initialisation of the model
+            with report.phase('warmup'):
+                warm_up(model)
+    zones = load_zones(args.zones, args.camera) if args.zones else None
+    cache = key = None
+    if args.cache_dir and args.command in ('image', 'video', 'analyze'):
+        cache = DetectionCache(args.cache_dir, max_bytes=args.cache_size << 20)
+        key = model_key(args.model, args.backend, args.int8)
+        if args.command != 'image':
+            key = source_key(key, args.source, args.decode_size)
+
+    if args.command == 'image':
+        print(json.dumps(detect_image_file(model, args.path, args.mode, args.output, zones, args.tiling, cache, key)))
+    elif args.command in ('video', 'stream'):
+        # Camera indexes are given as numbers
+        source = int(args.source) if args.source.isdigit() else args.source
+        mode_options = {}
+        if args.mode == 'Tracking':
+            mode_options = {**tracking_options(args), 'rotation': args.rotation}
+        profiler = FrameProfiler(log_path=args.profile_log, cprofile_path=args.profile,
+                                 cprofile_frames=args.profile_frames)
+        server = MetricsServer(profiler, port=args.metrics_port).start() if args.metrics_port else None
+        alerts = alert_dispatcher(args, zones)
+        live = live_server(args)
+        try:
+            stats = run_video(model, source, args.mode, args.output, args.results, drop_policy=args.drop_policy,
+                              queue_size=args.queue_size, inference_stride=args.stride, zones=zones,
+                              tiling=args.tiling, show_stats=args.stats, mode_options=mode_options, report=report,
+                              profiler=profiler, overlay=args.overlay, motion_gate=args.motion_gate,
+                              max_reuse=args.max_reuse, cache=cache if args.drop_policy == 'block' else None,
+                              source_key=key, decoder=args.decoder, decode_size=args.decode_size,
+                              hw_decode=args.hw_decode, alerts=alerts, live=live, start_time=args.start_time)
+        finally:
+            if server is not None:
+                server.stop()
+            if live is not None:
+                live.stop()
+            if alerts is not None:
+                alerts.close()
+        if alerts is not None:
+            stats['alerts'] = alerts.stats()
+        print(json.dumps({**stats, 'latency': profiler.summary()}))
+    elif args.command == 'multi':
+        if zones is not None:
+            parser.error('--zones is not supported with several sources yet')
+        sources = [int(source) if source.isdigit() else source for source in args.sources]
+        mode_options = tracking_options(args) if args.mode == 'Tracking' else {}
+        model_factory = functools.partial(load_model, args.model, args.backend, args.int8)
+        live = live_server(args)
+        try:
+            stats = run_multi(model, sources, args.mode, batch_size=args.batch_size, workers=args.workers,
+                              model_factory=model_factory, results_dir=args.results_dir,
+                              realtime=not args.no_realtime, drop_policy=args.drop_policy, show_stats=args.stats,
+                              mode_options=mode_options, live=live, consumers=args.consumers)
+        finally:
+            if live is not None:
+                live.stop()
+        print(json.dumps(stats))
+    else:
+        summary = analyze_video(model, args.source, args.mode, batch_size=args.batch_size, output_path=args.output,
+                                results_path=args.results, zones=zones, tiling=args.tiling, cache=cache,
+                                source_key=key, decoder=args.decoder, decode_size=args.decode_size,
+                                hw_decode=args.hw_decode, start_time=args.start_time,
+                                mode_options=tracking_options(args) if args.mode == 'Tracking' else None,
+                                progress=lambda frames: print(f'\r{frames} frames', end='', file=sys.stderr))
+        print(file=sys.stderr)
+        print('\n'.join(summary.pop('messages')))
+        print(json.dumps(summary))
+    if args.startup_report:
+        print(json.dumps({'startup': report.as_dict()}), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import functools
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from detections import Detections
+from pipeline import StageCounter
+
+
+def content_key(*parts):
+    """Hex digest of `parts` (bytes, NumPy arrays or anything with a stable repr)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(repr((part.shape, part.dtype.str)).encode())
+            part = np.ascontiguousarray(part).data
+        elif not isinstance(part, bytes):
+            part = repr(part).encode()
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=8)
+def _file_hash(path, size, mtime_ns):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    """Content hash of a file, or of the files of a folder (OpenVINO model), computed once per modification."""
+    paths = [path] if os.path.isfile(path) else sorted(os.path.join(root, name) for root, _, names in os.walk(path)
+                                                       for name in names)
+    hashes = []
+    for item in paths:
+        stat = os.stat(item)
+        hashes.append(_file_hash(item, stat.st_size, stat.st_mtime_ns))
+    return content_key(*hashes)
+
+
+def model_key(weights, backend='torch', int8=False, imgsz=640):
+    """Key of the detections of a model: content of the weights, backend, quantization and input size."""
+    return content_key(file_hash(weights), backend, int8, imgsz)
+
+
+def source_key(model_key, path, decode_size=None):
+    """
+    Key of the detections of a video file by a model, the file being identified by path, size and mtime. Frames
+    scaled at decode time (`decode_size`, see decoding.open_video) give other detections.
+    """
+    stat = os.stat(path)
+    if decode_size:
+        return content_key(model_key, os.path.abspath(path), stat.st_size, stat.st_mtime_ns, decode_size)
+    return content_key(model_key, os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+class DetectionCache:
+    """
+    On-disk cache of raw detections, one .npy file per entry holding (M, 7) float32 rows
+    [frame, x1, y1, x2, y2, conf, cls] sorted by frame, read memory-mapped. Video entries start with a header row
+    [-1, number of frames, 0, 0, 0, 0, 0]. Entries are evicted least recently used first (the modification time of a
+    file is its last use) once the cache is larger than `max_bytes`.
+    Parameters:
+        - directory (str): cache folder, created when needed
+        - max_bytes (int): maximum total size of the entries
+    """
+
+    def __init__(self, directory='.detection_cache', max_bytes=512 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key):
+        """Return the memory-mapped rows of `key`, or None."""
+        path = self.path(key)
+        try:
+            rows = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return rows
+
+    def put(self, key, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.float32).reshape(-1, 7)
+        path = self.path(key)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            np.save(file, rows)
+        os.replace(temporary, path)
+        self.evict()
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.npy'))
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in `max_bytes`."""
+        entries = sorted((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.directory) if entry.name.endswith('.npy'))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def to_rows(detections, frame=0):
+    boxes = Detections.from_results(detections).boxes
+    rows = np.empty((len(boxes), 7), dtype=np.float32)
+    rows[:, 0] = frame
+    rows[:, 1:] = boxes.data
+    return rows
+
+
+def from_rows(rows, names):
+    rows = np.asarray(rows)
+    return Detections(rows[:, 1:5], rows[:, 5], rows[:, 6], names)
+
+
+class CachedDetector:
+    """
+    Model wrapper answering images already seen by the model from the cache, keyed by the model and the image
+    content, e.g. an image opened again in the GUI. Misses of a batch run in one model call.
+    Parameters:
+        - model (YOLO object): the detection model
+        - cache (DetectionCache): the cache, None calls the model without hashing the images
+        - model_key (str): see model_key()
+    """
+
+    def __init__(self, model, cache, model_key):
+        self.model = model
+        self.names = model.names
+        self.cache = cache
+        self.model_key = model_key
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        if self.cache is None:
+            return [Detections.from_results(result) for result in self.model(images, **kwargs)]
+        keys = [content_key(self.model_key, sorted(kwargs.items()), image) for image in images]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, rows in enumerate(results) if rows is None]
+        if missing:
+            for i, detections in zip(missing, self.model([images[i] for i in missing], **kwargs)):
+                rows = to_rows(detections)
+                self.cache.put(keys[i], rows)
+                results[i] = rows
+        return [from_rows(rows, self.names) for rows in results]
+
+
+class VideoReplayDetector:
+    """
+    Model wrapper recording the detections of the frames of a video file by frame index, and replaying them when the
+    same video goes through the same model and inference options again, e.g. with another mode whose
+    post-processing differs. A replayed frame with the same rows as the previous one gets the same Detections object,
+    as the MotionGate gave it when recording, so the modes reuse the PPE status computed from it. Frames beyond a
+    recorded (stopped) run are detected and the entry is extended on close.
+    The frames must all be given in order, one call per frame or per batch (no dropped frames).
+    Parameters:
+        - model (YOLO object): the detection model, with its inference wrappers
+        - cache (DetectionCache): the cache
+        - key (str): key of the video, the model and the options changing the detections
+    """
+
+    def __init__(self, model, cache, key):
+        self.model = model
+        self.names = model.names
+        self.cache = cache
+        self.key = key
+        entry = cache.get(key)
+        if entry is None or not len(entry) or entry[0, 0] != -1:
+            self.frames = 0
+            self.recorded = np.empty((0, 7), dtype=np.float32)
+        else:
+            self.frames = int(entry[0, 1])
+            self.recorded = entry[1:]
+        # Rows of frame i: recorded[offsets[i]:offsets[i + 1]], frames without detections have no rows
+        self.offsets = np.searchsorted(self.recorded[:, 0], np.arange(self.frames + 1), side='left')
+        self.new_rows = []
+        self.index = 0
+        self.counter = StageCounter()
+        self.replayed = 0
+        self.last = None
+        self.last_rows = None
+
+    def replayable(self, index):
+        return index < self.frames
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        results = []
+        first = self.index
+        for index in range(first, first + len(images)):
+            if self.replayable(index):
+                rows = self.recorded[self.offsets[index]:self.offsets[index + 1]]
+                if self.last is None or not np.array_equal(rows[:, 1:], self.last_rows):
+                    self.last = from_rows(rows, self.names)
+                    self.last_rows = rows[:, 1:]
+                results.append(self.last)
+                self.replayed += 1
+            else:
+                results.append(None)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            start = time.perf_counter()
+            detections = self.model([images[i] for i in missing], **kwargs)
+            self.counter.tick(time.perf_counter() - start)
+            for i, result in zip(missing, detections):
+                results[i] = Detections.from_results(result)
+                self.new_rows.append(to_rows(results[i], first + i))
+        self.index += len(images)
+        return results
+
+    def close(self):
+        """Store the recording extended with the frames detected in this run."""
+        if self.new_rows:
+            header = np.array([[-1, self.index, 0, 0, 0, 0, 0]], dtype=np.float32)
+            self.cache.put(self.key, np.concatenate([header, self.recorded] + self.new_rows))
+            self.frames = self.index
+            self.new_rows = []
+
+    def stats(self):
+        """Detector runs and the frames replayed from the cache."""
+        counter = self.counter
+        return {'fps': round(counter.fps(), 1), 'busy_ms': round(counter.busy_ms(), 1), 'frames': counter.frames,
+                'replayed': self.replayed}
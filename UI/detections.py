@@ -0,0 +1,56 @@
+import numpy as np
+
+from association import CLASSES_NAMES
+
+
+class Boxes:
+    """Array view of the boxes of a frame, with the attributes of ultralytics Boxes used by the modes."""
+
+    def __init__(self, data):
+        # data: (N, 6) [x1, y1, x2, y2, conf, cls]
+        self.data = data
+        self.xyxy = data[:, :4]
+        self.conf = data[:, 4]
+        self.cls = data[:, 5]
+
+    def __len__(self):
+        return len(self.data)
+
+
+class Detections:
+    """
+    Detections of one frame held in NumPy arrays. It has the part of the ultralytics Results interface used by the
+    modes (boxes.xyxy/cls/conf/data, names, cpu(), numpy()), so detections that do not come straight from the model
+    (propagated, replayed, from another backend) go through the same post-processing.
+    Parameters:
+        - xyxy (np.array): (N, 4) boxes
+        - conf (np.array): (N,) confidences
+        - cls (np.array): (N,) class ids
+        - names (dict): {class id: class name}
+    """
+
+    def __init__(self, xyxy, conf, cls, names=None):
+        data = np.zeros((len(conf), 6), dtype=np.float32)
+        data[:, :4] = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        data[:, 4] = conf
+        data[:, 5] = cls
+        self.boxes = Boxes(data)
+        self.names = names if names is not None else dict(enumerate(CLASSES_NAMES))
+
+    @classmethod
+    def from_results(cls, results):
+        """Convert an ultralytics Results (or Detections) object."""
+        if isinstance(results, Detections):
+            return results
+        results = results.cpu().numpy()
+        boxes = results.boxes
+        return cls(boxes.xyxy, boxes.conf, boxes.cls, results.names)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+    def __len__(self):
+        return len(self.boxes)
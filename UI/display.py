@@ -0,0 +1,48 @@
+import cv2 as cv
+import numpy as np
+from PyQt5.QtGui import QImage, QPixmap
+
+
+def fit_size(width, height, max_width, max_height):
+    """Largest (width, height) with the aspect ratio of the frame that fits in max_width x max_height."""
+    scale = min(max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class FrameDisplay:
+    """
+    Display adapter of a QLabel for BGR frames. The frame is first resized to the label size, then converted to RGB
+    into a buffer that is reused while the size does not change, and that buffer is wrapped as a QImage without
+    copying it. Only the label-sized image is copied once more, into the QPixmap.
+    Parameters:
+        - interpolation (int): OpenCV interpolation of the resize, nearest neighbour like the default (fast)
+    transformation of QPixmap.scaled
+    """
+
+    def __init__(self, interpolation=cv.INTER_NEAREST):
+        self.interpolation = interpolation
+        self.scaled = None
+        self.rgb = None
+        self.q_image = None
+
+    def to_qimage(self, frame, max_width, max_height):
+        """
+        Convert a BGR frame to a QImage fitting in max_width x max_height (aspect ratio kept).
+        The QImage shares the buffer of the adapter: it is valid until the next call.
+        """
+        size = fit_size(frame.shape[1], frame.shape[0], max(max_width, 1), max(max_height, 1))
+        if self.rgb is None or (self.rgb.shape[1], self.rgb.shape[0]) != size:
+            self.scaled = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.rgb = np.empty_like(self.scaled)
+            self.q_image = QImage(self.rgb.data, size[0], size[1], size[0] * 3, QImage.Format_RGB888)
+
+        if (frame.shape[1], frame.shape[0]) == size:
+            cv.cvtColor(frame, cv.COLOR_BGR2RGB, dst=self.rgb)
+        else:
+            cv.resize(frame, size, dst=self.scaled, interpolation=self.interpolation)
+            cv.cvtColor(self.scaled, cv.COLOR_BGR2RGB, dst=self.rgb)
+        return self.q_image
+
+    def show(self, frame, label):
+        """Display a BGR frame on a QLabel, scaled to the label size."""
+        label.setPixmap(QPixmap.fromImage(self.to_qimage(frame, label.width(), label.height())))
@@ -0,0 +1,443 @@
+"""
+Detection engine: the per-frame logic of every mode, without any GUI dependency. Used by the PyQt application
+(Detection.py) and by the headless command line (detect.py).
+"""
+import time
+from contextlib import nullcontext
+
+import cv2 as cv
+import numpy as np
+
+from association import CLASSES_NAMES, PERSON_CLASS, PPE_CLASSES, associate_ppe
+from compliance import ComplianceAggregator
+from detection_cache import VideoReplayDetector, content_key
+from motion import MotionGate
+from render import Renderer
+from sinks import create_sink
+from stride import StrideDetector
+from tiling import TiledPPEDetector
+from tracker import WorkerTracker
+from zones import Zone, ZoneDetector
+
+
+class FrameMode:
+    """
+    Per-frame processing of a mode, independent from the capture and the display so it can run on any thread.
+    Subclasses keep the state of the mode between frames and implement process(), which also fills `record` with
+    the figures of the last frame (written to the results file of offline analysis).
+    The pipeline running the mode sets `profiler` (profiling.FrameProfiler) to time the stages of the frames.
+    The annotations are drawn with `renderer` (render.Renderer), disabled when nobody looks at the frames.
+    The modes showing the "ALERT !!!" of Show_Status_and_Alert send the persons without PPE to `alerts`
+    (alerts.AlertDispatcher) when it is set.
+    """
+    name = None
+
+    def __init__(self, model):
+        self.model = model
+        self.record = {}
+        self.profiler = None
+        self.renderer = Renderer()
+        self.alerts = None
+        self.ppe_detects = None
+        self.ppe = None
+
+    def stage(self, name):
+        """Context manager timing the stage `name` (see profiling.STAGES) of the current frame."""
+        return nullcontext() if self.profiler is None else self.profiler.stage(name)
+
+    def model_input(self, frame):
+        """Return the image given to the model for `frame`."""
+        return frame
+
+    def input_key(self):
+        """Identity of model_input(): modes giving the model the same images share their cached detections."""
+        return None
+
+    def infer(self, frame):
+        with self.stage('preprocess'):
+            image = self.model_input(frame)
+        with self.stage('inference'):
+            return self.model(image)[0]
+
+    def infer_batch(self, frames):
+        """Run the model once on a batch of frames, return one result per frame."""
+        with self.stage('preprocess'):
+            images = [self.model_input(frame) for frame in frames]
+        with self.stage('inference'):
+            return self.model(images)
+
+    def ppe_status(self, detects):
+        """
+        ppe_inspection of `detects`. It is reused when the model returns the same detections object as for the
+        previous frame (motion.MotionGate on a static scene).
+        """
+        if detects is not self.ppe_detects:
+            self.ppe_detects, self.ppe = detects, ppe_inspection(detects)
+        return self.ppe
+
+    def process(self, frame, detects):
+        """
+        Annotate `frame` with the model results `detects`.
+        Returns:
+            - np.array: the annotated frame
+            - list or None: lines replacing the result text, None to keep it unchanged
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """Return the lines appended to the result text at the end of the video."""
+        return ["Stopped video playback"]
+
+    def close(self):
+        """Release the resources of the mode (result files, ...) once no more frames will be processed."""
+        if hasattr(self.model, 'close'):
+            self.model.close()
+
+
+# Normal mode
+class NormalMode(FrameMode):
+    name = 'Normal'
+
+    def process(self, frame, detects):
+        results = detects.cpu().numpy()
+        with self.stage('drawing'):
+            boxes = results.boxes.xyxy.astype(int) if len(results.boxes) else np.empty((0, 4), dtype=int)
+            self.renderer.boxes(frame, boxes, (0, 255, 0), 2)
+            self.renderer.labels(frame, [results.names[int(class_id)].upper() for class_id in results.boxes.cls],
+                                 boxes[:, [0, 1]] - [0, 10], cv.FONT_HERSHEY_COMPLEX, 0.6, (0, 255, 0), 1)
+        self.record = {'detections': len(detects.boxes)}
+        return frame, None
+
+
+# Mode 1: Inspection
+def check_overlap(r1, r2):
+    return not (r1[2] < r2[0] or r1[0] > r2[2] or r1[3] < r2[1] or r1[1] > r2[3])
+
+
+def create_ppe_status_string(ppe_status):
+    status_list = []
+    for item, status in ppe_status.items():
+        if status:
+            status_list.append(f"{item} <span style='color:green;'>&#10004;</span>")
+        else:
+            status_list.append(f"{item} <span style='color:red;'>&#10008;</span>")
+    return '<br>'.join(status_list)
+
+
+def ppe_inspection(results, **kwargs):
+    """
+    This function inspects PPE for workers.
+    Parameters:
+        - results (YOLO object): the results of YOLO model prediction for a frame.
+        - kwargs: scoring options forwarded to association.associate_ppe (scoring, min_ioa, region_rules, ...)
+    Returns:
+        - PPEAssociation: array-backed PPE status of each person, items() yields (person position, PPE status) pairs.
+    """
+    results = results.cpu().numpy()
+    boxes = results.boxes
+    return associate_ppe(boxes.xyxy.astype(int), boxes.cls.astype(int), boxes.conf, **kwargs)
+
+
+y_offset_start = 800
+line_height = 50
+
+# Checkpoint of the inspection camera: frame[17:1080, 610:1235] of a 1080p frame, a person is inspected when the box
+# starts in the top 50 px and ends in the bottom 13 px of the region
+INSPECTION_ZONE = Zone('checkpoint', rect=[610 / 1920, 17 / 1080, 1235 / 1920, 1.0], normalized=True,
+                       gate=[50 / 1063, 1050 / 1063])
+
+
+class InspectionMode(FrameMode):
+    name = 'Inspection'
+
+    def __init__(self, model, zone=INSPECTION_ZONE):
+        super().__init__(model)
+        self.zone = zone
+        self.gate = zone.gate or [0.05, 0.95]
+        self.person_index = 1
+        self.output_text = None
+        self.last_person_detected = False
+
+    def model_input(self, frame):
+        # Define the region of interest
+        return self.zone.crop(frame)
+
+    def input_key(self):
+        return self.zone.key()
+
+    def process(self, frame, detects):
+        classes = detects.cpu().numpy().boxes.cls.astype(int)
+        x1, y1, x2, y2 = self.zone.bounds(frame)
+        gate_top, gate_bottom = self.gate[0] * (y2 - y1), self.gate[1] * (y2 - y1)
+
+        text = None
+        person_detected = False
+        inspected_status = None
+        if np.any(classes == 5):  # Check if 'person' class is detected
+            with self.stage('postprocess'):
+                ppe_status = self.ppe_status(detects)
+            y_offset = y_offset_start * frame.shape[0] // 1080
+            with self.stage('drawing'):
+                for person, status in ppe_status.items():
+                    # Detect for only person in the region of interest
+                    if person[1] < gate_top and person[3] > gate_bottom:
+                        person_detected = True
+                        inspected_status = status
+                        # Output in result
+                        self.output_text = create_ppe_status_string(status)
+                        text = [f'Person #{self.person_index}', self.output_text]
+                        # Output in frame
+                        for cls, retval in status.items():
+                            color = (0, 255, 0) if retval else (0, 0, 255)
+                            self.renderer.text(frame, f'{cls}'.upper(), (30, y_offset), cv.FONT_HERSHEY_SIMPLEX, 1,
+                                               color, 2)
+                            y_offset += line_height
+
+        if not person_detected and self.output_text is not None:
+            text = []
+            self.output_text = None
+
+        # Count a new person once the previous one has left the region of interest
+        if not person_detected and self.last_person_detected:
+            self.person_index += 1
+        self.last_person_detected = person_detected
+
+        self.record = {'person_index': self.person_index, 'person_detected': person_detected,
+                       'ppe': inspected_status}
+        return frame, text
+
+
+# Renderer of the callers of Show_Status_and_Alert that do not give theirs
+DEFAULT_RENDERER = Renderer()
+
+
+# Mode 2: Worker detection
+def Show_Status_and_Alert(img, person_tracking_ppe, number_worker, number_normal_person, show_worker=True,
+                          show_normal_person=True, renderer=DEFAULT_RENDERER):
+    '''
+    This function will show the status of PPE for each person, alert when appearing normal person,also count the
+    number of workers
+    Parameters:
+        - img (np.array): which is a frame or image
+        - person_tracking_ppe (PPEAssociation): the coordinates of the bounding box for each person with the status of
+    the PPE, and their identities when they come from the tracker
+        - renderer (Renderer): draws the boxes and labels, see render.Renderer
+    Return:
+        - number_worker (int): this function also return the number of workers appearing in the frame
+        - number_normal_person (int): this function also return the number of normal person appearing in the frame
+    '''
+
+    track_ids = getattr(person_tracking_ppe, 'track_ids', None)
+    person_ids = [f' #{track_id}' for track_id in track_ids] if track_ids is not None else \
+        [''] * len(person_tracking_ppe)
+    boxes = np.asarray(person_tracking_ppe.person_boxes).astype(int).reshape(-1, 4)
+
+    # Persons without safety vest nor helmet are normal persons, the others are workers
+    normal = ~(person_tracking_ppe.column('Safety Vest') | person_tracking_ppe.column('Helmet'))
+    number_normal_person += int(np.count_nonzero(normal))
+    number_worker += len(boxes) - int(np.count_nonzero(normal))
+
+    if show_normal_person:
+        renderer.boxes(img, boxes[normal], (0, 0, 255), 2)
+        renderer.labels(img, ["ALERT !!!" + person_ids[i] for i in np.flatnonzero(normal)],
+                        boxes[normal][:, [0, 1]] + [10, 100], cv.FONT_HERSHEY_COMPLEX, 0.7, (0, 0, 255), 2)
+    if show_worker:
+        renderer.boxes(img, boxes[~normal], (0, 255, 0), 2)
+        renderer.labels(img, ["Worker" + person_ids[i] for i in np.flatnonzero(~normal)],
+                        boxes[~normal][:, [0, 1]] - [20, 10], cv.FONT_HERSHEY_COMPLEX, 0.6, (0, 255, 0), 2)
+
+    return number_worker, number_normal_person
+
+
+class WorkerDetectionMode(FrameMode):
+    name = 'Detect'
+
+    def process(self, frame, detects):
+        # Initialize
+        number_worker = 0
+        number_normal_person = 0
+
+        # Check PPE
+        with self.stage('postprocess'):
+            person_tracking_ppe = self.ppe_status(detects)
+            # Before the annotations, the alert snapshots are cropped from the frame
+            if self.alerts is not None:
+                self.alerts.check(frame, person_tracking_ppe)
+
+        with self.stage('drawing'):
+            # Show the status and alert when appearing normal person
+            number_worker, number_normal_person = Show_Status_and_Alert(frame, person_tracking_ppe, number_worker,
+                                                                        number_normal_person, renderer=self.renderer)
+
+            # Show the number of workers and number of normal persons
+            self.renderer.layer(frame, (
+                ("Number of workers: " + str(number_worker), (30, 30), cv.FONT_HERSHEY_COMPLEX, 1, (255, 255, 255), 2),
+                ("Number of normal persons: " + str(number_normal_person), (30, 60), cv.FONT_HERSHEY_COMPLEX, 1,
+                 (0, 0, 255), 2)))
+        self.record = {'workers': number_worker, 'normal_persons': number_normal_person}
+        return frame, None
+
+
+# Mode 3: Tracking Worker in construction
+class VideoClock:
+    """
+    Clock of a recorded video for TrackingMode: each call moves to the next frame and returns its time, `start` +
+    frame index / `fps`, so the windows and reports follow the video however fast it is processed. Every frame has to
+    go through the mode (no dropped frames).
+    Parameters:
+        - fps (float): frame rate of the video, 30 when the container does not tell
+        - start (float): timestamp of the first frame (recording start), the creation time of the clock by default
+    """
+
+    def __init__(self, fps, start=None):
+        self.fps = fps if fps and fps > 0 else 30
+        self.start = time.time() if start is None else start
+        self.frame_index = -1
+
+    def __call__(self):
+        self.frame_index += 1
+        return self.start + self.frame_index / self.fps
+
+
+def is_live_source(source):
+    """True for camera indexes and stream URLs, False for video files."""
+    return isinstance(source, int) or '://' in str(source)
+
+
+class TrackingMode(FrameMode):
+    """
+    Track the persons and their PPE. Their compliance is aggregated per zone over sliding time windows (see
+    compliance.ComplianceAggregator), and every `report_interval` seconds the headcount state and rule compliance of
+    each zone are appended to the result file.
+    Parameters:
+        - result_path (str), rotation (str): result file, see sinks.create_sink. None writes no result file
+        - zones (list): Zone objects counted separately, see engine.build_mode
+        - required_workers (int or dict): required number of workers of every zone, or {zone name: number}
+        - ppe_rules (dict): {rule name: PPE labels a person must all wear}, compliance.DEFAULT_RULES by default
+        - report_interval (float): seconds between two result rows
+        - clock (callable): called once per frame, returns its time in seconds (time.time for live sources,
+    VideoClock for recorded videos)
+    """
+    name = 'Tracking'
+
+    def __init__(self, model, result_path='Tracking_State.csv', rotation=None, zones=None, required_workers=5,
+                 ppe_rules=None, report_interval=1.0, clock=time.time):
+        super().__init__(model)
+        self.number_detection = 0
+        self.result_path = result_path
+        self.tracker = WorkerTracker()
+        self.compliance = ComplianceAggregator([CLASSES_NAMES[cls].title() for cls in PPE_CLASSES], zones=zones,
+                                               required_workers=required_workers, rules=ppe_rules)
+        # A new run starts a new file, unless rotated files of a long run are appended to
+        self.sink = create_sink(result_path, rotation=rotation, overwrite=rotation is None,
+                                fieldnames=self.compliance.columns()) if result_path else None
+        self.report_interval = report_interval
+        self.clock = clock
+        self.now = None
+        self.last_report = None
+
+    def process(self, frame, detects):
+        number_normal_person = 0
+        number_worker = 0
+        now = self.now = self.clock()
+
+        # Check PPE of the confident persons, then track them. Low-confidence persons only keep their tracks alive
+        with self.stage('postprocess'):
+            results = detects.cpu().numpy()
+            positions = results.boxes.xyxy.astype(int)
+            classes = results.boxes.cls.astype(int)
+            scores = results.boxes.conf
+            person_ppe = associate_ppe(positions, classes, scores)
+            low = (classes == PERSON_CLASS) & (scores > 0.1) & (scores <= 0.5)
+            person_tracking_ppe = self.tracker.update(person_ppe.person_boxes, person_ppe.person_scores,
+                                                      person_ppe.matched, positions[low], scores[low])
+            self.compliance.update(person_tracking_ppe, (frame.shape[1], frame.shape[0]), now)
+            if self.alerts is not None:
+                self.alerts.check(frame, person_tracking_ppe, now)
+
+        if self.last_report is None or now - self.last_report >= self.report_interval:
+            self.number_detection += 1
+            # Append the headcount state of every zone to the result file
+            if self.sink is not None:
+                for row in self.compliance.rows(now):
+                    self.sink.write(row)
+            self.last_report = now
+
+        # Show the status and alert when appearing normal person, and the counters
+        with self.stage('drawing'):
+            number_worker, number_normal_person = Show_Status_and_Alert(frame, person_tracking_ppe, number_worker,
+                                                                        number_normal_person, renderer=self.renderer)
+            self.renderer.layer(frame, (
+                ("Number of workers: " + str(number_worker), (30, 30), cv.FONT_HERSHEY_COMPLEX, 1, (0, 255, 0), 2),
+                ("Number of detection " + str(self.number_detection), (30, 90), cv.FONT_HERSHEY_COMPLEX, 1,
+                 (0, 255, 255), 2)))
+        self.record = {'workers': number_worker, 'normal_persons': number_normal_person,
+                       'number_detection': self.number_detection,
+                       'track_ids': person_tracking_ppe.track_ids.tolist()}
+        return frame, None
+
+    def finish(self):
+        lines = ["Stopped video playback"]
+        if self.sink is not None:
+            self.sink.flush()
+            lines.append(f"Tracking file have been saved at '{self.sink.current_path or self.result_path}'")
+        for zone, windows in self.compliance.summary(self.now).items():
+            shift = windows.get('shift') or next(iter(windows.values()))
+            lines.append(f"{zone}: " + ', '.join(f'{rule} {share:.0%}' for rule, share in shift['rules'].items()) +
+                         f", headcount normal {shift['states']['Normal']:.0%} of the time")
+        return lines
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+        super().close()
+
+
+MODES = {mode.name: mode for mode in [NormalMode, InspectionMode, WorkerDetectionMode, TrackingMode]}
+
+
+def build_mode(model, mode, zones=None, inference_stride=1, tiling=False, motion_gate=False, max_reuse=30,
+               cache=None, source_key=None, draw=True, alerts=None, **options):
+    """
+    Create the FrameMode `mode` with the optional inference wrappers.
+    Parameters:
+        - model (YOLO object): the detection model
+        - mode (str): one of MODES
+        - zones (list): Zone objects of the camera (see zones.load_zones). Inspection mode checks the first zone with
+    a gate, the other modes only run the detector on the zones, and Tracking mode reports the compliance per zone
+        - inference_stride (int): run the detector every N frames at most, see stride.StrideDetector
+        - tiling (bool): look for small PPE in high-resolution crops of the persons, see tiling.TiledPPEDetector
+        - motion_gate (bool): skip the detector on static frames, see motion.MotionGate
+        - max_reuse (int): maximum frames in a row the motion gate answers with the previous detections
+        - cache (detection_cache.DetectionCache): record the detections of the frames, and replay them when the same
+    video goes through the same model, input and wrappers again (another mode, another analysis run)
+        - source_key (str): key of the video and the model, see detection_cache.source_key. Every frame of the video
+    has to go through the mode, in order
+        - draw (bool): False skips the annotations, when the frames are neither displayed nor written
+        - alerts (alerts.AlertDispatcher): receives the persons without safety vest nor helmet (Detect and Tracking)
+        - options: keyword arguments of the mode class
+    Returns:
+        - FrameMode: the mode
+    """
+    if tiling:
+        model = TiledPPEDetector(model)
+    if zones:
+        if mode == 'Inspection':
+            options['zone'] = next((zone for zone in zones if zone.gate is not None), zones[0])
+        else:
+            model = ZoneDetector(model, zones)
+            if mode == 'Tracking':
+                options['zones'] = zones
+    if inference_stride > 1:
+        model = StrideDetector(model, stride=inference_stride)
+    if motion_gate:
+        model = MotionGate(model, max_reuse=max_reuse)
+    frame_mode = MODES[mode](model, **options)
+    frame_mode.renderer.enabled = draw
+    frame_mode.alerts = alerts
+    if cache is not None and source_key is not None:
+        zones_key = None if mode == 'Inspection' else [zone.key() for zone in zones or []]
+        key = content_key(source_key, frame_mode.input_key(), zones_key, tiling, inference_stride,
+                          motion_gate and max_reuse)
+        frame_mode.model = VideoReplayDetector(frame_mode.model, cache, key)
+    return frame_mode
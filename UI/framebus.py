@@ -0,0 +1,120 @@
+"""
+Shared-memory frame bus between processes: frames and their detection arrays are written once into a
+multiprocessing.shared_memory block, and only slot indices and shapes go through the queues, instead of pickling
+every frame (6 MB at 1080p, 25 MB at 4K) to the other process and back. multicam.MultiCameraMonitor passes the
+frames of its decoders through it to the inference workers, then with their detections to the consumer processes
+running the modes, which draw the annotations in the slots.
+
+    bus = FrameBus(slots=16, frame_bytes=1920 * 1080 * 3)     # owner process
+    slot = bus.acquire()
+    shape = bus.write_frame(slot, frame)                      # send (slot, shape) to the worker
+    worker_bus = FrameBus.attach(bus.spec())                  # worker process, once
+    image = worker_bus.frame(slot, shape)
+    count = worker_bus.write_detections(slot, detections.boxes.data)
+    detections = bus.read_detections(slot, count, names)      # owner, then bus.release(slot)
+"""
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from detections import Detections
+
+# Columns of the detection rows, as in detections.Boxes.data
+DETECTION_COLUMNS = 6
+
+
+class FrameBus:
+    """
+    `slots` frame slots of `frame_bytes` bytes and their detection arrays ((max_detections, 6) float32 rows
+    [x1, y1, x2, y2, conf, cls]) in one shared memory block. A slot holds a uint8 frame of any shape that fits, read
+    back as a view without copy. The owner (the process that created the bus) hands the free slots out and unlinks
+    the block on close(), the other processes attach to it with FrameBus.attach(bus.spec()).
+    Parameters:
+        - slots (int): number of frames in flight at once
+        - frame_bytes (int): size of the largest frame, e.g. width * height * 3
+        - max_detections (int): detection rows per slot, the next ones are dropped (the model keeps 300 at most)
+    """
+
+    def __init__(self, slots, frame_bytes, max_detections=300, name=None):
+        self.slots = slots
+        # Frames start on cache lines
+        self.frame_bytes = -(-frame_bytes // 64) * 64
+        self.max_detections = max_detections
+        detection_bytes = slots * max_detections * DETECTION_COLUMNS * 4
+        size = slots * self.frame_bytes + detection_bytes
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+        buffer = self.shm.buf
+        self.frames = np.ndarray((slots, self.frame_bytes), dtype=np.uint8, buffer=buffer)
+        self.detections = np.ndarray((slots, max_detections, DETECTION_COLUMNS), dtype=np.float32, buffer=buffer,
+                                     offset=slots * self.frame_bytes)
+        self.free = deque(range(slots)) if self.owner else None
+
+    def spec(self):
+        """Picklable description of the bus, for FrameBus.attach in another process."""
+        return {'name': self.shm.name, 'slots': self.slots, 'frame_bytes': self.frame_bytes,
+                'max_detections': self.max_detections}
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec['slots'], spec['frame_bytes'], spec['max_detections'], name=spec['name'])
+
+    def fits(self, frame):
+        return frame.dtype == np.uint8 and frame.nbytes <= self.frame_bytes
+
+    def acquire(self):
+        """Index of a free slot (owner), None when all the slots are in use."""
+        return self.free.popleft() if self.free else None
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def write_frame(self, slot, frame):
+        """Copy `frame` into `slot`, return its shape."""
+        if not self.fits(frame):
+            raise ValueError(f'Frame {frame.shape} {frame.dtype} does not fit in a {self.frame_bytes} bytes slot')
+        np.copyto(self.frame(slot, frame.shape), frame)
+        return frame.shape
+
+    def frame(self, slot, shape):
+        """View of the frame of `shape` in `slot`, valid until the slot is released."""
+        return self.frames[slot, :int(np.prod(shape))].reshape(shape)
+
+    def write_detections(self, slot, data):
+        """Copy the (N, 6) detection rows `data` into `slot`, return the number of rows written."""
+        count = min(len(data), self.max_detections)
+        self.detections[slot, :count] = data[:count]
+        return count
+
+    def read_detections(self, slot, count, names=None):
+        """Detections of `slot` (copied, the slot can be released)."""
+        data = self.detections[slot, :count]
+        return Detections(data[:, :4], data[:, 4], data[:, 5], names)
+
+    def stats(self):
+        """Slots, slots in use (owner) and size of the block in MB."""
+        return {'slots': self.slots, 'in_use': self.slots - len(self.free) if self.owner else None,
+                'size_mb': round(self.shm.size / 2 ** 20, 1)}
+
+    def close(self):
+        # The views have to go before the memory they point to
+        self.frames = self.detections = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def attach_shared_memory(name):
+    """
+    Attach to an existing shared memory block, leaving its unlinking to the owner. Before Python 3.13 the block is
+    registered with the resource tracker of the process, the one of the owner for the processes it started (spawn or
+    forkserver), which unlinks it only when the owner dies without closing the bus.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
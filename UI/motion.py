@@ -0,0 +1,81 @@
+import time
+
+import cv2 as cv
+
+from detections import Detections
+from pipeline import StageCounter
+from stride import small_gray
+
+GATE_METHODS = ('diff', 'mog2')
+
+
+class MotionGate:
+    """
+    Model wrapper skipping the detector on static frames of fixed cameras. A cheap test on a downscaled grayscale
+    frame runs first: frame differencing against the last frame given to the detector ('diff'), or the foreground
+    of a MOG2 background subtractor ('mog2'). When less than `min_changed` of the pixels changed, the previous
+    detections are returned again (the same object, so the modes also reuse the PPE status computed from them),
+    for at most `max_reuse` frames in a row.
+    It is called like the YOLO model, so every mode can use it unchanged.
+    Parameters:
+        - model (YOLO object): the detection model
+        - max_reuse (int): maximum number of frames in a row answered with the previous detections
+        - method (str): one of GATE_METHODS
+        - pixel_threshold (int): gray-level difference above which a pixel changed ('diff')
+        - min_changed (float): fraction of changed (or foreground) pixels that runs the detector
+        - size (int): longest side of the downscaled frames
+    """
+
+    def __init__(self, model, max_reuse=30, method='diff', pixel_threshold=25, min_changed=0.002, size=160):
+        if method not in GATE_METHODS:
+            raise ValueError(f"Unknown motion gate method '{method}', expected one of {GATE_METHODS}")
+        self.model = model
+        self.names = model.names
+        self.max_reuse = max_reuse
+        self.method = method
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.size = size
+        self.subtractor = cv.createBackgroundSubtractorMOG2(detectShadows=False) if method == 'mog2' else None
+        self.detector_counter = StageCounter()
+        self.frames = 0
+        self.gated = 0
+        self.reference = None
+        self.last = None
+        self.reused = 0
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        return [self.detect(image, **kwargs) for image in images]
+
+    def changed_fraction(self, gray):
+        """Fraction of the pixels of the downscaled frame `gray` that changed."""
+        if self.subtractor is not None:
+            return cv.countNonZero(self.subtractor.apply(gray)) / gray.size
+        if self.reference is None or self.reference.shape != gray.shape:
+            return 1.0
+        changed = cv.threshold(cv.absdiff(gray, self.reference), self.pixel_threshold, 255, cv.THRESH_BINARY)[1]
+        return cv.countNonZero(changed) / gray.size
+
+    def detect(self, image, **kwargs):
+        self.frames += 1
+        gray = cv.GaussianBlur(small_gray(image, self.size)[0], (5, 5), 0)
+        changed = self.changed_fraction(gray)
+        if self.last is not None and self.reused < self.max_reuse and changed < self.min_changed:
+            self.gated += 1
+            self.reused += 1
+            return self.last
+
+        start = time.perf_counter()
+        self.last = Detections.from_results(self.model(image, **kwargs)[0])
+        self.detector_counter.tick(time.perf_counter() - start)
+        self.reference = gray
+        self.reused = 0
+        return self.last
+
+    def stats(self):
+        """Detector runs and the frames answered with the previous detections."""
+        counter = self.detector_counter
+        return {'fps': round(counter.fps(), 1), 'busy_ms': round(counter.busy_ms(), 1), 'frames': counter.frames,
+                'gated': self.gated}
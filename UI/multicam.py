@@ -0,0 +1,557 @@
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from detections import Detections
+from engine import build_mode
+from framebus import FrameBus
+from pipeline import END_OF_STREAM, BoundedQueue, StageCounter, decode_frames
+from sinks import create_sink
+
+
+def camera_names(sources):
+    """Unique names of the sources: file name without extension, or 'camera<i>' for camera indexes and URLs."""
+    names = []
+    for i, source in enumerate(sources):
+        name = os.path.splitext(os.path.basename(source))[0] if isinstance(source, str) and os.path.exists(source) \
+            else f'camera{i}'
+        names.append(name if name not in names else f'{name}_{i}')
+    return names
+
+
+def mosaic_layout(count, cell_size):
+    """Number of columns and rows of a grid of `count` cells, and the (width, height) of the grid image."""
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    return columns, rows, (columns * cell_size[0], rows * cell_size[1])
+
+
+# Model of the inference worker processes, loaded once per process by _init_worker, and the frame bus they read
+_worker_model = None
+_worker_bus = None
+
+
+def _init_worker(model_factory, bus_spec=None):
+    global _worker_model, _worker_bus
+    _worker_model = model_factory()
+    if bus_spec is not None:
+        _worker_bus = FrameBus.attach(bus_spec)
+
+
+def _infer_in_worker(inputs):
+    return [Detections.from_results(result) for result in _worker_model(inputs)]
+
+
+def _infer_shared_in_worker(frames):
+    """
+    _infer_in_worker on the frames [(slot, shape)] of the frame bus. The detections are written back to the slots.
+    Returns:
+        - list: number of detections of every frame
+        - dict: class names of the model
+    """
+    images = [_worker_bus.frame(slot, shape) for slot, shape in frames]
+    results = [Detections.from_results(result) for result in _worker_model(images)]
+    counts = [_worker_bus.write_detections(slot, result.boxes.data) for (slot, _), result in zip(frames, results)]
+    return counts, results[0].names if results else None
+
+
+# Modes of the cameras of a consumer process, {camera name: FrameMode}, and the frame bus it reads
+_consumer_modes = {}
+_consumer_bus = None
+
+
+def _init_consumer(mode, camera_options, bus_spec):
+    """Build the modes of the cameras {name: mode options} handled by a consumer process."""
+    global _consumer_bus
+    _consumer_bus = FrameBus.attach(bus_spec)
+    for name, options in camera_options.items():
+        _consumer_modes[name] = build_mode(None, mode, **options)
+
+
+def _process_in_consumer(items, names):
+    """
+    Post-processing (PPE association, tracking, compliance) and drawing of frames of the frame bus, in a consumer
+    process. The annotated frames are left in their slots.
+    Parameters:
+        - items (list): (camera name, frame slot, frame shape, detections slot, detection count) of every frame,
+    with a None frame slot at the end of the source of a camera
+        - names (dict): class names of the model
+    Returns:
+        - list: (text, record, shape of the annotated frame, processing seconds) of every frame, the lines of
+    FrameMode.finish() at the end of a source
+    """
+    results = []
+    for name, slot, shape, detections_slot, count in items:
+        mode = _consumer_modes[name]
+        if slot is None:
+            results.append(mode.finish())
+            continue
+        start = time.perf_counter()
+        frame = _consumer_bus.frame(slot, shape)
+        frame, text = mode.process(frame, _consumer_bus.read_detections(detections_slot, count, names))
+        # The modes draw in place, another frame is copied to the slot
+        if frame.ctypes.data != _consumer_bus.frames[slot].ctypes.data or not frame.flags.c_contiguous:
+            _consumer_bus.write_frame(slot, frame)
+        results.append((text, mode.record, frame.shape, time.perf_counter() - start))
+    return results
+
+
+def _close_consumer():
+    for mode in _consumer_modes.values():
+        mode.close()
+    _consumer_modes.clear()
+    _consumer_bus.close()
+
+
+class Camera:
+    """One source of a MultiCameraMonitor: capture, decoder queue, mode, result sink and counters."""
+
+    def __init__(self, name, cap, mode, queue_size, drop_policy, sink=None, options=None):
+        self.name = name
+        self.cap = cap
+        self.mode = mode
+        # Mode options, to build the mode again in a consumer process, and the index of that process
+        self.options = options or {}
+        self.consumer = None
+        self.fps = cap.get(cv.CAP_PROP_FPS) or 30
+        self.decode_counter = StageCounter()
+        self.process_counter = StageCounter()
+        self.queue = BoundedQueue(queue_size, drop_policy, self.decode_counter)
+        self.sink = sink
+        self.text = []
+        self.ended = False
+        self.thread = None
+
+
+class MultiCameraMonitor:
+    """
+    Monitoring of several sources with one shared detector. Every source has its own decoder thread and mode (so the
+    tracking state stays per camera), and a scheduler thread batches the decoded frames of all cameras into single
+    model calls. The batches are filled round-robin, one frame per camera per turn starting after the camera served
+    last, so a busy camera cannot starve the others.
+    With `workers` > 0, the batches run on a pool of processes each holding its own model (from `model_factory`),
+    for when one model instance is saturated. Results are still processed in submission order, so the frames of a
+    camera stay in order. The frames and detections go through a shared memory framebus.FrameBus, only slot indices
+    are sent to the workers.
+    With `consumers` > 0 as well, the post-processing and drawing of the modes (PPE association, tracking,
+    compliance, annotations) also leave this process: every camera is assigned to one of `consumers` processes holding
+    its mode, which reads the frame and its detections from the frame bus and draws the annotations in place. This
+    process only decodes (the OpenCV decoders release the GIL), schedules the batches and writes the results.
+    Parameters:
+        - model (YOLO object): the detection model used in-process, may be None when `workers` > 0
+        - sources (list): video files, camera indexes or stream URLs
+        - mode (str): one of engine.MODES, used for every camera
+        - names (list): camera names, see camera_names by default
+        - batch_size (int): maximum number of frames per model call
+        - workers (int): number of inference processes, 0 to run the model in the scheduler thread
+        - model_factory (callable): picklable function returning a model, called once in every worker process
+        - shared_memory (bool): False pickles the frames to the workers instead of using the frame bus
+        - consumers (int): number of processes running the modes, 0 to run them in the scheduler thread. Needs
+    `workers` > 0 and the frame bus
+        - queue_size (int), drop_policy (str), realtime (bool): decoder queue of each camera, see pipeline.VideoPipeline
+        - results_dir (str): directory of the per-camera result files '<name><results_format>' (None to skip them)
+        - results_format (str): '.jsonl', '.csv' or '.parquet', see sinks.create_sink
+        - cell_size (tuple): (width, height) of a camera in the grid view
+        - stats_interval (float): seconds between two on_stats calls
+        - mode_options (dict): keyword arguments of the mode class, Tracking files are suffixed with the camera name
+    Callbacks, all called from the scheduler thread:
+        - on_result(name, frame, text, record): every processed frame (a copy out of the frame bus with consumers)
+        - on_frame_ready(): the grid view was updated, take it with take_frame(). The grid is only drawn when this
+    callback is given
+        - on_text(lines): latest result text of every camera
+        - on_finished(lines): all the sources ended
+        - on_stats(stats): see stats()
+    """
+
+    def __init__(self, model, sources, mode, names=None, batch_size=8, workers=0, model_factory=None, queue_size=2,
+                 drop_policy='drop_oldest', realtime=True, results_dir=None, results_format='.jsonl',
+                 cell_size=(640, 360), stats_interval=1.0, mode_options=None, on_result=None, on_frame_ready=None,
+                 on_text=None, on_finished=None, on_stats=None, shared_memory=True, consumers=0):
+        if workers > 0 and model_factory is None:
+            raise ValueError('Inference worker processes need a model_factory')
+        if consumers > 0 and (workers == 0 or not shared_memory):
+            raise ValueError('Consumer processes need inference worker processes and the shared memory frame bus')
+        if model is None and workers == 0:
+            raise ValueError('A model is needed when running without worker processes')
+        self.model = model
+        self.batch_size = batch_size
+        self.workers = workers
+        self.model_factory = model_factory
+        self.shared_memory = shared_memory
+        self.consumers = consumers
+        self.mode_name = mode
+        self.bus = None
+        self.realtime = realtime
+        self.cell_size = cell_size
+        self.stats_interval = stats_interval
+        self.on_result = on_result
+        self.on_frame_ready = on_frame_ready
+        self.on_text = on_text
+        self.on_finished = on_finished
+        self.on_stats = on_stats
+
+        names = names or camera_names(sources)
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+        self.cameras = []
+        for name, source in zip(names, sources):
+            cap = cv.VideoCapture(source)
+            if not cap.isOpened():
+                for camera in self.cameras:
+                    camera.cap.release()
+                raise IOError(f'Error opening video stream or file {source}')
+            options = dict(mode_options or {})
+            if mode == 'Tracking':
+                stem, extension = os.path.splitext(options.get('result_path', 'Tracking_State.csv'))
+                options['result_path'] = f'{stem}_{name}{extension}'
+            sink = create_sink(os.path.join(results_dir, f'{name}{results_format}'), overwrite=True) \
+                if results_dir else None
+            # With consumer processes, the mode of this process only gives the model inputs
+            self.cameras.append(Camera(name, cap, build_mode(model, mode, **options), queue_size, drop_policy, sink,
+                                       options))
+            self.cameras[-1].consumer = (len(self.cameras) - 1) % consumers if consumers else None
+
+        self.inference_counter = StageCounter()
+        self.batch_sizes = deque(maxlen=60)
+        self.next_camera = 0
+        self.in_flight = deque()
+        # Batches in the consumer processes: (batch, {consumer: future}, slots)
+        self.consuming = deque()
+        self.columns, _, grid_size = mosaic_layout(len(self.cameras), cell_size)
+        self.grid = np.zeros((grid_size[1], grid_size[0], 3), dtype=np.uint8)
+        self.render_counter = StageCounter()
+        self.render_queue = BoundedQueue(2, 'drop_oldest', self.render_counter)
+        self.stop_event = threading.Event()
+        self.scheduler = None
+
+    def start(self):
+        for camera in self.cameras:
+            camera.thread = threading.Thread(target=decode_frames, name=f'decode-{camera.name}', daemon=True,
+                                             args=(camera.cap, camera.queue, camera.decode_counter, self.stop_event,
+                                                   self.realtime))
+            camera.thread.start()
+        self.scheduler = threading.Thread(target=self._schedule_loop, name='multicam-scheduler', daemon=True)
+        self.scheduler.start()
+
+    def stop(self, wait=True):
+        """Stop the cameras, with `wait` until the scheduler has closed their modes and result files."""
+        self.stop_event.set()
+        if self.scheduler is None:
+            # Never started, nothing else closes the modes
+            for camera in self.cameras:
+                camera.mode.close()
+                if camera.sink is not None:
+                    camera.sink.close()
+        elif wait:
+            self.wait()
+
+    def is_running(self):
+        return self.scheduler is not None and self.scheduler.is_alive()
+
+    def wait(self, timeout=None):
+        """Block until all the sources ended (or stop()). Return False on timeout."""
+        if self.scheduler is not None and self.scheduler is not threading.current_thread():
+            self.scheduler.join(timeout)
+        if not self.is_running():
+            for camera in self.cameras:
+                camera.thread.join()
+        return not self.is_running()
+
+    def take_frame(self):
+        """Return the latest grid view (GUI thread), or None."""
+        return self.render_queue.get_nowait()
+
+    def frame_displayed(self, duration):
+        """Account a grid returned by take_frame() that took `duration` seconds to display."""
+        self.render_counter.tick(duration)
+
+    def stats(self):
+        """
+        Return {camera name: {'fps', 'busy_ms', 'decode_ms', 'frames', 'dropped', 'queue'}} with the processed frames
+        of every camera (busy_ms is the time its mode takes per frame) and its decoder queue, plus 'inference':
+        {'fps', 'busy_ms', 'frames', 'batch', 'in_flight'} where busy_ms is the time per batch, and with consumer
+        processes 'consumers': {'processes', 'in_flight'}.
+        """
+        stats = {camera.name: {'fps': round(camera.process_counter.fps(), 1),
+                               'busy_ms': round(camera.process_counter.busy_ms(), 1),
+                               'decode_ms': round(camera.decode_counter.busy_ms(), 1),
+                               'frames': camera.process_counter.frames, 'dropped': camera.decode_counter.dropped,
+                               'queue': camera.queue.depth()}
+                 for camera in self.cameras}
+        counter = self.inference_counter
+        frames = sum(self.batch_sizes)
+        elapsed = counter.timestamps[-1] - counter.timestamps[0] if len(counter.timestamps) > 1 else 0
+        stats['inference'] = {'fps': round((frames - self.batch_sizes[0]) / elapsed, 1) if elapsed > 0 else 0.0,
+                              'busy_ms': round(counter.busy_ms(), 1), 'frames': counter.frames,
+                              'batch': round(frames / len(self.batch_sizes), 1) if self.batch_sizes else 0.0,
+                              'in_flight': len(self.in_flight)}
+        if self.consumers:
+            stats['consumers'] = {'processes': self.consumers, 'in_flight': len(self.consuming)}
+        return stats
+
+    def _next_batch(self):
+        """
+        Take up to batch_size decoded frames, one per camera per turn. Returns [(camera, frame)], where frame is
+        END_OF_STREAM for a camera whose source ended.
+        """
+        batch = []
+        frames = 0
+        count = len(self.cameras)
+        index = self.next_camera
+        idle_turns = 0
+        # Stop after a full turn without any frame
+        while frames < self.batch_size and idle_turns < count:
+            camera = self.cameras[index % count]
+            index += 1
+            item = None if camera.ended else camera.queue.get_nowait()
+            if item is None:
+                idle_turns += 1
+                continue
+            idle_turns = 0
+            if item is END_OF_STREAM:
+                camera.ended = True
+            else:
+                frames += 1
+            batch.append((camera, item))
+        self.next_camera = index % count
+        return batch
+
+    def _schedule_loop(self):
+        pool = None
+        consumer_pools = []
+        if self.workers > 0:
+            frame_bytes = 3 * max(int(camera.cap.get(cv.CAP_PROP_FRAME_WIDTH)) *
+                                  int(camera.cap.get(cv.CAP_PROP_FRAME_HEIGHT)) for camera in self.cameras)
+            if self.shared_memory and frame_bytes:
+                # One slot per frame of the batches in flight, and with consumers of a batch per consumer. Model
+                # inputs that are not whole frames (zone crops) take a slot of their own
+                self.bus = FrameBus((2 * self.workers + self.consumers) * self.batch_size, frame_bytes)
+            elif self.consumers:
+                self.stop_event.set()
+                raise ValueError('The frame size of the sources is unknown, consumer processes need the frame bus')
+            # Spawned processes do not inherit the decoder threads and GUI state of this process
+            context = multiprocessing.get_context('spawn')
+            pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                       initargs=(self.model_factory, self.bus.spec() if self.bus else None))
+            # One process per consumer, so the frames of a camera are processed in order
+            for index in range(self.consumers):
+                camera_options = {camera.name: camera.options for camera in self.cameras if camera.consumer == index}
+                consumer_pools.append(ProcessPoolExecutor(1, mp_context=context, initializer=_init_consumer,
+                                                          initargs=(self.mode_name, camera_options,
+                                                                    self.bus.spec())))
+        try:
+            self._run_schedule(pool, consumer_pools)
+        finally:
+            # Release the decoders blocked on a full queue
+            self.stop_event.set()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            for consumer_pool in consumer_pools:
+                # The modes close (flush their result files) in their process
+                try:
+                    consumer_pool.submit(_close_consumer).result()
+                finally:
+                    consumer_pool.shutdown(cancel_futures=True)
+            if self.bus is not None:
+                self.bus.close()
+                self.bus = None
+            for camera in self.cameras:
+                camera.mode.close()
+                if camera.sink is not None:
+                    camera.sink.close()
+
+    def _run_schedule(self, pool, consumer_pools):
+        max_in_flight = 2 * self.workers
+        last_stats = time.perf_counter()
+        while not self.stop_event.is_set():
+            batch = self._next_batch()
+            inputs = [camera.mode.model_input(frame) for camera, frame in batch if frame is not END_OF_STREAM]
+            if batch and consumer_pools:
+                self._submit_consumed(pool, consumer_pools, batch, inputs)
+            elif batch:
+                if pool is None:
+                    start = time.perf_counter()
+                    results = self.model(inputs) if inputs else []
+                    self._deliver(batch, results, time.perf_counter() - start)
+                else:
+                    if inputs:
+                        future, slots = self._submit(pool, inputs)
+                    else:
+                        # Ends of stream wait for the frames of their camera still in flight
+                        future, slots = Future(), []
+                        future.set_result([])
+                    self.in_flight.append((batch, future, slots, time.perf_counter()))
+
+            # Deliver in submission order: wait for the oldest batch when the pool is full or nothing is decoded
+            while self.in_flight and (len(self.in_flight) >= max_in_flight or not batch or
+                                      self.in_flight[0][1].done()):
+                if consumer_pools:
+                    self._consume(consumer_pools)
+                    continue
+                done_batch, future, slots, submitted = self.in_flight.popleft()
+                self._deliver(done_batch, self._results(future, slots), time.perf_counter() - submitted)
+            while self.consuming and (len(self.consuming) >= 2 * len(consumer_pools) or not batch or
+                                      all(future.done() for future in self.consuming[0][1].values())):
+                self._deliver_consumed()
+
+            if self.on_stats is not None and time.perf_counter() - last_stats >= self.stats_interval:
+                self.on_stats(self.stats())
+                last_stats = time.perf_counter()
+            if all(camera.ended for camera in self.cameras) and not self.in_flight and not self.consuming:
+                if self.on_finished is not None:
+                    self.on_finished(['All sources ended'])
+                break
+            if not batch:
+                time.sleep(0.005)
+        if self.on_stats is not None:
+            self.on_stats(self.stats())
+
+    def _submit(self, pool, inputs):
+        """Submit a batch to the worker processes, through the frame bus when its frames fit in the slots."""
+        if self.bus is None or not all(self.bus.fits(image) for image in inputs):
+            return pool.submit(_infer_in_worker, inputs), []
+        slots = [self.bus.acquire() for _ in inputs]
+        shapes = [self.bus.write_frame(slot, image) for slot, image in zip(slots, inputs)]
+        return pool.submit(_infer_shared_in_worker, list(zip(slots, shapes))), slots
+
+    def _results(self, future, slots):
+        """Detections of a submitted batch, read from the frame bus slots (then released) when it went through it."""
+        results = future.result()
+        if not slots:
+            return results
+        counts, names = results
+        results = [self.bus.read_detections(slot, count, names) for slot, count in zip(slots, counts)]
+        for slot in slots:
+            self.bus.release(slot)
+        return results
+
+    def _submit_consumed(self, pool, consumer_pools, batch, inputs):
+        """
+        Write the frames of `batch` and their model inputs to the frame bus and submit the inputs to the worker
+        processes. The slots stay in use until the consumers processed the frames.
+        """
+        frames = [(camera, frame) for camera, frame in batch if frame is not END_OF_STREAM]
+        needed = len(frames) + sum(image is not frame for (_, frame), image in zip(frames, inputs))
+        # Make room by finishing the oldest batches
+        while len(self.bus.free) < needed and (self.in_flight or self.consuming):
+            if self.consuming:
+                self._deliver_consumed()
+            else:
+                self._consume(consumer_pools)
+        items = []
+        slots = []
+        for (camera, frame), image in zip(frames, inputs):
+            slot = self.bus.acquire()
+            shape = self.bus.write_frame(slot, frame)
+            input_slot = slot
+            if image is not frame:
+                input_slot = self.bus.acquire()
+                slots.append(input_slot)
+                self.bus.write_frame(input_slot, np.ascontiguousarray(image))
+            slots.append(slot)
+            items.append((slot, shape, input_slot, image.shape))
+        if items:
+            future = pool.submit(_infer_shared_in_worker, [(input_slot, input_shape)
+                                                           for _, _, input_slot, input_shape in items])
+        else:
+            # Ends of stream wait for the frames of their camera still in flight
+            future = Future()
+            future.set_result(([], None))
+        self.in_flight.append((batch, future, (items, slots), time.perf_counter()))
+
+    def _consume(self, consumer_pools):
+        """Send the oldest inferred batch to the consumer processes of its cameras."""
+        batch, future, (items, slots), submitted = self.in_flight.popleft()
+        counts, names = future.result()
+        if items:
+            self.inference_counter.tick(time.perf_counter() - submitted)
+            self.batch_sizes.append(len(items))
+        work = {}
+        frames = iter(zip(items, counts))
+        for camera, frame in batch:
+            if frame is END_OF_STREAM:
+                work.setdefault(camera.consumer, []).append((camera.name, None, None, None, 0))
+                continue
+            (slot, shape, input_slot, _), count = next(frames)
+            work.setdefault(camera.consumer, []).append((camera.name, slot, shape, input_slot, count))
+        futures = {index: consumer_pools[index].submit(_process_in_consumer, consumer_items, names)
+                   for index, consumer_items in work.items()}
+        self.consuming.append((batch, futures, [item[0] for item in items], slots))
+
+    def _deliver_consumed(self):
+        """Deliver the oldest batch processed by the consumers, then release its slots."""
+        batch, futures, frame_slots, slots = self.consuming.popleft()
+        results = {index: iter(future.result()) for index, future in futures.items()}
+        frame_slots = iter(frame_slots)
+        text_changed = False
+        for camera, frame in batch:
+            result = next(results[camera.consumer])
+            if frame is END_OF_STREAM:
+                camera.text.extend(f'{camera.name}: {line}' for line in result)
+                text_changed = True
+                continue
+            text, record, shape, duration = result
+            camera.process_counter.tick(duration)
+            frame = self.bus.frame(next(frame_slots), shape)
+            # The slot is reused once released, the callback may keep the frame
+            text_changed |= self._output(camera, frame.copy() if self.on_result is not None else frame, text, record)
+        for slot in slots:
+            self.bus.release(slot)
+        self._frames_done(text_changed)
+
+    def _deliver(self, batch, results, duration):
+        if results:
+            self.inference_counter.tick(duration)
+            self.batch_sizes.append(len(results))
+        results = iter(results)
+        text_changed = False
+        for camera, frame in batch:
+            if frame is END_OF_STREAM:
+                for line in camera.mode.finish():
+                    camera.text.append(f'{camera.name}: {line}')
+                text_changed = True
+                continue
+            start = time.perf_counter()
+            frame, text = camera.mode.process(frame, next(results))
+            camera.process_counter.tick(time.perf_counter() - start)
+            text_changed |= self._output(camera, frame, text, camera.mode.record)
+        self._frames_done(text_changed)
+
+    def _output(self, camera, frame, text, record):
+        """Write the result of a processed frame, return True when the result text of the camera changed."""
+        if camera.sink is not None:
+            camera.sink.write({'frame': camera.process_counter.frames - 1,
+                               'time': round((camera.process_counter.frames - 1) / camera.fps, 3), **record})
+        if self.on_result is not None:
+            self.on_result(camera.name, frame, text, record)
+        if self.on_frame_ready is not None:
+            self._draw_cell(camera, frame)
+        if text is None:
+            return False
+        camera.text = [f'{camera.name}: {line}' for line in text]
+        return True
+
+    def _frames_done(self, text_changed):
+        if text_changed and self.on_text is not None:
+            self.on_text([line for camera in self.cameras for line in camera.text])
+        if self.on_frame_ready is not None and self.render_queue.put(self.grid.copy(), self.stop_event):
+            self.on_frame_ready()
+
+    def _draw_cell(self, camera, frame):
+        index = self.cameras.index(camera)
+        cell_width, cell_height = self.cell_size
+        x, y = (index % self.columns) * cell_width, (index // self.columns) * cell_height
+        scale = min(cell_width / frame.shape[1], cell_height / frame.shape[0])
+        width, height = max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale))
+        cell = self.grid[y:y + cell_height, x:x + cell_width]
+        cell[height:] = 0
+        cell[:, width:] = 0
+        cell[:height, :width] = cv.resize(frame, (width, height), interpolation=cv.INTER_AREA)
+        cv.putText(cell, camera.name, (10, 30), cv.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
@@ -0,0 +1,140 @@
+"""
+Offline analysis of a recorded video: frames are read in chunks and the model runs on batches of frames, then every
+frame goes through the post-processing of the selected mode. Writes the annotated video and a JSON Lines results
+file with one record per frame. Run it with `python detect.py analyze`.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+
+from decoding import open_video
+from engine import VideoClock, build_mode
+
+
+def read_chunk(cap, size):
+    frames = []
+    while len(frames) < size:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    return frames
+
+
+class ResultWriter:
+    """
+    Writes the annotated frames of a run to a video file and their records to a JSON Lines file.
+    Parameters:
+        - output_path (str): annotated video path, None to skip it
+        - results_path (str): JSON Lines results path, None to skip it
+        - fps (float): frame rate of the source, used for the video and the 'time' of the records
+    """
+
+    def __init__(self, output_path, results_path, fps):
+        self.output_path = output_path
+        self.results_path = results_path
+        self.fps = fps or 30
+        self.writer = None
+        self.results_file = open(results_path, 'w') if results_path else None
+        self.frame_index = 0
+
+    def write(self, frame, text, record):
+        if self.output_path:
+            if self.writer is None:
+                height, width = frame.shape[:2]
+                self.writer = cv.VideoWriter(self.output_path, cv.VideoWriter_fourcc(*'mp4v'), self.fps,
+                                             (width, height))
+            self.writer.write(frame)
+        if self.results_file is not None:
+            record = {'frame': self.frame_index, 'time': round(self.frame_index / self.fps, 3), **record}
+            if text is not None:
+                record['text'] = text
+            self.results_file.write(json.dumps(record) + '\n')
+        self.frame_index += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+        if self.results_file is not None:
+            self.results_file.close()
+
+
+def analyze_video(model, video_path, mode, batch_size=8, output_path=None, results_path=None, zones=None,
+                  tiling=False, progress=None, cache=None, source_key=None, decoder='opencv', decode_size=None,
+                  hw_decode=False, start_time=None, mode_options=None):
+    """
+    Analyze a whole video file with batched inference.
+    Parameters:
+        - model (YOLO object): the detection model
+        - video_path (str): path of the video to analyze
+        - mode (str): one of engine.MODES
+        - batch_size (int): number of frames given to the model at once
+        - output_path (str): annotated video, defaults to '<video>_<mode>.mp4' (None to skip writing it)
+        - results_path (str): JSON Lines results file, defaults to '<video>_<mode>.jsonl'
+        - zones (list): Zone objects of the camera, see engine.build_mode
+        - tiling (bool): high-resolution person crops for small PPE, see engine.build_mode
+        - progress (callable): called with the number of frames processed after each batch
+        - cache (DetectionCache), source_key (str): replay the detections of a previous run on the same video, see
+    engine.build_mode
+        - decoder (str), decode_size (int), hw_decode (bool): see decoding.open_video (decoder, max_size, hw_accel)
+        - start_time (float): timestamp of the first frame, the time of the Tracking mode reports follows the video
+    from it (see engine.VideoClock), the start of the analysis by default
+        - mode_options (dict): keyword arguments of the mode class. The Tracking mode result file defaults to
+    '<results>_tracking.csv', next to the results file
+    Returns:
+        - dict: summary of the run (frames, elapsed seconds, FPS, output paths, final messages of the mode)
+    """
+    # The chunks are already read ahead of the model, no prefetch thread
+    cap = open_video(video_path, decoder, max_size=decode_size, hw_accel=hw_decode, prefetch=0)
+    if not cap.isOpened():
+        raise IOError(f'Error opening video file {video_path}')
+
+    stem = f'{os.path.splitext(video_path)[0]}_{mode.lower()}'
+    output_path = output_path if output_path is not None else f'{stem}.mp4'
+    results_path = results_path or f'{stem}.jsonl'
+
+    fps = cap.get(cv.CAP_PROP_FPS)
+    options = dict(mode_options or {})
+    if mode == 'Tracking':
+        # The sliding windows and reports follow the video, not the processing speed
+        options.setdefault('clock', VideoClock(fps, start_time))
+        options['result_path'] = options.get('result_path') or f'{os.path.splitext(results_path)[0]}_tracking.csv'
+    writer = ResultWriter(output_path, results_path, fps)
+    try:
+        frame_mode = build_mode(model, mode, zones=zones, tiling=tiling, cache=cache, source_key=source_key,
+                                draw=bool(output_path), **options)
+    except Exception:
+        cap.release()
+        writer.close()
+        raise
+
+    start = time.perf_counter()
+    try:
+        # Decode the next chunk while the model runs on the current one
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            next_chunk = reader.submit(read_chunk, cap, batch_size)
+            while True:
+                frames = next_chunk.result()
+                if not frames:
+                    break
+                next_chunk = reader.submit(read_chunk, cap, batch_size)
+
+                for frame, detects in zip(frames, frame_mode.infer_batch(frames)):
+                    frame, text = frame_mode.process(frame, detects)
+                    writer.write(frame, text, frame_mode.record)
+
+                if progress is not None:
+                    progress(writer.frame_index)
+        messages = frame_mode.finish()
+    finally:
+        # The files written so far stay readable when the analysis fails
+        cap.release()
+        writer.close()
+        frame_mode.close()
+    elapsed = time.perf_counter() - start
+    frames = writer.frame_index
+    return {'frames': frames, 'elapsed': round(elapsed, 3), 'fps': round(frames / elapsed, 2) if elapsed else 0,
+            'output_path': output_path, 'results_path': results_path, 'messages': messages}
@@ -0,0 +1,279 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2 as cv
+
+from profiling import FrameProfiler
+
+# What a stage does when the queue to the next stage is full:
+#   - block: wait for a free slot (no frame is lost, the source is slowed down)
+#   - drop_oldest: discard the oldest queued frame to keep the freshest one (live sources)
+#   - drop_newest: discard the incoming frame
+DROP_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+END_OF_STREAM = object()
+
+
+class StageCounter:
+    """
+    Rolling counters of a pipeline stage: throughput, time spent per frame and dropped frames.
+    Parameters:
+        - window (int): number of recent frames used for the rolling values
+    """
+
+    def __init__(self, window=60):
+        self.timestamps = deque(maxlen=window)
+        self.durations = deque(maxlen=window)
+        self.frames = 0
+        self.dropped = 0
+
+    def tick(self, duration):
+        self.timestamps.append(time.perf_counter())
+        self.durations.append(duration)
+        self.frames += 1
+
+    def fps(self):
+        if len(self.timestamps) < 2:
+            return 0.0
+        elapsed = self.timestamps[-1] - self.timestamps[0]
+        return (len(self.timestamps) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def busy_ms(self):
+        return 1000 * sum(self.durations) / len(self.durations) if self.durations else 0.0
+
+
+class BoundedQueue:
+    """queue.Queue with a drop policy applied when it is full."""
+
+    def __init__(self, maxsize, drop_policy, counter):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy '{drop_policy}', expected one of {DROP_POLICIES}")
+        self.queue = queue.Queue(maxsize)
+        self.drop_policy = drop_policy
+        self.counter = counter
+
+    def put(self, item, stop_event, force_block=False):
+        """Put `item` following the drop policy. Return False when the item was not queued."""
+        if self.drop_policy == 'block' or force_block:
+            while not stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        self.counter.dropped += 1
+        if self.drop_policy == 'drop_newest':
+            return False
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout=0.1):
+        """Return the next item, or None when nothing arrived before `timeout`."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+def decode_frames(cap, out_queue, counter, stop_event, realtime=True, profiler=None):
+    """
+    Decoder loop: read `cap` into `out_queue` (a BoundedQueue) until the end of the stream or `stop_event`, then
+    release the capture and queue END_OF_STREAM.
+    Parameters:
+        - counter (StageCounter): decode counter
+        - realtime (bool): pace the reads at the source FPS instead of decoding as fast as possible
+        - profiler (FrameProfiler): receives the 'decode' stage timings
+    """
+    fps = cap.get(cv.CAP_PROP_FPS)
+    frame_interval = 1 / fps if realtime and fps > 0 else 0
+    next_time = time.perf_counter()
+    try:
+        while not stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            duration = time.perf_counter() - start
+            counter.tick(duration)
+            if profiler is not None:
+                profiler.add('decode', duration)
+            out_queue.put(frame, stop_event)
+
+            if frame_interval:
+                next_time += frame_interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.perf_counter()
+    finally:
+        cap.release()
+        out_queue.put(END_OF_STREAM, stop_event, force_block=True)
+
+
+class VideoPipeline:
+    """
+    Three-stage video pipeline: a decoder thread reading the capture, an inference thread running the mode on each
+    frame, and a consumer of the annotated frames (the GUI thread, notified through Qt signals by Detection.py, or a
+    headless sink).
+    Stages are connected by bounded queues, so a slow stage applies the drop policy instead of growing memory.
+    Parameters:
+        - cap (cv.VideoCapture): opened video source, released by the pipeline
+        - mode (FrameMode): per-frame processor of the selected mode (see engine.MODES)
+        - queue_size (int): capacity of the decoder -> inference and inference -> render queues
+        - drop_policy (str): policy of the decoder -> inference queue, one of DROP_POLICIES
+        - realtime (bool): pace the decoder at the source FPS instead of decoding as fast as possible
+        - stats_interval (float): seconds between two on_stats calls
+        - profiler (FrameProfiler): per-stage timings of the frames, a new one by default. Share one to follow
+    several runs (e.g. behind a profiling.MetricsServer)
+        - overlay (bool): write the stage latency percentiles on the frames
+    Callbacks, all called from the inference thread:
+        - on_result(frame, text, record): every processed frame, for headless sinks
+        - on_frame_ready(): an annotated frame is waiting in the render queue, take it with take_frame(). Frames are
+    only queued for rendering when this callback is given
+        - on_text(lines): replace the result text with these lines
+        - on_finished(lines): end of the stream was reached, append these lines to the result text
+        - on_stats(stats): see stats()
+    """
+
+    def __init__(self, cap, mode, queue_size=4, drop_policy='block', realtime=True, stats_interval=1.0,
+                 profiler=None, overlay=False, on_result=None, on_frame_ready=None, on_text=None, on_finished=None,
+                 on_stats=None):
+        self.cap = cap
+        self.mode = mode
+        self.profiler = profiler or FrameProfiler()
+        self.mode.profiler = self.profiler
+        self.overlay = overlay
+        self.realtime = realtime
+        self.stats_interval = stats_interval
+        self.on_result = on_result
+        self.on_frame_ready = on_frame_ready
+        self.on_text = on_text
+        self.on_finished = on_finished
+        self.on_stats = on_stats
+        self.counters = {'decode': StageCounter(), 'inference': StageCounter(), 'render': StageCounter()}
+        # Only the latest annotated frames are worth displaying, so the render queue always drops the oldest
+        self.decode_queue = BoundedQueue(queue_size, drop_policy, self.counters['decode'])
+        self.render_queue = BoundedQueue(queue_size, 'drop_oldest', self.counters['inference'])
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.threads = [threading.Thread(target=self._decode_loop, name='pipeline-decode', daemon=True),
+                        threading.Thread(target=self._inference_loop, name='pipeline-inference', daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, wait=True):
+        """Stop the threads, with `wait` until the inference thread has closed the mode (flushed its results)."""
+        self.stop_event.set()
+        if not self.threads:
+            # Never started, nothing else closes the mode
+            self.mode.close()
+        elif wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def wait(self, timeout=None):
+        """Block until the end of the stream (or stop()). Return False on timeout."""
+        for thread in self.threads:
+            thread.join(timeout)
+        return not self.is_running()
+
+    def take_frame(self):
+        """Return the next annotated frame to display (GUI thread), or None."""
+        return self.render_queue.get_nowait()
+
+    def frame_displayed(self, duration):
+        """Account a frame returned by take_frame() that took `duration` seconds to display."""
+        self.counters['render'].tick(duration)
+        self.profiler.add('display', duration)
+
+    def stats(self):
+        """
+        Return {stage: {'fps', 'busy_ms', 'frames', 'dropped', 'queue'}} where 'queue' is the input queue depth, plus
+        a 'detector' entry when the model of the mode reports stats.
+        """
+        queue_depths = {'decode': 0, 'inference': self.decode_queue.depth(), 'render': self.render_queue.depth()}
+        stats = {name: {'fps': round(counter.fps(), 1), 'busy_ms': round(counter.busy_ms(), 1),
+                        'frames': counter.frames, 'dropped': counter.dropped, 'queue': queue_depths[name]}
+                 for name, counter in self.counters.items()}
+        # Model wrappers (e.g. stride.StrideDetector) report their own counters
+        model_stats = getattr(self.mode.model, 'stats', None)
+        if model_stats is not None:
+            stats['detector'] = model_stats()
+        return stats
+
+    def _decode_loop(self):
+        decode_frames(self.cap, self.decode_queue, self.counters['decode'], self.stop_event, self.realtime,
+                      self.profiler)
+
+    def _inference_loop(self):
+        try:
+            self.profiler.start_frames()
+            self._run_inference()
+        finally:
+            self.profiler.close()
+            self.mode.close()
+
+    def _run_inference(self):
+        counter = self.counters['inference']
+        last_stats = time.perf_counter()
+        while not self.stop_event.is_set():
+            frame = self.decode_queue.get()
+            if frame is None:
+                continue
+            if frame is END_OF_STREAM:
+                if self.on_finished is not None:
+                    self.on_finished(self.mode.finish())
+                break
+
+            start = time.perf_counter()
+            detects = self.mode.infer(frame)
+            frame, text = self.mode.process(frame, detects)
+            if self.overlay:
+                self.profiler.draw_overlay(frame)
+            counter.tick(time.perf_counter() - start)
+            self.profiler.end_frame()
+
+            if self.on_result is not None:
+                self.on_result(frame, text, self.mode.record)
+            if text is not None and self.on_text is not None:
+                self.on_text(text)
+            if self.on_frame_ready is not None and self.render_queue.put(frame, self.stop_event):
+                self.on_frame_ready()
+
+            if self.on_stats is not None and time.perf_counter() - last_stats >= self.stats_interval:
+                self.on_stats(self.stats())
+                last_stats = time.perf_counter()
+        if self.on_stats is not None:
+            self.on_stats(self.stats())
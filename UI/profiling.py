@@ -0,0 +1,187 @@
+import cProfile
+import datetime
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2 as cv
+import numpy as np
+
+from sinks import JSONLSink
+
+# Stages of a frame, in order: decode (capture read), preprocess (model input, e.g. the zone crop), inference (model
+# call), postprocess (PPE association and tracking), drawing (annotations) and display (GUI only)
+STAGES = ('decode', 'preprocess', 'inference', 'postprocess', 'drawing', 'display')
+PERCENTILES = (50, 90, 99)
+
+
+class FrameProfiler:
+    """
+    Per-stage timings of the frames of a pipeline, with rolling percentiles over the last `window` samples of every
+    stage. Stages are timed from any thread (decode, inference, GUI). Optionally writes the percentiles to a JSON
+    Lines log every `log_interval` seconds, and runs cProfile on the inference thread for `cprofile_frames` frames.
+    Parameters:
+        - window (int): number of recent samples of a stage used for the percentiles
+        - log_path (str): JSON Lines log of the percentiles, None to disable it
+        - log_interval (float): seconds between two log rows
+        - cprofile_path (str): cProfile dump (pstats format, open it with snakeviz or `python -m pstats`), None to
+    disable profiling
+        - cprofile_frames (int): number of frames profiled from the start of the pipeline
+    """
+
+    def __init__(self, window=300, log_path=None, log_interval=1.0, cprofile_path=None, cprofile_frames=300):
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        # Totals since the start, the Prometheus summaries are cumulative
+        self.counts = dict.fromkeys(STAGES, 0)
+        self.sums = dict.fromkeys(STAGES, 0.0)
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.log_interval = log_interval
+        self.sink = JSONLSink(log_path, flush_every=1, overwrite=True) if log_path else None
+        self.last_log = time.perf_counter()
+        self.cprofile_path = cprofile_path
+        self.cprofile_frames = cprofile_frames
+        self.cprofile = None
+        self.cprofile_done = False
+        self.overlay_lines = []
+        self.last_overlay = 0.0
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+            self.sums[stage] += seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def start_frames(self):
+        """Called by the inference thread before its first frame: starts cProfile when it is enabled."""
+        if self.cprofile_path and not self.cprofile_done and self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def end_frame(self):
+        """Called by the inference thread after every frame."""
+        self.frames += 1
+        if self.cprofile is not None and self.frames >= self.cprofile_frames:
+            self._dump_cprofile()
+        if self.sink is not None and time.perf_counter() - self.last_log >= self.log_interval:
+            self.sink.write({'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                             'frames': self.frames, 'stages': self.summary()})
+            self.last_log = time.perf_counter()
+
+    def close(self):
+        """Dump a cProfile run shorter than `cprofile_frames` and close the log. Call it from the inference thread."""
+        if self.cprofile is not None:
+            self._dump_cprofile()
+        if self.sink is not None:
+            self.sink.close()
+
+    def _dump_cprofile(self):
+        self.cprofile.disable()
+        self.cprofile.dump_stats(self.cprofile_path)
+        self.cprofile = None
+        self.cprofile_done = True
+
+    def summary(self):
+        """
+        Return {stage: {'count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms'}} over the rolling window, for the stages
+        timed at least once.
+        """
+        with self.lock:
+            samples = {stage: np.array(values) * 1000 for stage, values in self.samples.items() if values}
+        summary = {}
+        for stage, values in samples.items():
+            summary[stage] = {'count': len(values), 'mean_ms': round(float(values.mean()), 2)}
+            for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                summary[stage][f'p{percentile}_ms'] = round(float(value), 2)
+        return summary
+
+    def draw_overlay(self, frame, refresh_interval=0.5):
+        """Write the stage percentiles in the top right corner of `frame`, refreshed every `refresh_interval` s."""
+        if time.perf_counter() - self.last_overlay >= refresh_interval:
+            self.overlay_lines = [f"{stage:<11} p50 {values['p50_ms']:6.1f}  p99 {values['p99_ms']:6.1f} ms"
+                                  for stage, values in self.summary().items()]
+            self.last_overlay = time.perf_counter()
+        x = frame.shape[1] - 420
+        for i, line in enumerate(self.overlay_lines):
+            y = 30 + 25 * i
+            cv.putText(frame, line, (x, y), cv.FONT_HERSHEY_PLAIN, 1.2, (0, 0, 0), 3)
+            cv.putText(frame, line, (x, y), cv.FONT_HERSHEY_PLAIN, 1.2, (255, 255, 255), 1)
+        return frame
+
+    def prometheus_text(self):
+        """Prometheus text exposition of the stage latencies (one summary per stage) and the frame count."""
+        summary = self.summary()
+        with self.lock:
+            counts, sums = dict(self.counts), dict(self.sums)
+        lines = ['# HELP ppe_stage_latency_seconds Latency of a pipeline stage per frame, rolling quantiles',
+                 '# TYPE ppe_stage_latency_seconds summary']
+        for stage, values in summary.items():
+            for percentile in PERCENTILES:
+                lines.append(f'ppe_stage_latency_seconds{{stage="{stage}",quantile="{percentile / 100}"}} '
+                             f"{values[f'p{percentile}_ms'] / 1000:.6f}")
+            lines.append(f'ppe_stage_latency_seconds_sum{{stage="{stage}"}} {sums[stage]:.6f}')
+            lines.append(f'ppe_stage_latency_seconds_count{{stage="{stage}"}} {counts[stage]}')
+        lines += ['# HELP ppe_frames_total Frames processed by the inference thread',
+                  '# TYPE ppe_frames_total counter',
+                  f'ppe_frames_total {self.frames}']
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint of a FrameProfiler, on a background thread: /metrics in the Prometheus text format and
+    /stats with the JSON summary. `profiler` may be replaced while the server runs (a new video in the GUI).
+    Parameters:
+        - profiler (FrameProfiler): the profiler served
+        - host (str): listening address, local only by default
+        - port (int): listening port, 0 picks a free one (see `port` after start())
+    """
+
+    def __init__(self, profiler, host='127.0.0.1', port=9108):
+        self.profiler = profiler
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = server.profiler.prometheus_text(), 'text/plain; version=0.0.4'
+                elif self.path == '/stats':
+                    body = json.dumps({'frames': server.profiler.frames, 'stages': server.profiler.summary()})
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,42 @@
+import cv2 as cv
+import numpy as np
+
+
+class Renderer:
+    """
+    Annotation drawing of the modes: the boxes of a color are drawn with one cv.polylines call, the texts with
+    cv.putText. The frames are the same as with cv.rectangle and cv.putText.
+    Parameters:
+        - enabled (bool): False skips all the drawing (headless runs without an output video)
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def text(self, frame, text, org, font=cv.FONT_HERSHEY_COMPLEX, scale=1.0, color=(0, 255, 0), thickness=1):
+        if not self.enabled:
+            return
+        cv.putText(frame, text, org, font, scale, color, thickness)
+
+    def layer(self, frame, lines):
+        """Draw the static text `lines` ((text, org, font, scale, color, thickness), ...)."""
+        if not self.enabled:
+            return
+        for text, org, font, scale, color, thickness in lines:
+            cv.putText(frame, text, org, font, scale, color, thickness)
+
+    def boxes(self, frame, boxes, color, thickness=2):
+        """Draw the (N, 4) xyxy `boxes` with one cv.polylines call."""
+        if not self.enabled or not len(boxes):
+            return
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        corners = boxes[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+        cv.polylines(frame, list(corners), True, color, thickness)
+
+    def labels(self, frame, texts, origins, font=cv.FONT_HERSHEY_COMPLEX, scale=1.0, color=(0, 255, 0),
+               thickness=1):
+        """Draw `texts` at the (N, 2) `origins`."""
+        if not self.enabled:
+            return
+        for text, org in zip(texts, np.asarray(origins).reshape(-1, 2).tolist()):
+            cv.putText(frame, text, org, font, scale, color, thickness)
@@ -0,0 +1,195 @@
+import csv
+import datetime
+import json
+import os
+import threading
+
+
+class ResultSink:
+    """
+    Append-only, buffered writer of result rows (dicts with the same keys). Rows are kept in memory and appended to
+    the file every `flush_every` rows, or by a timer `flush_interval` seconds after the first buffered row, so the
+    cost per row stays constant however long the run is and a row is on disk within `flush_interval`. With
+    `rotation`, a new file is started every hour or day, named after the period it covers:
+    'Tracking_State.csv' -> 'Tracking_State_2024-05-20_14.csv' (hour) or 'Tracking_State_2024-05-20.csv' (day).
+    Parameters:
+        - path (str): output file
+        - flush_every (int): number of buffered rows that triggers a flush
+        - flush_interval (float): seconds after which buffered rows are flushed
+        - rotation (str): None, 'hour' or 'day'
+        - overwrite (bool): empty an existing file the first time the sink opens it, instead of appending to it
+        - fieldnames (list): columns of the rows (CSV header), the keys of the first row by default
+    """
+    ROTATION_FORMATS = {None: None, 'hour': '%Y-%m-%d_%H', 'day': '%Y-%m-%d'}
+
+    def __init__(self, path, flush_every=100, flush_interval=5.0, rotation=None, overwrite=False, fieldnames=None):
+        if rotation not in self.ROTATION_FORMATS:
+            raise ValueError(f"Unknown rotation '{rotation}', expected None, 'hour' or 'day'")
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.rotation = rotation
+        self.overwrite = overwrite
+        self.fieldnames = list(fieldnames) if fieldnames is not None else None
+        self.opened_paths = set()
+        self.buffer = []
+        self.buffer_path = None
+        self.current_path = None
+        # The timer flushes from its own thread
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def period_path(self, now=None):
+        """Return the file the rows written at `now` go to."""
+        if self.rotation is None:
+            return self.path
+        stem, extension = os.path.splitext(self.path)
+        now = now or datetime.datetime.now()
+        return f'{stem}_{now.strftime(self.ROTATION_FORMATS[self.rotation])}{extension}'
+
+    def write(self, row):
+        path = self.period_path()
+        with self.lock:
+            # Rows of a finished period go to its file before the new period starts
+            if path != self.buffer_path:
+                self.flush()
+                self.buffer_path = path
+            self.buffer.append(row)
+            if len(self.buffer) >= self.flush_every:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if self.buffer:
+                path = self.buffer_path
+                if path != self.current_path:
+                    self._close_file()
+                    self._open_file(path, truncate=self.overwrite and path not in self.opened_paths)
+                    self.opened_paths.add(path)
+                    self.current_path = path
+                self._append(self.buffer)
+                self.buffer = []
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self._close_file()
+            self.current_path = None
+
+    def _open_file(self, path, truncate):
+        raise NotImplementedError
+
+    def _append(self, rows):
+        raise NotImplementedError
+
+    def _close_file(self):
+        raise NotImplementedError
+
+
+class CSVSink(ResultSink):
+    """
+    CSV file, the header is written when the file is created. The keys of a row that are not columns are left out,
+    the missing ones are left empty.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.file = None
+        self.writer = None
+        self.write_header = False
+
+    def _open_file(self, path, truncate):
+        self.write_header = truncate or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'w' if truncate else 'a', newline='')
+        self.writer = None
+
+    def _append(self, rows):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames or list(rows[0]),
+                                         extrasaction='ignore')
+            if self.write_header:
+                self.writer.writeheader()
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class JSONLSink(ResultSink):
+    """JSON Lines file, one object per row."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.file = None
+
+    def _open_file(self, path, truncate):
+        self.file = open(path, 'w' if truncate else 'a')
+
+    def _append(self, rows):
+        self.file.write(''.join(json.dumps(row) + '\n' for row in rows))
+        self.file.flush()
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class ParquetSink(ResultSink):
+    """
+    Parquet file written with pyarrow, every flush appends a row group. A Parquet file cannot be reopened for
+    appending: without `overwrite`, the rows go to a new part file next to an existing one, 'Tracking_State-1.parquet'
+    and so on. The file is readable once the sink is closed (its footer is written last).
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError('The Parquet result sink requires pyarrow: pip install pyarrow') from error
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.writer = None
+
+    def _open_file(self, path, truncate):
+        self.writer = None
+        stem, extension = os.path.splitext(path)
+        part = 0
+        while not truncate and os.path.exists(path):
+            part += 1
+            path = f'{stem}-{part}{extension}'
+        self.pending_path = path
+
+    def _append(self, rows):
+        table = self.pa.Table.from_pylist(rows)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.pending_path, table.schema)
+        self.writer.write_table(table)
+
+    def _close_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+SINKS = {'.csv': CSVSink, '.jsonl': JSONLSink, '.parquet': ParquetSink}
+
+
+def create_sink(path, **kwargs):
+    """Create the result sink matching the extension of `path` (.csv, .jsonl or .parquet)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f"Unsupported result file '{path}', expected one of {list(SINKS)}")
+    return SINKS[extension](path, **kwargs)
@@ -0,0 +1,118 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """
+    Durations of the startup phases (imports, window, model load, warm-up, first frame), in seconds. Phases may run
+    on different threads, e.g. the model loads while the window is built.
+    Parameters:
+        - start (float): time.perf_counter() at the start of the application
+    """
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self):
+        """Seconds since the start of the application."""
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        with self.lock:
+            return {name: round(seconds, 3) for name, seconds in self.phases.items()}
+
+    def __str__(self):
+        return ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in self.as_dict().items())
+
+
+def warm_up(model, frame_size=(1920, 1080), runs=2):
+    """
+    Run the model on blank frames so that the first real frame does not pay for the lazy initialisation (graph
+    optimisation, memory allocation). The frames have the size of the video, so the model letterboxes them to the
+    same input tensor shape as the real frames at its configured input size.
+    """
+    # Imported here, the GUI imports this module before showing its window
+    import numpy as np
+    frame = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+    for _ in range(runs):
+        model(frame, verbose=False)
+
+
+class ModelLoader:
+    """
+    Load the detector and warm it up on a background thread, so the window shows up while the heavy libraries
+    (ultralytics, torch or the inference runtime) are imported. The progress goes through `state`:
+    'loading' -> 'warming up' -> 'ready', or 'failed' with the exception in `error`.
+    Parameters:
+        - load (callable): function returning the model, e.g. a partial of backends.load_detector
+        - imports (tuple): modules imported before `load`, reported apart as 'runtime_import'
+        - frame_size (tuple): (width, height) of the warm-up frames, see warm_up
+        - warmup_runs (int): number of warm-up inferences, 0 to skip the warm-up
+        - report (StartupReport): receives the 'runtime_import', 'model_load' and 'warmup' durations
+        - on_state (callable): called with the new state, from the loader thread
+    """
+
+    def __init__(self, load, imports=('ultralytics',), frame_size=(1920, 1080), warmup_runs=2, report=None,
+                 on_state=None):
+        self.load = load
+        self.imports = imports
+        self.frame_size = frame_size
+        self.warmup_runs = warmup_runs
+        self.report = report or StartupReport()
+        self.on_state = on_state
+        self.state = 'idle'
+        self.model = None
+        self.error = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='model-loader', daemon=True)
+        self.thread.start()
+        return self
+
+    def ready(self):
+        return self.state == 'ready'
+
+    def wait(self, timeout=None):
+        """Block until the model is ready or failed. Return the model, or None."""
+        self.thread.join(timeout)
+        return self.model
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_state is not None:
+            self.on_state(state)
+
+    def _run(self):
+        try:
+            self._set_state('loading')
+            with self.report.phase('runtime_import'):
+                for name in self.imports:
+                    importlib.import_module(name)
+            with self.report.phase('model_load'):
+                model = self.load()
+            if self.warmup_runs:
+                self._set_state('warming up')
+                with self.report.phase('warmup'):
+                    warm_up(model, self.frame_size, self.warmup_runs)
+            self.model = model
+            self._set_state('ready')
+        except Exception as error:
+            self.error = error
+            self._set_state('failed')
@@ -0,0 +1,242 @@
+"""
+Live view of the annotated frames in a browser: a local HTTP server streaming them as MJPEG
+(multipart/x-mixed-replace), fed by the pipeline that runs the mode, so the viewers cost no extra inference.
+
+    http://127.0.0.1:8081/                       page with every stream
+    http://127.0.0.1:8081/stream/<name>.mjpg     MJPEG stream of a camera ('default' for a single video)
+    http://127.0.0.1:8081/snapshot/<name>.jpg    latest frame
+
+A frame is encoded once, in the encoder thread of its stream and only while someone watches, and the JPEG is shared
+by all the clients. Every client sends the latest JPEG when it is ready for the next one, so a slow viewer skips
+frames instead of delaying the others or the pipeline.
+"""
+import html
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2 as cv
+
+from decoding import decode_size
+
+BOUNDARY = 'frame'
+
+
+def encode_jpeg(frame, max_size, quality, resized=None):
+    """
+    JPEG of `frame` with its longest side at most `max_size`.
+    Returns:
+        - bytes: the JPEG
+        - np.array: the resized frame, give it back as `resized` to reuse its buffer
+    """
+    height, width = frame.shape[:2]
+    size = decode_size(width, height, max_size)
+    if size != (width, height):
+        resized = cv.resize(frame, size, resized, interpolation=cv.INTER_LINEAR)
+        frame = resized
+    return cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, quality])[1].tobytes(), resized
+
+
+class FrameStream:
+    """
+    Latest frame of a camera and its shared JPEG. publish() only keeps a reference to the frame (the pipeline does
+    not modify a frame once processed), the encoder thread resizes and encodes the latest one at most `max_fps`
+    times per second while `clients` > 0.
+    """
+
+    def __init__(self, name, max_size=960, quality=75, max_fps=15.0):
+        self.name = name
+        self.max_size = max_size
+        self.quality = quality
+        self.max_fps = max_fps
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.jpeg = None
+        self.jpeg_id = 0
+        # frame_id of the JPEG
+        self.jpeg_frame_id = 0
+        self.clients = 0
+        self.stopped = False
+        self.counters = dict.fromkeys(['published', 'encoded', 'sent', 'skipped'], 0)
+        self.thread = threading.Thread(target=self._encode_loop, name=f'mjpeg-{name}', daemon=True)
+        self.thread.start()
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.frame_id += 1
+            self.counters['published'] += 1
+            self.condition.notify_all()
+
+    def _encode_loop(self):
+        encoded_id = 0
+        last_encode = 0.0
+        resized = None
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or (self.clients and self.frame_id != encoded_id))
+                if self.stopped:
+                    return
+            if self.max_fps:
+                time.sleep(max(0.0, last_encode + 1 / self.max_fps - time.perf_counter()))
+            last_encode = time.perf_counter()
+            with self.condition:
+                frame, encoded_id = self.frame, self.frame_id
+            jpeg, resized = encode_jpeg(frame, self.max_size, self.quality, resized)
+            with self.condition:
+                self.jpeg = jpeg
+                self.jpeg_id += 1
+                self.jpeg_frame_id = encoded_id
+                self.counters['encoded'] += 1
+                self.condition.notify_all()
+
+    def snapshot(self):
+        """JPEG of the latest frame, None before the first frame."""
+        with self.condition:
+            if self.jpeg is not None and self.jpeg_frame_id == self.frame_id:
+                return self.jpeg
+            frame = self.frame
+        return None if frame is None else encode_jpeg(frame, self.max_size, self.quality)[0]
+
+    def frames(self):
+        """Generator of the JPEGs sent to a client, the latest one each time the client is ready."""
+        sent_id = 0
+        with self.condition:
+            self.clients += 1
+            self.condition.notify_all()
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.stopped or self.jpeg_id != sent_id, timeout=1.0)
+                    if self.stopped:
+                        return
+                    if self.jpeg_id == sent_id:
+                        continue
+                    if sent_id:
+                        self.counters['skipped'] += self.jpeg_id - sent_id - 1
+                    jpeg, sent_id = self.jpeg, self.jpeg_id
+                    self.counters['sent'] += 1
+                yield jpeg
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class MJPEGServer:
+    """
+    Local HTTP server of the MJPEG streams, on background threads. Give publish() (or on_result()) to the pipeline.
+    Parameters:
+        - host (str): listening address, local only by default (0.0.0.0 for the other machines of the site network)
+        - port (int): listening port, 0 picks a free one (see `port` after start())
+        - max_size (int): longest side of the streamed frames, None keeps the frame size
+        - quality (int): JPEG quality
+        - max_fps (float): maximum frames per second of a stream, 0 for no limit
+        - client_timeout (float): seconds before a client that stopped reading is disconnected
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081, max_size=960, quality=75, max_fps=15.0, client_timeout=10.0):
+        self.max_size = max_size
+        self.quality = quality
+        self.max_fps = max_fps
+        self.streams = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.connection.settimeout(client_timeout)
+                if self.path == '/':
+                    self.send_body(server.index_page().encode(), 'text/html; charset=utf-8')
+                elif self.path.startswith('/stream/') and self.path.endswith('.mjpg'):
+                    stream = server.streams.get(urllib.parse.unquote(self.path[len('/stream/'):-len('.mjpg')]))
+                    if stream is None:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    frames = stream.frames()
+                    try:
+                        for jpeg in frames:
+                            self.wfile.write(f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                                             f'{len(jpeg)}\r\n\r\n'.encode() + jpeg + b'\r\n')
+                            self.wfile.flush()
+                    except OSError:
+                        # The viewer went away or stopped reading
+                        pass
+                    finally:
+                        frames.close()
+                elif self.path.startswith('/snapshot/') and self.path.endswith('.jpg'):
+                    stream = server.streams.get(urllib.parse.unquote(self.path[len('/snapshot/'):-len('.jpg')]))
+                    jpeg = stream.snapshot() if stream is not None else None
+                    if jpeg is None:
+                        self.send_error(404)
+                        return
+                    self.send_body(jpeg, 'image/jpeg')
+                else:
+                    self.send_error(404)
+
+            def send_body(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def stream(self, name='default'):
+        """FrameStream `name`, created the first time."""
+        with self.lock:
+            if name not in self.streams:
+                self.streams[name] = FrameStream(name, self.max_size, self.quality, self.max_fps)
+            return self.streams[name]
+
+    def publish(self, frame, name='default'):
+        """Make `frame` the latest frame of the stream `name`, cheap enough for the inference thread."""
+        self.stream(name).publish(frame)
+
+    def on_result(self, frame, text, record):
+        """on_result callback of a pipeline.VideoPipeline."""
+        self.publish(frame)
+
+    def on_camera_result(self, name, frame, text, record):
+        """on_result callback of a multicam.MultiCameraMonitor, one stream per camera."""
+        self.publish(frame, str(name))
+
+    def index_page(self):
+        images = ''.join(f'<figure><img src="/stream/{urllib.parse.quote(name)}.mjpg"><figcaption>'
+                         f'{html.escape(name)}</figcaption></figure>' for name in self.streams) or \
+            '<p>No video running</p>'
+        return (f'<!DOCTYPE html><html><head><title>PPE monitoring</title><style>figure {{display: inline-block}} '
+                f'img {{max-width: 100%}}</style></head><body>{images}</body></html>')
+
+    def stats(self):
+        """{stream: {'published', 'encoded', 'sent', 'skipped', 'clients'}}"""
+        return {name: {**stream.counters, 'clients': stream.clients} for name, stream in self.streams.items()}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mjpeg-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        for stream in self.streams.values():
+            stream.stop()
+        self.httpd.shutdown()
+        self.httpd.server_close()
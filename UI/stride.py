@@ -0,0 +1,113 @@
+import time
+import warnings
+
+import cv2 as cv
+import numpy as np
+
+from detections import Detections
+from pipeline import StageCounter
+
+
+def small_gray(image, size):
+    """Downscale `image` so that its longest side is `size` and convert it to grayscale. Returns (gray, scale)."""
+    scale = size / max(image.shape[:2])
+    small = cv.resize(image, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA) if scale < 1 else image
+    gray = cv.cvtColor(small, cv.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    return gray, min(scale, 1.0)
+
+
+def motion_score(gray_a, gray_b):
+    """Mean absolute difference of two grayscale images of the same size, in gray levels."""
+    return float(cv.absdiff(gray_a, gray_b).mean())
+
+
+def propagate_boxes(prev_gray, gray, boxes, scale, grid=3):
+    """
+    Move boxes from the previous frame to the current one with sparse Lucas-Kanade optical flow: a grid of points
+    is tracked inside every box and each box is shifted by the median motion of its points.
+    Parameters:
+        - prev_gray, gray (np.array): downscaled grayscale previous and current frames
+        - boxes (np.array): (N, 4) xyxy boxes in full-resolution coordinates
+        - scale (float): downscale factor of the grayscale frames
+        - grid (int): points tracked per box side
+    Returns:
+        - np.array: (N, 4) shifted boxes
+        - float: fraction of the points that were tracked successfully
+    """
+    if len(boxes) == 0:
+        return boxes, 1.0
+    steps = np.linspace(0.2, 0.8, grid)
+    fx, fy = np.meshgrid(steps, steps)
+    x1, y1, x2, y2 = [boxes[:, i:i + 1] * scale for i in range(4)]
+    points = np.stack([x1 + (x2 - x1) * fx.ravel(), y1 + (y2 - y1) * fy.ravel()], axis=-1).astype(np.float32)
+
+    next_points, status, _ = cv.calcOpticalFlowPyrLK(prev_gray, gray, points.reshape(-1, 1, 2), None,
+                                                     winSize=(15, 15), maxLevel=2)
+    status = status.reshape(len(boxes), -1).astype(bool)
+    motion = (next_points.reshape(points.shape) - points) / scale
+    motion[~status] = np.nan
+    with warnings.catch_warnings():
+        # Boxes whose points were all lost keep their position
+        warnings.simplefilter('ignore', RuntimeWarning)
+        shift = np.nan_to_num(np.nanmedian(motion, axis=1))
+    return boxes + np.tile(shift, 2), float(status.mean())
+
+
+class StrideDetector:
+    """
+    Model wrapper running the detector only on key frames and carrying the boxes forward with optical flow in
+    between. A frame is a key frame every `stride` frames, when the scene changes (mean difference to the last key
+    frame above `motion_threshold`) or when the optical flow loses too many points.
+    It is called like the YOLO model, so every mode can use it unchanged.
+    Parameters:
+        - model (YOLO object): the detection model
+        - stride (int): maximum number of frames between two detector runs
+        - motion_threshold (float): mean gray-level difference that forces a detector run
+        - min_tracked (float): fraction of optical flow points that must be tracked to skip the detector
+        - flow_size (int): longest side of the downscaled frames used for motion and optical flow
+    """
+
+    def __init__(self, model, stride=4, motion_threshold=12.0, min_tracked=0.5, flow_size=320):
+        self.model = model
+        self.names = model.names
+        self.stride = stride
+        self.motion_threshold = motion_threshold
+        self.min_tracked = min_tracked
+        self.flow_size = flow_size
+        self.detector_counter = StageCounter()
+        self.frames = 0
+        self.key_gray = None
+        self.prev_gray = None
+        self.last = None
+        self.since_key = 0
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        return [self.detect(image, **kwargs) for image in images]
+
+    def detect(self, image, **kwargs):
+        self.frames += 1
+        gray, scale = small_gray(image, self.flow_size)
+
+        if self.last is not None and self.since_key < self.stride and gray.shape == self.key_gray.shape and \
+                motion_score(gray, self.key_gray) < self.motion_threshold:
+            boxes, tracked = propagate_boxes(self.prev_gray, gray, self.last.boxes.xyxy, scale)
+            if tracked >= self.min_tracked:
+                self.last = Detections(boxes, self.last.boxes.conf, self.last.boxes.cls, self.last.names)
+                self.prev_gray = gray
+                self.since_key += 1
+                return self.last
+
+        start = time.perf_counter()
+        self.last = Detections.from_results(self.model(image, **kwargs)[0])
+        self.detector_counter.tick(time.perf_counter() - start)
+        self.key_gray = self.prev_gray = gray
+        self.since_key = 1
+        return self.last
+
+    def stats(self):
+        """Detector runs and their rate, to compare with the display FPS."""
+        counter = self.detector_counter
+        return {'fps': round(counter.fps(), 1), 'busy_ms': round(counter.busy_ms(), 1), 'frames': counter.frames,
+                'skipped': self.frames - counter.frames}
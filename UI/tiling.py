@@ -0,0 +1,117 @@
+import time
+
+import numpy as np
+
+from association import PERSON_CLASS, iou_matrix
+from detections import Detections
+from pipeline import StageCounter
+
+SMALL_PPE_CLASSES = (1, 2, 3)  # dust mask, glass, gloves: a few pixels wide in a 1080p site shot seen at 640
+
+
+def nms(boxes, scores, classes, iou_threshold=0.5):
+    """Indexes of the boxes kept by class-wise greedy non-maximum suppression, highest score first."""
+    suppress = (iou_matrix(boxes, boxes) > iou_threshold) & (classes[:, None] == classes[None, :])
+    removed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in np.argsort(-scores):
+        if not removed[i]:
+            keep.append(i)
+            removed |= suppress[i]
+    return np.array(keep, dtype=int)
+
+
+class TiledPPEDetector:
+    """
+    Model wrapper choosing the input resolution per frame for small PPE. A low-resolution pass on the whole frame
+    finds the persons, then only the crops around the persons that the crop pass sees at least `min_gain` times
+    larger are run again at `crop_imgsz`, in one batch. The small PPE found in the crops is mapped back to frame
+    coordinates and merged with the first pass by non-maximum suppression, so ppe_inspection and every mode use the
+    merged detections unchanged. Frames without small persons cost a single low-resolution inference.
+    At the default 320, the whole-frame pass has a quarter of the pixels of the usual 640 pass, and about a quarter
+    of its convolution cost (YOLOv8m: ~20 instead of 79 GFLOPs). In exchange, the persons smaller than ~10 px at 320
+    (60 px tall in a 1080p frame, against 30 px at 640) may be missed, and their PPE with them. Set it to 640 to
+    keep them, tiling then only adds the crop pass to the normal inference.
+    Parameters:
+        - model (YOLO object): the detection model
+        - low_imgsz (int): input size of the whole-frame pass
+        - crop_imgsz (int): input size of the person crops
+        - crop_classes (tuple): classes taken from the crops, the other classes come from the whole-frame pass
+        - person_conf (float): minimum confidence of a person to be cropped
+        - margin (float): crop margin around a person, as a fraction of its width and height
+        - min_gain (float): minimum magnification of a person in the crop pass compared to the whole-frame pass
+        - max_crops (int): maximum crops per frame, the smallest persons (largest gain) first
+        - iou_threshold (float): IoU above which two boxes of the same class are merged
+    """
+
+    def __init__(self, model, low_imgsz=320, crop_imgsz=640, crop_classes=SMALL_PPE_CLASSES, person_conf=0.4,
+                 margin=0.15, min_gain=1.5, max_crops=8, iou_threshold=0.5):
+        self.model = model
+        self.names = model.names
+        self.low_imgsz = low_imgsz
+        self.crop_imgsz = crop_imgsz
+        self.crop_classes = np.array(crop_classes)
+        self.person_conf = person_conf
+        self.margin = margin
+        self.min_gain = min_gain
+        self.max_crops = max_crops
+        self.iou_threshold = iou_threshold
+        self.counter = StageCounter()
+        self.crops = 0
+
+    def crop_boxes(self, image, detections):
+        """(K, 4) integer xyxy crops around the persons of `detections` worth a high-resolution pass."""
+        height, width = image.shape[:2]
+        boxes = detections.boxes
+        persons = boxes.xyxy[(boxes.cls == PERSON_CLASS) & (boxes.conf >= self.person_conf)]
+        if not len(persons):
+            return np.empty((0, 4), dtype=int)
+
+        size = persons[:, 2:] - persons[:, :2]
+        crops = np.clip(persons + np.hstack([-size, size]) * self.margin, 0, [width, height, width, height])
+        side = np.maximum((crops[:, 2:] - crops[:, :2]).max(axis=1), 1)
+        # Pixels of the person in the crop input / pixels in the whole-frame input
+        gain = (self.crop_imgsz / side) / (self.low_imgsz / max(height, width))
+        order = np.argsort(-gain)[:self.max_crops]
+        return crops[order[gain[order] >= self.min_gain]].round().astype(int)
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        start = time.perf_counter()
+        low = [Detections.from_results(result) for result in self.model(images, imgsz=self.low_imgsz, **kwargs)]
+
+        crops, owners, offsets = [], [], []
+        for i, (image, detections) in enumerate(zip(images, low)):
+            for x1, y1, x2, y2 in self.crop_boxes(image, detections):
+                crops.append(image[y1:y2, x1:x2])
+                owners.append(i)
+                offsets.append([x1, y1, x1, y1])
+        crop_results = self.model(crops, imgsz=self.crop_imgsz, **kwargs) if crops else []
+
+        merged = []
+        for i, detections in enumerate(low):
+            boxes = detections.boxes
+            xyxy, conf, cls = [boxes.xyxy], [boxes.conf], [boxes.cls]
+            for owner, offset, result in zip(owners, offsets, crop_results):
+                if owner == i:
+                    crop = Detections.from_results(result).boxes
+                    small = np.isin(crop.cls, self.crop_classes)
+                    xyxy.append(crop.xyxy[small] + offset)
+                    conf.append(crop.conf[small])
+                    cls.append(crop.cls[small])
+            xyxy, conf, cls = np.concatenate(xyxy), np.concatenate(conf), np.concatenate(cls)
+            keep = nms(xyxy, conf, cls, self.iou_threshold)
+            merged.append(Detections(xyxy[keep], conf[keep], cls[keep], self.names))
+
+        self.crops += len(crops)
+        duration = time.perf_counter() - start
+        for _ in images:
+            self.counter.tick(duration / len(images))
+        return merged
+
+    def stats(self):
+        """Detector runs and the high-resolution crops they needed."""
+        counter = self.counter
+        return {'fps': round(counter.fps(), 1), 'busy_ms': round(counter.busy_ms(), 1), 'frames': counter.frames,
+                'crops': self.crops}
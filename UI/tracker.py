@@ -0,0 +1,178 @@
+import numpy as np
+
+from association import PPE_CLASSES, PPEAssociation, iou_matrix
+
+# Constant velocity Kalman filter on [cx, cy, area, aspect ratio, vx, vy, v_area] (SORT)
+_F = np.eye(7, dtype=np.float64)
+_F[0, 4] = _F[1, 5] = _F[2, 6] = 1
+_H = np.eye(4, 7, dtype=np.float64)
+_Q = np.diag([1, 1, 1, 1, 0.01, 0.01, 1e-4])
+_R = np.diag([1, 1, 10, 10])
+_P0 = np.diag([10, 10, 10, 10, 1e4, 1e4, 1e4])
+
+
+def boxes_to_measurements(boxes):
+    """(N, 4) xyxy boxes -> (N, 4) [cx, cy, area, aspect ratio]."""
+    boxes = boxes.astype(np.float64)
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / np.maximum(h, 1e-6)], axis=1)
+
+
+def states_to_boxes(states):
+    """(N, 7) Kalman states -> (N, 4) xyxy boxes."""
+    area = np.maximum(states[:, 2], 1e-6)
+    w = np.sqrt(area * np.maximum(states[:, 3], 1e-6))
+    h = area / w
+    return np.stack([states[:, 0] - w / 2, states[:, 1] - h / 2, states[:, 0] + w / 2, states[:, 1] + h / 2], axis=1)
+
+
+def greedy_match(iou, threshold):
+    """
+    Match rows to columns by decreasing IoU.
+    Returns:
+        - np.array: (K, 2) matched (row, column) pairs with an IoU of at least `threshold`
+    """
+    if iou.size == 0:
+        return np.empty((0, 2), dtype=int)
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols], kind='stable')
+    used_rows, used_cols, matches = set(), set(), []
+    for row, col in zip(rows[order], cols[order]):
+        if row not in used_rows and col not in used_cols:
+            used_rows.add(row)
+            used_cols.add(col)
+            matches.append((row, col))
+    return np.array(matches, dtype=int).reshape(-1, 2)
+
+
+class WorkerTracker:
+    """
+    SORT/ByteTrack-style multi-person tracker. All tracks are kept in arrays and predicted, matched and corrected
+    together: Kalman filter for the motion, IoU matching of high-confidence detections first, then of low-confidence
+    detections against the tracks left over (ByteTrack).
+    The PPE status of each track is an exponential moving average of its per-frame PPE observations, so one missed
+    helmet or vest detection does not flip a worker into a normal person.
+    Parameters:
+        - iou_threshold (float): minimum IoU to match a track with a high-confidence detection
+        - low_iou_threshold (float): minimum IoU to match a track with a low-confidence detection
+        - max_age (int): frames a track survives without detection
+        - min_hits (int): detections needed before a track is confirmed
+        - max_coast (int): frames a confirmed track keeps being reported on its predicted box after losing detection
+        - ppe_smoothing (float): weight of the new observation in the PPE moving average
+        - ppe_classes (list): PPE class ids, must match the columns of the PPE observations
+    """
+
+    def __init__(self, iou_threshold=0.3, low_iou_threshold=0.5, max_age=30, min_hits=3, max_coast=5,
+                 ppe_smoothing=0.3, ppe_classes=PPE_CLASSES):
+        self.iou_threshold = iou_threshold
+        self.low_iou_threshold = low_iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.max_coast = max_coast
+        self.ppe_smoothing = ppe_smoothing
+        self.ppe_classes = np.asarray(ppe_classes, dtype=int)
+        self.next_id = 1
+
+        num_ppe = len(self.ppe_classes)
+        self.ids = np.empty(0, dtype=int)
+        self.states = np.empty((0, 7))
+        self.covariances = np.empty((0, 7, 7))
+        self.hits = np.empty(0, dtype=int)
+        self.misses = np.empty(0, dtype=int)
+        self.scores = np.empty(0)
+        self.ppe = np.empty((0, num_ppe))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, boxes, scores, ppe=None, low_boxes=None, low_scores=None):
+        """
+        Advance the tracker by one frame.
+        Parameters:
+            - boxes (np.array): (N, 4) xyxy boxes of the confident person detections
+            - scores (np.array): (N,) their confidences
+            - ppe (np.array): (N, C) bool PPE observations of these detections (e.g. PPEAssociation.matched)
+            - low_boxes, low_scores (np.array): (L, 4) and (L,) low-confidence person detections, only used to keep
+        existing tracks alive
+        Returns:
+            - PPEAssociation: the confirmed tracks with their smoothed PPE status, `track_ids` holds their identities
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        ppe = np.zeros((len(boxes), len(self.ppe_classes))) if ppe is None else np.asarray(ppe, dtype=np.float64)
+        low_boxes = np.empty((0, 4)) if low_boxes is None else np.asarray(low_boxes, dtype=np.float64).reshape(-1, 4)
+        low_scores = np.empty(0) if low_scores is None else np.asarray(low_scores, dtype=np.float64).reshape(-1)
+
+        self._predict()
+        predicted = states_to_boxes(self.states)
+
+        # First association: confident detections with every track
+        matches = greedy_match(iou_matrix(predicted, boxes), self.iou_threshold)
+        unmatched_tracks = np.setdiff1d(np.arange(len(self)), matches[:, 0])
+        unmatched_detections = np.setdiff1d(np.arange(len(boxes)), matches[:, 1])
+
+        # Second association: low-confidence detections with the remaining tracks
+        low_matches = greedy_match(iou_matrix(predicted[unmatched_tracks], low_boxes), self.low_iou_threshold)
+        low_matches[:, 0] = unmatched_tracks[low_matches[:, 0]]
+
+        self._correct(matches[:, 0], boxes[matches[:, 1]], scores[matches[:, 1]])
+        self._correct(low_matches[:, 0], low_boxes[low_matches[:, 1]], low_scores[low_matches[:, 1]])
+        # Only confident detections carry a PPE observation
+        alpha = self.ppe_smoothing
+        self.ppe[matches[:, 0]] = (1 - alpha) * self.ppe[matches[:, 0]] + alpha * ppe[matches[:, 1]]
+
+        self._spawn(boxes[unmatched_detections], scores[unmatched_detections], ppe[unmatched_detections])
+        self._prune()
+        return self.confirmed()
+
+    def confirmed(self):
+        """Return the confirmed tracks reported for the current frame as a PPEAssociation."""
+        selected = (self.hits >= self.min_hits) & (self.misses <= self.max_coast)
+        boxes = np.round(states_to_boxes(self.states[selected])).astype(int)
+        return PPEAssociation(boxes, self.scores[selected], self.ppe_classes, self.ppe[selected] >= 0.5,
+                              track_ids=self.ids[selected])
+
+    def _predict(self):
+        # Keep the area positive when it shrinks fast
+        shrinking = self.states[:, 2] + self.states[:, 6] <= 0
+        self.states[shrinking, 6] = 0
+        self.states = self.states @ _F.T
+        self.covariances = _F @ self.covariances @ _F.T + _Q
+        self.misses += 1
+
+    def _correct(self, tracks, boxes, scores):
+        if len(tracks) == 0:
+            return
+        P = self.covariances[tracks]
+        innovation = boxes_to_measurements(boxes) - self.states[tracks] @ _H.T
+        S = _H @ P @ _H.T + _R
+        K = P @ _H.T @ np.linalg.inv(S)
+        self.states[tracks] += np.einsum('nij,nj->ni', K, innovation)
+        self.covariances[tracks] = (np.eye(7) - K @ _H) @ P
+        self.hits[tracks] += 1
+        self.misses[tracks] = 0
+        self.scores[tracks] = scores
+
+    def _spawn(self, boxes, scores, ppe):
+        count = len(boxes)
+        if count == 0:
+            return
+        states = np.zeros((count, 7))
+        states[:, :4] = boxes_to_measurements(boxes)
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + count)])
+        self.next_id += count
+        self.states = np.concatenate([self.states, states])
+        self.covariances = np.concatenate([self.covariances, np.repeat(_P0[None], count, axis=0)])
+        self.hits = np.concatenate([self.hits, np.ones(count, dtype=int)])
+        self.misses = np.concatenate([self.misses, np.zeros(count, dtype=int)])
+        self.scores = np.concatenate([self.scores, scores])
+        self.ppe = np.concatenate([self.ppe, ppe])
+
+    def _prune(self):
+        alive = self.misses <= self.max_age
+        if alive.all():
+            return
+        self.ids, self.states, self.covariances = self.ids[alive], self.states[alive], self.covariances[alive]
+        self.hits, self.misses, self.scores, self.ppe = (self.hits[alive], self.misses[alive], self.scores[alive],
+                                                         self.ppe[alive])
@@ -0,0 +1,145 @@
+import json
+import os
+
+import numpy as np
+
+from detections import Detections
+
+
+class Zone:
+    """
+    Region of interest of a camera, a rectangle or a polygon. Coordinates are in pixels, or in fractions of the frame
+    size when `normalized` is True, so the same zone works at any resolution.
+    Parameters:
+        - name (str): name of the zone
+        - rect (list): [x1, y1, x2, y2]
+        - polygon (list): [[x, y], ...], used instead of `rect` when given
+        - normalized (bool): coordinates are fractions of the frame width and height
+        - gate (list): [top, bottom] fractions of the zone height, a person whose box starts above `top` and ends
+    below `bottom` fills the zone and is inspected (Inspection mode)
+        - required_workers (int): number of workers the zone needs (Tracking mode), None for the mode default
+    """
+
+    def __init__(self, name, rect=None, polygon=None, normalized=False, gate=None, required_workers=None):
+        if rect is None and polygon is None:
+            raise ValueError(f"Zone '{name}' needs a 'rect' or a 'polygon'")
+        self.name = name
+        self.points = np.array(polygon if polygon is not None else
+                               [[rect[0], rect[1]], [rect[2], rect[1]], [rect[2], rect[3]], [rect[0], rect[3]]],
+                               dtype=np.float64)
+        self.is_rect = polygon is None
+        self.normalized = normalized
+        self.gate = gate
+        self.required_workers = required_workers
+        self._resolved = {}
+
+    def resolve(self, width, height):
+        """Return the polygon in pixels and its bounding rectangle (x1, y1, x2, y2) for a frame size."""
+        if (width, height) not in self._resolved:
+            points = self.points * [width, height] if self.normalized else self.points.copy()
+            points = np.clip(np.round(points), 0, [width, height])
+            x1, y1 = map(int, points.min(axis=0))
+            x2, y2 = map(int, points.max(axis=0))
+            self._resolved[(width, height)] = points, (x1, y1, x2, y2)
+        return self._resolved[(width, height)]
+
+    def key(self):
+        """Geometry of the zone, identifying the detections made on it (see detection_cache)."""
+        return self.points.tolist(), self.is_rect, self.normalized
+
+    def bounds(self, frame):
+        return self.resolve(frame.shape[1], frame.shape[0])[1]
+
+    def crop(self, frame):
+        """Return the bounding rectangle of the zone in `frame` (a view, no copy)."""
+        x1, y1, x2, y2 = self.bounds(frame)
+        return frame[y1:y2, x1:x2]
+
+    def contains(self, points, frame_size):
+        """(N, 2) points in frame coordinates -> (N,) bool, True inside the zone (even-odd rule)."""
+        polygon, (x1, y1, x2, y2) = self.resolve(*frame_size)
+        x, y = points[:, 0:1], points[:, 1:2]
+        if self.is_rect:
+            return ((x >= x1) & (x <= x2) & (y >= y1) & (y <= y2))[:, 0]
+        xa, ya = polygon[:, 0][None], polygon[:, 1][None]
+        xb, yb = np.roll(polygon[:, 0], -1)[None], np.roll(polygon[:, 1], -1)[None]
+        crosses = (ya > y) != (yb > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = xa + (y - ya) * (xb - xa) / (yb - ya)
+        return (np.count_nonzero(crosses & (x < x_cross), axis=1) % 2) == 1
+
+
+def load_zones(path, camera='default'):
+    """
+    Load the zones of a camera from a YAML or JSON file:
+
+        cameras:
+          default:
+            normalized: true
+            zones:
+              - name: checkpoint
+                rect: [0.3177, 0.0157, 0.6432, 1.0]
+                gate: [0.047, 0.988]
+              - name: scaffold
+                polygon: [[0.05, 0.2], [0.3, 0.2], [0.3, 0.9], [0.05, 0.9]]
+                required_workers: 3
+
+    Returns:
+        - list: the Zone objects of the camera
+    """
+    with open(path) as file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            config = json.load(file)
+        else:
+            import yaml
+
+            config = yaml.safe_load(file)
+
+    cameras = config.get('cameras', {})
+    if camera not in cameras:
+        raise KeyError(f"Camera '{camera}' not found in {path}, available cameras: {list(cameras)}")
+    camera_config = cameras[camera]
+    normalized = camera_config.get('normalized', False)
+    return [Zone(zone.get('name', f'zone {i}'), rect=zone.get('rect'), polygon=zone.get('polygon'),
+                 normalized=zone.get('normalized', normalized), gate=zone.get('gate'),
+                 required_workers=zone.get('required_workers'))
+            for i, zone in enumerate(camera_config.get('zones', []))]
+
+
+class ZoneDetector:
+    """
+    Model wrapper running the detector only on the zones of the frame: the zone crops of every frame are given to the
+    model as one batch, their boxes are mapped back to frame coordinates and only the detections whose centre lies
+    inside a zone are kept (an object in two overlapping zones is reported twice). It is called like the YOLO model,
+    so every mode can use it unchanged.
+    Parameters:
+        - model (YOLO object): the detection model
+        - zones (list): the Zone objects, see load_zones
+    """
+
+    def __init__(self, model, zones):
+        self.model = model
+        self.names = model.names
+        self.zones = zones
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        crops = [zone.crop(image) for image in images for zone in self.zones]
+        results = self.model(crops, **kwargs)
+
+        detections = []
+        for i, image in enumerate(images):
+            frame_size = (image.shape[1], image.shape[0])
+            xyxy, conf, cls = [np.empty((0, 4))], [np.empty(0)], [np.empty(0)]
+            for zone, result in zip(self.zones, results[i * len(self.zones):(i + 1) * len(self.zones)]):
+                result = Detections.from_results(result)
+                x1, y1, _, _ = zone.bounds(image)
+                boxes = result.boxes.xyxy + [x1, y1, x1, y1]
+                centers = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+                inside = zone.contains(centers, frame_size)
+                xyxy.append(boxes[inside])
+                conf.append(result.boxes.conf[inside])
+                cls.append(result.boxes.cls[inside])
+            detections.append(Detections(np.concatenate(xyxy), np.concatenate(conf), np.concatenate(cls), self.names))
+        return detections
@@ -0,0 +1,176 @@
+"""
+Alert delivery check against a local webhook stand-in (http.server on 127.0.0.1): the AlertDispatcher counters and
+the requests the server received are compared with the expected values for the cooldown per (zone, track id), the
+batching, the token bucket rate limit and failing sinks, then the cost of check() on the inference thread is timed.
+Exits with code 1 when a count differs.
+
+    python bench/bench_alerts.py
+    python bench/bench_alerts.py --persons 20 --frames 300
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from alerts import AlertDispatcher, WebhookSink  # noqa: E402
+from association import PPE_CLASSES, PPEAssociation  # noqa: E402
+
+
+class WebhookStandIn:
+    """Local webhook answering 500 to the first `fail_first` requests, recording the alerts of the others."""
+
+    def __init__(self, fail_first=0):
+        self.fail_first = fail_first
+        self.requests = 0
+        self.batches = []
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                with stand_in.lock:
+                    stand_in.requests += 1
+                    failed = stand_in.requests <= stand_in.fail_first
+                    if not failed:
+                        stand_in.batches.append(json.loads(body)['alerts'])
+                self.send_response(500 if failed else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/alerts'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def alerts(self):
+        return sum(len(batch) for batch in self.batches)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def persons(count, protected=0, tracked=True):
+    """PPEAssociation of `count` persons side by side, the first `protected` ones wearing a helmet."""
+    boxes = np.array([[20 + 60 * i, 100, 70 + 60 * i, 300] for i in range(count)], dtype=np.float64)
+    matched = np.zeros((count, len(PPE_CLASSES)), dtype=bool)
+    matched[:protected, PPE_CLASSES.index(4)] = True
+    return PPEAssociation(boxes, np.full(count, 0.9), np.array(PPE_CLASSES), matched,
+                          np.arange(1, count + 1) if tracked else None)
+
+
+def check_cooldown(frame, args):
+    """Tracked persons over `frames` frames at 10 FPS of video time: one alert per track and cooldown period."""
+    server = WebhookStandIn()
+    dispatcher = AlertDispatcher([WebhookSink(server.url)], cooldown=args.cooldown, rate=0, batch_size=args.persons,
+                                 batch_interval=0.1, snapshot_size=64)
+    association = persons(args.persons + 2, protected=2)
+    for index in range(args.frames):
+        dispatcher.check(frame, association, index / 10)
+    dispatcher.close()
+    server.stop()
+    alerts = args.persons * int(np.ceil(args.frames / 10 / args.cooldown))
+    expected = {'alerts': alerts, 'suppressed': args.persons * args.frames - alerts, 'sent': alerts, 'failed': 0,
+                'received': alerts}
+    return expected, {**dispatcher.stats(), 'received': server.alerts()}
+
+
+def check_untracked(frame, args):
+    """Untracked persons (Detect mode) share the cooldown of their zone."""
+    server = WebhookStandIn()
+    dispatcher = AlertDispatcher([WebhookSink(server.url)], cooldown=args.cooldown, rate=0, batch_interval=0.1,
+                                 snapshot_size=0)
+    association = persons(args.persons, tracked=False)
+    for index in range(args.frames):
+        dispatcher.check(frame, association, index / 10)
+    dispatcher.close()
+    server.stop()
+    alerts = int(np.ceil(args.frames / 10 / args.cooldown))
+    expected = {'alerts': alerts, 'suppressed': args.persons * args.frames - alerts, 'sent': alerts,
+                'received': alerts}
+    return expected, {**dispatcher.stats(), 'received': server.alerts()}
+
+
+def check_rate(frame, args):
+    """Token bucket of `rate` batches per minute: a burst of rate + 2 single-alert batches, the last 2 wait."""
+    server = WebhookStandIn()
+    rate = 6
+    dispatcher = AlertDispatcher([WebhookSink(server.url)], cooldown=0, rate=rate, batch_size=1, batch_interval=0,
+                                 snapshot_size=0)
+    association = persons(1)
+    for index in range(rate + 2):
+        dispatcher.check(frame, association, float(index))
+    time.sleep(1.0)
+    before_close = server.requests
+    # close() flushes the alerts waiting for a token
+    dispatcher.close()
+    server.stop()
+    expected = {'alerts': rate + 2, 'batches': rate + 2, 'sent': rate + 2, 'requests within 1 s': rate}
+    return expected, {**dispatcher.stats(), 'requests within 1 s': before_close}
+
+
+def check_failures(frame, args):
+    """A webhook failing twice is retried, a webhook that cannot be reached fails after its retries."""
+    flaky = WebhookStandIn(fail_first=2)
+    # Nothing listens on a port just released by a stand-in
+    dead = WebhookStandIn()
+    dead.stop()
+    dispatcher = AlertDispatcher([WebhookSink(flaky.url), WebhookSink(dead.url, timeout=1.0)], cooldown=0, rate=0,
+                                 batch_size=10, batch_interval=0.1, retries=2, snapshot_size=0)
+    dispatcher.check(frame, persons(3), 0.0)
+    dispatcher.close(timeout=30)
+    flaky.stop()
+    # 2 failed attempts on the flaky webhook, 3 on the dead one
+    expected = {'alerts': 3, 'batches': 1, 'sent': 3, 'failed': 3, 'errors': 5, 'requests': 3, 'received': 3}
+    return expected, {**dispatcher.stats(), 'requests': flaky.requests, 'received': flaky.alerts()}
+
+
+def time_check(frame, args):
+    """Milliseconds of check() on the inference thread, new alerts (snapshot copies) vs cooldown only."""
+    server = WebhookStandIn()
+    dispatcher = AlertDispatcher([WebhookSink(server.url)], cooldown=1e9, rate=0, queue_size=1 << 20)
+    association = persons(args.persons)
+    timings = []
+    # The persons alert on the first frame, then stay in their cooldown
+    for index in range(args.frames):
+        start = time.perf_counter()
+        dispatcher.check(frame, association, float(index))
+        timings.append(time.perf_counter() - start)
+    dispatcher.close()
+    server.stop()
+    return timings[0] * 1000, float(np.median(timings[1:])) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--persons', type=int, default=5, help='persons without PPE per frame')
+    parser.add_argument('--frames', type=int, default=200, help='frames of the cooldown checks, 10 FPS of video time')
+    parser.add_argument('--cooldown', type=float, default=4.0, help='cooldown of the checks in seconds')
+    args = parser.parse_args()
+
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    failures = 0
+    print(f"{'check':>10} {'counter':>20} {'expected':>9} {'got':>9}")
+    for name, check in [('cooldown', check_cooldown), ('untracked', check_untracked), ('rate', check_rate),
+                        ('failures', check_failures)]:
+        expected, got = check(frame, args)
+        for counter, value in expected.items():
+            ok = got.get(counter) == value
+            failures += not ok
+            print(f"{name:>10} {counter:>20} {value:>9} {got.get(counter):>9}{'' if ok else '  MISMATCH'}")
+    first, cooldown = time_check(frame, args)
+    print(f'check() with {args.persons} persons: {first:.3f} ms with new alerts, {cooldown:.3f} ms in cooldown')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
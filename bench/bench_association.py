@@ -0,0 +1,82 @@
+"""
+Per-frame cost of the PPE-to-person association, legacy nested loop vs the vectorized engine.
+
+    python bench/bench_association.py --persons 1 10 50 100 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from association import CLASSES_NAMES, PERSON_CLASS, PPE_CLASSES, associate_ppe  # noqa: E402
+
+
+def synthetic_frame(num_persons, ppe_per_person=4, width=1920, height=1080, seed=0):
+    """Random person boxes with PPE boxes scattered inside them, as (positions, classes, scores)."""
+    rng = np.random.default_rng(seed)
+    w = rng.integers(60, 200, num_persons)
+    h = rng.integers(150, 500, num_persons)
+    x1 = rng.integers(0, width - 200, num_persons)
+    y1 = rng.integers(0, height - 500, num_persons)
+    persons = np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+
+    owner = np.repeat(np.arange(num_persons), ppe_per_person)
+    ppe_cls = rng.choice([0, 1, 2, 3, 4, 6], len(owner))
+    px = persons[owner, 0] + rng.integers(0, 40, len(owner))
+    py = persons[owner, 1] + (rng.random(len(owner)) * h[owner] * 0.8).astype(int)
+    ppe = np.stack([px, py, px + 30, py + 30], axis=1)
+
+    positions = np.concatenate([persons, ppe]).astype(int)
+    classes = np.concatenate([np.full(num_persons, PERSON_CLASS), ppe_cls])
+    scores = rng.uniform(0.4, 1.0, len(classes))
+    return positions, classes, scores
+
+
+def legacy_association(positions, classes, scores):
+    """The nested loop formerly used by Detection.ppe_inspection."""
+    valid_indices = np.where(scores > 0.5)[0]
+    positions, classes = positions[valid_indices], classes[valid_indices]
+    person_indices = np.where(classes == PERSON_CLASS)[0]
+    ppe_status = {}
+    for person_box in positions[person_indices]:
+        classes_overlap = []
+        for i, other_box in enumerate(positions):
+            if i not in person_indices and not (person_box[2] < other_box[0] or person_box[0] > other_box[2] or
+                                                person_box[3] < other_box[1] or person_box[1] > other_box[3]):
+                classes_overlap.append(classes[i])
+        classes_overlap = np.unique(classes_overlap)
+        ppe_status[tuple(person_box)] = {CLASSES_NAMES[cls].title(): (cls in classes_overlap) for cls in PPE_CLASSES}
+    return ppe_status
+
+
+def time_per_call(func, args, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--persons', type=int, nargs='+', default=[1, 5, 10, 25, 50, 100, 200])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'persons':>8} {'detections':>11} {'legacy ms':>10} {'vector ms':>10} {'speed-up':>9}")
+    for num_persons in args.persons:
+        frame = synthetic_frame(num_persons)
+        # Both implementations must agree before being compared
+        expected = legacy_association(*frame)
+        assert dict(associate_ppe(*frame).items()) == expected
+
+        legacy = time_per_call(legacy_association, frame, args.repeat)
+        vector = time_per_call(associate_ppe, frame, args.repeat)
+        print(f'{num_persons:>8} {len(frame[1]):>11} {legacy * 1e3:>10.3f} {vector * 1e3:>10.3f} '
+              f'{legacy / vector:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
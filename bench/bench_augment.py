@@ -0,0 +1,71 @@
+"""
+Dataset augmentation cost: the per-pixel salt-and-pepper loop of the notebook vs the vectorized transform, and the
+augmentation of a synthetic image folder in one process vs on a process pool.
+
+    python bench/bench_augment.py --size 1920x1080 --images 200 --workers 0 4 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from augment import add_salt_and_pepper_noise, augment_dataset  # noqa: E402
+
+
+def legacy_salt_and_pepper_noise(image, salt_prob=0.01, pepper_prob=0.05):
+    """The loop formerly used by the notebook."""
+    noisy_image = np.copy(image)
+    for _ in range(int(salt_prob * image.size)):
+        noisy_image[np.random.randint(0, image.shape[0]), np.random.randint(0, image.shape[1])] = 255
+    for _ in range(int(pepper_prob * image.size)):
+        noisy_image[np.random.randint(0, image.shape[0]), np.random.randint(0, image.shape[1])] = 0
+    return noisy_image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='1920x1080', help='image size, WIDTHxHEIGHT')
+    parser.add_argument('--probabilities', type=float, nargs='+', default=[0.01, 0.05])
+    parser.add_argument('--images', type=int, default=100, help='images of the synthetic folder')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 4])
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.lower().split('x'))
+    image = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    rng = np.random.default_rng(0)
+
+    print(f"{'noise prob':>10} {'legacy ms':>10} {'vector ms':>10} {'speed-up':>9}")
+    for probability in args.probabilities:
+        start = time.perf_counter()
+        legacy_salt_and_pepper_noise(image, probability, probability)
+        legacy = time.perf_counter() - start
+        start = time.perf_counter()
+        add_salt_and_pepper_noise(image, rng, probability, probability)
+        vector = time.perf_counter() - start
+        print(f'{probability:>10} {legacy * 1e3:>10.1f} {vector * 1e3:>10.2f} {legacy / vector:>8.0f}x')
+
+    directory = tempfile.mkdtemp()
+    try:
+        images_dir = os.path.join(directory, 'images')
+        os.makedirs(images_dir)
+        for i in range(args.images):
+            cv.imwrite(os.path.join(images_dir, f'image{i}.jpg'), image)
+        print(f"\n{'workers':>7} {'images/s':>9}")
+        for workers in args.workers:
+            output_dir = os.path.join(directory, f'output{workers}', 'images')
+            start = time.perf_counter()
+            augment_dataset(images_dir, output_dir, probabilities={'grayscale': 0.25, 'binarize': 0.25,
+                                                                   'noise': 0.25, 'rotate': 0.25}, workers=workers)
+            print(f'{workers:>7} {args.images / (time.perf_counter() - start):>9.1f}')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Latency, throughput and mAP of the detector on each inference backend (PyTorch, ONNX Runtime, OpenVINO, FP32 and
+INT8), on the same video clips and the data.yaml validation split. The exports are created on the first run.
+
+    python bench/bench_backends.py --clips site1.mp4 site2.mp4 --variants torch onnx onnx-int8 openvino openvino-int8
+    python bench/bench_backends.py --clips site1.mp4 --no-map --json backends.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from backends import DATA_PATH, load_detector  # noqa: E402
+from detect import MODEL_PATH  # noqa: E402
+
+VARIANTS = ['torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8']
+
+
+def read_clips(paths, frames_per_clip):
+    frames = []
+    for path in paths:
+        cap = cv.VideoCapture(path)
+        if not cap.isOpened():
+            raise IOError(f'Error opening video file {path}')
+        for _ in range(frames_per_clip):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        raise IOError('No frame could be read from the clips')
+    return frames
+
+
+def measure(model, frames, batch_size, warmup=5):
+    """Per-frame latency (batch of 1) and batched throughput of `model` on `frames`."""
+    for frame in frames[:warmup]:
+        model(frame, verbose=False)
+
+    latencies = []
+    for frame in frames:
+        start = time.perf_counter()
+        model(frame, verbose=False)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(frames), batch_size):
+        model(frames[i:i + batch_size], verbose=False)
+    throughput = len(frames) / (time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    return {'latency_ms': round(float(latencies.mean()), 2), 'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+            'throughput_fps': round(throughput, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--weights', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI',
+                                                           MODEL_PATH))
+    parser.add_argument('--clips', nargs='+', required=True, help='video files, the same for every backend')
+    parser.add_argument('--frames', type=int, default=100, help='frames read from every clip')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=VARIANTS)
+    parser.add_argument('--batch-size', type=int, default=8, help='batch size of the throughput run')
+    parser.add_argument('--data', default=DATA_PATH, help='dataset configuration of the mAP and INT8 calibration')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--no-map', action='store_true', help='skip the mAP evaluation on the validation split')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    frames = read_clips(args.clips, args.frames)
+    results = {}
+    print(f"{'variant':>14} {'latency ms':>11} {'p95 ms':>8} {'throughput':>11} {'mAP50':>7} {'mAP50-95':>9}")
+    for variant in args.variants:
+        backend, _, precision = variant.partition('-')
+        model = load_detector(args.weights, backend, int8=precision == 'int8', data_path=args.data, imgsz=args.imgsz)
+        result = measure(model, frames, args.batch_size)
+        if not args.no_map:
+            metrics = model.val(data=args.data, imgsz=args.imgsz, batch=1, plots=False, verbose=False)
+            result.update({'map50': round(float(metrics.box.map50), 4), 'map50_95': round(float(metrics.box.map), 4)})
+        results[variant] = result
+        print(f"{variant:>14} {result['latency_ms']:>11.2f} {result['p95_ms']:>8.2f} "
+              f"{result['throughput_fps']:>10.1f}  {result.get('map50', float('nan')):>6.3f} "
+              f"{result.get('map50_95', float('nan')):>9.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'frames': len(frames), 'batch_size': args.batch_size, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
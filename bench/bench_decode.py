@@ -0,0 +1,122 @@
+"""
+Video decoding throughput and memory: cv.VideoCapture (with and without resizing the frames afterwards) vs the
+decoders of decoding.open_video (OpenCV and PyAV, prefetched into a ring of preallocated frames), at the source size
+and scaled at decode time. Every configuration runs in its own process, which reports its decoded FPS and peak
+resident memory. Synthetic 1080p and 4K clips are written to a temporary folder unless --clips is given.
+
+    python bench/bench_decode.py --sizes 1920x1080 3840x2160 --frames 150 --decode-size 1280
+    python bench/bench_decode.py --clips site_1080p.mp4 site_4k.mp4 --decoders opencv pyav
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from decoding import open_video  # noqa: E402
+
+
+def size_arg(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def write_clip(path, size, frames, fps=25):
+    """Clip of textured blocks moving over a noisy background, so the encoder has real work to do."""
+    width, height = size
+    rng = np.random.default_rng(0)
+    background = cv.resize(rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8), size)
+    block = rng.integers(0, 256, (height // 4, width // 8, 3), dtype=np.uint8)
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(frames):
+        frame = background.copy()
+        for j in range(3):
+            x = (i * 12 + j * width // 3) % (width - block.shape[1])
+            y = (j * height // 3 + i * 4) % (height - block.shape[0])
+            frame[y:y + block.shape[0], x:x + block.shape[1]] = block
+        writer.write(frame)
+    writer.release()
+
+
+def run_config(path, config, decode_size, max_frames):
+    """Decode `path` with `config` in this process, return the FPS, frames, frame size and peak RSS."""
+    if config in ('capture', 'capture_resize'):
+        cap = cv.VideoCapture(path)
+    else:
+        cap = open_video(path, config, max_size=decode_size, prefetch=4)
+    if not cap.isOpened():
+        raise IOError(f'Error opening video file {path}')
+    resized = None
+    frames = 0
+    shape = None
+    start = time.perf_counter()
+    while frames < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if config == 'capture_resize' and decode_size:
+            height, width = frame.shape[:2]
+            scale = decode_size / max(width, height)
+            resized = cv.resize(frame, (int(width * scale), int(height * scale)), resized)
+            frame = resized
+        shape = frame.shape
+        frames += 1
+    elapsed = time.perf_counter() - start
+    cap.release()
+    # ru_maxrss is in KB on Linux
+    return {'fps': frames / elapsed, 'frames': frames, 'shape': shape,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', nargs='+', help='video files, synthetic clips of --sizes by default')
+    parser.add_argument('--sizes', type=size_arg, nargs='+', default=[(1920, 1080), (3840, 2160)],
+                        help='synthetic clip sizes, WIDTHxHEIGHT')
+    parser.add_argument('--frames', type=int, default=150, help='frames decoded per configuration')
+    parser.add_argument('--decode-size', type=int, default=1280, help='longest side of the scaled frames')
+    parser.add_argument('--decoders', nargs='+', choices=['opencv', 'pyav'], default=['opencv', 'pyav'])
+    # Internal: run one configuration in a child process
+    parser.add_argument('--run', nargs=3, metavar=('PATH', 'CONFIG', 'DECODE_SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        path, config, decode_size = args.run
+        print(json.dumps(run_config(path, config, int(decode_size), args.frames)))
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        clips = args.clips
+        if not clips:
+            clips = []
+            for width, height in args.sizes:
+                clips.append(os.path.join(folder, f'{width}x{height}.mp4'))
+                write_clip(clips[-1], (width, height), args.frames)
+
+        configs = [('capture', 0), ('capture_resize', args.decode_size)]
+        for decoder in args.decoders:
+            configs += [(decoder, 0), (decoder, args.decode_size)]
+        print(f"{'clip':>16} {'decoder':>15} {'decode size':>12} {'output':>10} {'FPS':>8} {'peak RSS MB':>12}")
+        for clip in clips:
+            for config, decode_size in configs:
+                process = subprocess.run([sys.executable, os.path.abspath(__file__), '--frames', str(args.frames),
+                                          '--run', clip, config, str(decode_size)], capture_output=True, text=True)
+                if process.returncode:
+                    error = process.stderr.strip().splitlines()[-1:] or ['failed']
+                    print(f'{os.path.basename(clip):>16} {config:>15} {decode_size or "-":>12} {error[0]}')
+                    continue
+                result = json.loads(process.stdout)
+                height, width = result['shape'][:2]
+                print(f'{os.path.basename(clip):>16} {config:>15} {decode_size or "-":>12} '
+                      f"{f'{width}x{height}':>10} {result['fps']:>8.1f} {result['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Per-frame cost of displaying a video frame on a QLabel, former path (convert full frame, QPixmap, scale) vs the
+FrameDisplay adapter (resize, convert into a reused buffer, QImage over the buffer). Runs without a screen:
+
+    QT_QPA_PLATFORM=offscreen python bench/bench_display.py --frame 1920x1080 1280x720 --label 960x540 640x360
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtWidgets import QApplication, QLabel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from display import FrameDisplay  # noqa: E402
+
+
+def former_show(frame, label):
+    """The display path formerly used by Detection.show_frame."""
+    frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+    q_image = QImage(frame.data, frame.shape[1], frame.shape[0], frame.shape[1] * 3, QImage.Format_RGB888)
+    pixmap = QPixmap.fromImage(q_image)
+    label.setPixmap(pixmap.scaled(label.size(), Qt.KeepAspectRatio))
+
+
+def size_arg(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def time_per_frame(show, frames, label, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        show(frames[i % len(frames)], label)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frame', type=size_arg, nargs='+', default=[(1920, 1080), (1280, 720)],
+                        help='frame sizes, WIDTHxHEIGHT')
+    parser.add_argument('--label', type=size_arg, nargs='+', default=[(960, 540), (640, 360)],
+                        help='label sizes, WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841
+    rng = np.random.default_rng(0)
+    label = QLabel()
+
+    print(f"{'frame':>10} {'label':>10} {'former ms':>10} {'adapter ms':>11} {'speed-up':>9}")
+    for frame_width, frame_height in args.frame:
+        frames = [rng.integers(0, 256, (frame_height, frame_width, 3), dtype=np.uint8) for _ in range(4)]
+        for label_width, label_height in args.label:
+            label.resize(label_width, label_height)
+            display = FrameDisplay()
+            # Warm up both paths (allocations, pixmap cache) before timing
+            former_show(frames[0], label)
+            display.show(frames[0], label)
+
+            former = time_per_frame(former_show, frames, label, args.repeat)
+            adapter = time_per_frame(display.show, frames, label, args.repeat)
+            print(f"{f'{frame_width}x{frame_height}':>10} {f'{label_width}x{label_height}':>10} "
+                  f'{former * 1e3:>10.3f} {adapter * 1e3:>11.3f} {former / adapter:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Cost of sending frames to an inference worker process and getting their detections back: frames pickled through a
+ProcessPoolExecutor (the former MultiCameraMonitor workers) vs the shared memory framebus.FrameBus, where only slot
+indices and shapes are pickled. The worker model returns fixed detections at once, so only the transport is measured.
+
+    python bench/bench_framebus.py --sizes 1280x720 1920x1080 3840x2160 --frames 200 --batch-size 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from detections import Detections  # noqa: E402
+from framebus import FrameBus  # noqa: E402
+from multicam import _infer_in_worker, _infer_shared_in_worker, _init_worker  # noqa: E402
+
+
+class InstantModel:
+    """Model answering two detections per image without any computation."""
+    names = {0: 'boots', 1: 'helmet', 2: 'vest', 3: 'gloves', 4: 'glasses', 5: 'person', 6: 'mask'}
+
+    def __call__(self, images, **kwargs):
+        return [Detections([[100, 100, 300, 600], [150, 100, 250, 180]], [0.9, 0.8], [5, 1], self.names)
+                for _ in images]
+
+
+def size_arg(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def run(frames, batch_size, count, in_flight, bus):
+    """Frames per second through one worker process, keeping `in_flight` batches submitted."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context, initializer=_init_worker,
+                             initargs=(InstantModel, bus.spec() if bus else None)) as pool:
+        # Start the worker before timing
+        pool.submit(_infer_in_worker, frames[:1]).result()
+        pending = []
+        start = time.perf_counter()
+        for i in range(0, count, batch_size):
+            batch = [frames[(i + j) % len(frames)] for j in range(batch_size)]
+            if bus is None:
+                pending.append((pool.submit(_infer_in_worker, batch), []))
+            else:
+                slots = [bus.acquire() for _ in batch]
+                shapes = [bus.write_frame(slot, frame) for slot, frame in zip(slots, batch)]
+                pending.append((pool.submit(_infer_shared_in_worker, list(zip(slots, shapes))), slots))
+            while len(pending) >= in_flight or (pending and i + batch_size >= count):
+                future, slots = pending.pop(0)
+                results = future.result()
+                if slots:
+                    counts, names = results
+                    results = [bus.read_detections(slot, n, names) for slot, n in zip(slots, counts)]
+                    for slot in slots:
+                        bus.release(slot)
+        return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=size_arg, nargs='+', default=[(1280, 720), (1920, 1080), (3840, 2160)],
+                        help='frame sizes, WIDTHxHEIGHT')
+    parser.add_argument('--frames', type=int, default=200, help='frames sent per run')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--in-flight', type=int, default=2, help='batches submitted ahead')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'frame':>10} {'pickled fps':>12} {'shared fps':>11} {'pickled ms':>11} {'shared ms':>10} "
+          f"{'speed-up':>9}")
+    for width, height in args.sizes:
+        frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+        pickled = run(frames, args.batch_size, args.frames, args.in_flight, None)
+        bus = FrameBus(args.in_flight * args.batch_size, width * height * 3)
+        try:
+            shared = run(frames, args.batch_size, args.frames, args.in_flight, bus)
+        finally:
+            bus.close()
+        print(f"{f'{width}x{height}':>10} {pickled:>12.1f} {shared:>11.1f} {1e3 / pickled:>11.2f} "
+              f'{1e3 / shared:>10.2f} {shared / pickled:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
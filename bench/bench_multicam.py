@@ -0,0 +1,143 @@
+"""
+Multi-camera throughput: independent per-camera pipelines sharing one model vs the MultiCameraMonitor batching
+frames across cameras, in-process, with worker processes and with consumer processes running the modes. Synthetic
+local video files stand in for RTSP cameras and are decoded at their FPS; the synthetic model costs a fixed latency
+per call plus a smaller cost per image, like a GPU, and one model instance runs one call at a time.
+
+    python bench/bench_multicam.py --cameras 4 8 16 --fps 15 --seconds 10 --workers 0 2
+    python bench/bench_multicam.py --cameras 8 --workers 2 --consumers 0 2 --mode Tracking
+"""
+import argparse
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from detections import Detections  # noqa: E402
+from engine import build_mode  # noqa: E402
+from multicam import MultiCameraMonitor  # noqa: E402
+from pipeline import VideoPipeline  # noqa: E402
+
+
+class SyntheticModel:
+    """Model with the cost of `call_ms` per call plus `image_ms` per image, returning one person and one helmet."""
+
+    def __init__(self, call_ms=20.0, image_ms=3.0):
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+        self.names = {0: 'boots', 1: 'helmet', 2: 'vest', 3: 'gloves', 4: 'glasses', 5: 'person', 6: 'mask'}
+        self.lock = threading.Lock()
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        with self.lock:
+            time.sleep((self.call_ms + self.image_ms * len(images)) / 1000)
+        return [Detections([[100, 100, 300, 600], [150, 100, 250, 180]], [0.9, 0.8], [5, 1], self.names)
+                for _ in images]
+
+
+def write_video(path, frames, fps, size=(640, 360), seed=0):
+    """Video file with a moving block on a noisy background."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(frames):
+        frame = background.copy()
+        x = (i * 5) % (size[0] - 80)
+        frame[100:260, x:x + 80] = (0, 200, 255)
+        writer.write(frame)
+    writer.release()
+
+
+def measure(read_counts, warmup, seconds):
+    """Per-camera (processed, dropped) frame counts over `seconds`, after `warmup` seconds."""
+    time.sleep(warmup)
+    start = read_counts()
+    time.sleep(seconds)
+    end = read_counts()
+    processed = [b[0] - a[0] for a, b in zip(start, end)]
+    return processed, sum(b[1] - a[1] for a, b in zip(start, end))
+
+
+def run_independent(model, paths, mode, warmup, seconds):
+    """One VideoPipeline per camera, all calling the same model one frame at a time."""
+    pipelines = [VideoPipeline(cv.VideoCapture(path), build_mode(model, mode), queue_size=2,
+                               drop_policy='drop_oldest') for path in paths]
+    for pipeline in pipelines:
+        pipeline.start()
+
+    def read_counts():
+        return [(pipeline.counters['inference'].frames, pipeline.counters['decode'].dropped)
+                for pipeline in pipelines]
+
+    processed, dropped = measure(read_counts, warmup, seconds)
+    for pipeline in pipelines:
+        pipeline.stop()
+    return processed, dropped, 1.0
+
+
+def run_monitor(model, paths, mode, warmup, seconds, batch_size, workers, factory, consumers=0):
+    monitor = MultiCameraMonitor(model if workers == 0 else None, paths, mode, batch_size=batch_size,
+                                 workers=workers, model_factory=factory, consumers=consumers)
+    monitor.start()
+
+    def read_counts():
+        return [(camera.process_counter.frames, camera.decode_counter.dropped) for camera in monitor.cameras]
+
+    processed, dropped = measure(read_counts, warmup, seconds)
+    batch = monitor.stats()['inference']['batch']
+    monitor.stop()
+    return processed, dropped, batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--fps', type=float, default=15, help='FPS of the synthetic cameras')
+    parser.add_argument('--seconds', type=float, default=10, help='measured duration of every run')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds before measuring (worker start-up)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2],
+                        help='worker process counts of the monitor runs, 0 runs the model in-process')
+    parser.add_argument('--consumers', type=int, nargs='+', default=[0],
+                        help='consumer process counts of the monitor runs with workers, 0 runs the modes in-process')
+    parser.add_argument('--call-ms', type=float, default=20.0, help='synthetic model cost per call')
+    parser.add_argument('--image-ms', type=float, default=3.0, help='synthetic model cost per image')
+    parser.add_argument('--mode', default='Detect')
+    args = parser.parse_args()
+
+    factory = functools.partial(SyntheticModel, args.call_ms, args.image_ms)
+    with tempfile.TemporaryDirectory() as directory:
+        frames = int(args.fps * (args.warmup + args.seconds + 5))
+        max_cameras = max(args.cameras)
+        paths = [os.path.join(directory, f'camera{i}.mp4') for i in range(max_cameras)]
+        for i, path in enumerate(paths):
+            write_video(path, frames, args.fps, seed=i)
+
+        print(f"{'cameras':>7} {'run':>30} {'total fps':>10} {'min cam fps':>12} {'max cam fps':>12} "
+              f"{'dropped':>8} {'batch':>6}")
+        for count in args.cameras:
+            runs = [('independent', lambda: run_independent(factory(), paths[:count], args.mode, args.warmup,
+                                                            args.seconds))]
+            for workers in args.workers:
+                for consumers in args.consumers if workers else [0]:
+                    name = f'monitor, {workers} workers' + (f', {consumers} consumers' if consumers else '')
+                    runs.append((name, lambda workers=workers, consumers=consumers: run_monitor(
+                        factory(), paths[:count], args.mode, args.warmup, args.seconds, args.batch_size, workers,
+                        factory, consumers)))
+            for name, run in runs:
+                processed, dropped, batch = run()
+                print(f'{count:>7} {name:>30} {sum(processed) / args.seconds:>10.1f} '
+                      f'{min(processed) / args.seconds:>12.1f} {max(processed) / args.seconds:>12.1f} '
+                      f'{dropped:>8} {batch:>6.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Reproducible benchmark suite of the detection pipeline, on synthetic videos and synthetic detections (no dataset or
+weights needed): frames/sec of every mode through the VideoPipeline, ppe_inspection scaling with the crowd size,
+Show_Status_and_Alert drawing cost and result sink write cost. The results are written as JSON, flat metric names
+to values, so two commits can be compared:
+
+    python bench/bench_suite.py --json baseline.json
+    python bench/bench_suite.py --json current.json --compare baseline.json --tolerance 0.15
+
+With --compare, the metrics worse than the baseline by more than the tolerance are listed and the exit code is 1.
+Metrics ending in '_fps' or '_per_s' are better higher, '_ms' better lower.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from bench_association import synthetic_frame  # noqa: E402
+from bench_multicam import write_video  # noqa: E402
+from detections import Detections  # noqa: E402
+from engine import MODES, Show_Status_and_Alert, build_mode, ppe_inspection  # noqa: E402
+from render import Renderer  # noqa: E402
+from pipeline import VideoPipeline  # noqa: E402
+from profiling import FrameProfiler  # noqa: E402
+from sinks import SINKS, create_sink  # noqa: E402
+
+SUITES = ('modes', 'ppe_inspection', 'drawing', 'sinks')
+
+
+class ReplayModel:
+    """Model replaying synthetic detections of `persons` persons, optionally costing `model_ms` per call."""
+
+    def __init__(self, persons=10, model_ms=0.0, frame_size=(1280, 720), variants=16):
+        self.model_ms = model_ms
+        self.names = Detections(np.empty((0, 4)), [], []).names
+        self.detections = [Detections(positions, scores, classes, self.names) for positions, classes, scores in
+                           (synthetic_frame(persons, width=frame_size[0], height=frame_size[1], seed=seed)
+                            for seed in range(variants))]
+        self.calls = 0
+
+    def __call__(self, images, **kwargs):
+        if not isinstance(images, list):
+            images = [images]
+        if self.model_ms:
+            time.sleep(self.model_ms / 1000)
+        results = []
+        for _ in images:
+            results.append(self.detections[self.calls % len(self.detections)])
+            self.calls += 1
+        return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def median_time(func, repeat):
+    """Median duration of `func()` in seconds over `repeat` calls, after one warm-up call."""
+    func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations))
+
+
+def bench_modes(video_path, frames, persons, model_ms, directory):
+    """Frames/sec and median stage latencies of every mode, decoding as fast as possible."""
+    metrics = {}
+    for name in MODES:
+        options = {'result_path': os.path.join(directory, 'tracking.csv')} if name == 'Tracking' else {}
+        mode = build_mode(ReplayModel(persons, model_ms), name, **options)
+        profiler = FrameProfiler()
+        pipeline = VideoPipeline(cv.VideoCapture(video_path), mode, realtime=False, profiler=profiler)
+        start = time.perf_counter()
+        pipeline.start()
+        pipeline.wait()
+        elapsed = time.perf_counter() - start
+        metrics[f'modes/{name}/throughput_fps'] = round(frames / elapsed, 1)
+        for stage, values in profiler.summary().items():
+            metrics[f'modes/{name}/{stage}_p50_ms'] = values['p50_ms']
+    return metrics
+
+
+def bench_ppe_inspection(crowds, repeat):
+    metrics = {}
+    for persons in crowds:
+        positions, classes, scores = synthetic_frame(persons)
+        detections = Detections(positions, scores, classes)
+        metrics[f'ppe_inspection/{persons}_persons_ms'] = round(median_time(lambda: ppe_inspection(detections),
+                                                                            repeat) * 1000, 4)
+    return metrics
+
+
+def bench_drawing(crowds, repeat):
+    metrics = {}
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    for persons in crowds:
+        positions, classes, scores = synthetic_frame(persons)
+        status = ppe_inspection(Detections(positions, scores, classes))
+        metrics[f'drawing/{persons}_persons_ms'] = round(median_time(
+            lambda: Show_Status_and_Alert(frame, status, 0, 0, renderer=Renderer()), repeat) * 1000, 4)
+    return metrics
+
+
+def bench_sinks(rows, directory):
+    """Rows/sec of every result sink writing Tracking-mode rows, closed (flushed to disk) at the end."""
+    metrics = {}
+    row = {'Date time': 'May 20, 2024 14:00:00', 'Number of workers': 5, 'State': 'Normal'}
+    for extension in SINKS:
+        path = os.path.join(directory, f'sink{extension}')
+        try:
+            sink = create_sink(path, overwrite=True)
+        except ImportError:
+            # Optional dependency (pyarrow) not installed
+            continue
+        start = time.perf_counter()
+        for _ in range(rows):
+            sink.write(row)
+        sink.close()
+        metrics[f'sinks/{extension[1:]}_rows_per_s'] = round(rows / (time.perf_counter() - start))
+    return metrics
+
+
+def compare(current, baseline, tolerance):
+    """Return the (metric, baseline, current, change) regressions larger than `tolerance` (a fraction)."""
+    regressions = []
+    for name, value in current.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        change = (value - reference) / reference
+        higher_is_better = name.endswith(('_fps', '_per_s'))
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append((name, reference, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--frames', type=int, default=300, help='frames of the synthetic video of the mode runs')
+    parser.add_argument('--size', default='1280x720', help='synthetic video size, WIDTHxHEIGHT')
+    parser.add_argument('--persons', type=int, default=10, help='persons per frame in the mode runs')
+    parser.add_argument('--model-ms', type=float, default=0.0,
+                        help='synthetic model cost per call, 0 measures the pipeline and post-processing only')
+    parser.add_argument('--crowds', type=int, nargs='+', default=[1, 10, 50, 100, 200],
+                        help='persons per frame of the ppe_inspection and drawing runs')
+    parser.add_argument('--rows', type=int, default=20000, help='rows written to every result sink')
+    parser.add_argument('--repeat', type=int, default=50, help='calls per measure, the median is kept')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of the baseline commit')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative slow-down of --compare')
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.lower().split('x'))
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        if 'modes' in args.suites:
+            video_path = os.path.join(directory, 'synthetic.mp4')
+            write_video(video_path, args.frames, 30, size=(width, height))
+            metrics.update(bench_modes(video_path, args.frames, args.persons, args.model_ms, directory))
+        if 'ppe_inspection' in args.suites:
+            metrics.update(bench_ppe_inspection(args.crowds, args.repeat))
+        if 'drawing' in args.suites:
+            metrics.update(bench_drawing(args.crowds, args.repeat))
+        if 'sinks' in args.suites:
+            metrics.update(bench_sinks(args.rows, directory))
+
+    results = {'meta': {'commit': git_commit(), 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                        'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv.__version__,
+                        'machine': platform.machine(), 'processor': platform.processor(),
+                        'args': {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}},
+               'metrics': metrics}
+    for name, value in metrics.items():
+        print(f'{name:<45} {value:>12}')
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(metrics, baseline['metrics'], args.tolerance)
+        print(f"\nCompared with {args.compare} (commit {baseline['meta'].get('commit')}): "
+              f'{len(regressions)} regression(s) above {args.tolerance:.0%}')
+        for name, reference, value, change in regressions:
+            print(f'{name:<45} {reference:>12} -> {value:<12} {change:+.1%}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
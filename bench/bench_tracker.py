@@ -0,0 +1,58 @@
+"""
+Per-frame cost of WorkerTracker.update as the number of tracked persons grows, on synthetic persons walking across
+a 1080p frame with randomly missed detections.
+
+    python bench/bench_tracker.py --tracks 1 10 50 100 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'UI'))
+from association import PPE_CLASSES  # noqa: E402
+from tracker import WorkerTracker  # noqa: E402
+
+
+def synthetic_sequence(num_tracks, num_frames, miss_rate=0.1, width=1920, height=1080, seed=0):
+    """Yield (boxes, scores, ppe) per frame for persons moving with constant velocity."""
+    rng = np.random.default_rng(seed)
+    position = rng.uniform([0, 0], [width - 100, height - 300], (num_tracks, 2))
+    velocity = rng.uniform(-4, 4, (num_tracks, 2))
+    size = rng.uniform([50, 150], [100, 300], (num_tracks, 2))
+    ppe = rng.random((num_tracks, len(PPE_CLASSES))) > 0.5
+    bounds = np.array([width - 100, height - 300])
+    for _ in range(num_frames):
+        position += velocity
+        # Bounce on the frame borders
+        outside = (position < 0) | (position > bounds)
+        velocity[outside] *= -1
+        position = np.clip(position, 0, bounds)
+        visible = rng.random(num_tracks) > miss_rate
+        jitter = rng.normal(0, 2, (num_tracks, 4))
+        boxes = np.concatenate([position, position + size], axis=1) + jitter
+        yield boxes[visible], rng.uniform(0.5, 1.0, visible.sum()), ppe[visible]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, nargs='+', default=[1, 5, 10, 25, 50, 100, 200])
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'tracks':>7} {'ms/frame':>9} {'confirmed':>10} {'ids used':>9}")
+    for num_tracks in args.tracks:
+        tracker = WorkerTracker()
+        frames = list(synthetic_sequence(num_tracks, args.frames))
+        start = time.perf_counter()
+        for boxes, scores, ppe in frames:
+            tracks = tracker.update(boxes, scores, ppe)
+        elapsed = (time.perf_counter() - start) / args.frames
+        # 'ids used' close to 'tracks' means identities were kept despite the missed detections
+        print(f'{num_tracks:>7} {elapsed * 1e3:>9.3f} {len(tracks):>10} {tracker.next_id - 1:>9}')
+
+
+if __name__ == '__main__':
+    main()